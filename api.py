@@ -1,19 +1,56 @@
-from flask import Flask, request, jsonify
+import time
+# Start of the API's import, the startup time is measured from here
+STARTED = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from database import CovidDatabase, UserDatabase
-import pandas as pd
+from database import get_covid_database, UserDatabase, to_day_number, GRANULARITIES, CASE_METRICS
+from rollup_scheduler import RollupScheduler
+from storage import CHANGE_PAGE_ROWS, COUNTRY_PAGE_ROWS, COUNTRY_SORTS, EXPORT_PAGE_ROWS, SNAPSHOT_DIR
+from countries import canonicalize_country, get_iso3
+from comparison import MAX_COMPARE_COUNTRIES, compare_series, series_to_json
+from datetime import date
+import queue
+from login_limiter import LoginRateLimited
+import export
+import live_updates
+import query_stats
+import telemetry
+import tracing
 
 app = Flask(__name__)
 CORS(app)
+# Per-route request counters, latency/size histograms and in-flight gauges
+telemetry.instrument_app(app)
 
 # Initialize databases
-covid_db = CovidDatabase()
+covid_db = get_covid_database()
 user_db = UserDatabase()
 
+# Correlation IDs, Server-Timing and sampled trace files while tracing is enabled
+tracing.instrument_app(app, covid=covid_db, auth=user_db)
+
+# One poller of the change feed fans new cases out to every /api/stream client
+broadcaster = live_updates.get_broadcaster(covid_db)
+
+# Keep the weekly/monthly rollups and the Arrow snapshot current in the background
+rollup_scheduler = RollupScheduler(covid_db, snapshot_dir=SNAPSHOT_DIR).start()
+
+# Import to ready, the SQLite databases are only opened (and their schema checked) on first use
+STARTUP_SECONDS = time.perf_counter() - STARTED
+
+def get_granularity():
+    """Read the granularity query parameter, None if it is invalid"""
+    granularity = request.args.get('granularity', 'day')
+    return granularity if granularity in GRANULARITIES else None
+
+GRANULARITY_ERROR = {'error': f"granularity must be one of {', '.join(GRANULARITIES)}"}
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """API health check"""
-    return jsonify({'status': 'healthy', 'message': 'COVID-19 API is running'})
+    return jsonify({'status': 'healthy', 'message': 'COVID-19 API is running',
+                    'startup_ms': round(STARTUP_SECONDS * 1000, 1)})
 
 # Authentication endpoints
 @app.route('/api/register', methods=['POST'])
@@ -43,22 +80,117 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'message': 'Missing credentials'}), 400
         
-        success, message = user_db.authenticate_user(username, password)
+        try:
+            success, message, role = user_db.authenticate_user(username, password, request.remote_addr)
+        except LoginRateLimited as e:
+            retry_after = max(1, int(e.retry_after + 0.999))
+            response = jsonify({'success': False, 'message': str(e), 'retry_after': retry_after})
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        
         return jsonify({
             'success': success, 
             'message': message, 
-            'username': username if success else None
+            'username': username if success else None,
+            'role': role
         }), 200 if success else 401
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
+@app.route('/api/login-stats', methods=['GET'])
+def get_login_stats():
+    """Login rate limiter counters"""
+    try:
+        return jsonify(user_db.limiter.get_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, cache, bcrypt and database metrics in the Prometheus text format"""
+    limiter = user_db.limiter.get_stats()
+    extra = [
+        ('api_startup_seconds', 'gauge', 'Time from importing api.py to serving', STARTUP_SECONDS),
+        ('covid_data_version', 'gauge', 'Data version of the case database', covid_db.get_data_version()),
+        ('rollup_refresh_runs_total', 'counter', 'Background rollup refreshes', rollup_scheduler.runs),
+        ('live_subscribers', 'gauge', 'Open /api/stream connections', broadcaster.subscriber_count()),
+        ('live_events_total', 'counter', 'Case change events pushed to subscribers', broadcaster.events),
+        ('login_attempts_total', 'counter', 'Login attempts seen by the rate limiter', limiter['attempts']),
+        ('login_rejected_total', 'counter', 'Login attempts rejected by the rate limiter', limiter['rejected']),
+        ('login_locked_usernames', 'gauge', 'Usernames currently locked out', limiter['locked_usernames'])
+    ]
+    return Response(telemetry.render(extra), mimetype='text/plain; version=0.0.4')
+
+QUERY_STATS_SORTS = ('total_ms', 'count', 'mean_ms', 'max_ms', 'p95_ms', 'rows')
+
+@app.route('/api/query-stats', methods=['GET'])
+def get_query_stats():
+    """Per-statement database timings and the recent slow queries"""
+    try:
+        sort = request.args.get('sort', 'total_ms')
+        if sort not in QUERY_STATS_SORTS:
+            return jsonify({'error': f"sort must be one of {', '.join(QUERY_STATS_SORTS)}"}), 400
+        limit = int(request.args.get('limit', 50))
+        return jsonify({
+            'enabled': query_stats.ENABLED,
+            'slow_query_ms': query_stats.SLOW_QUERY_MS,
+            'queries': query_stats.get_query_stats(limit, sort),
+            'slow_queries': query_stats.get_slow_queries()
+        })
+    except ValueError:
+        return jsonify({'error': 'Invalid limit parameter'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tracing', methods=['GET', 'POST'])
+def tracing_settings():
+    """Tracing status; POST {"enabled", "sample_rate", "trace_file"} from localhost toggles it"""
+    if request.method == 'GET':
+        return jsonify(tracing.get_status())
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({'error': 'Tracing can only be changed from localhost'}), 403
+    try:
+        data = request.get_json(silent=True) or {}
+        if data.get('enabled', True):
+            tracing.enable(data.get('sample_rate'), data.get('trace_file'))
+        else:
+            tracing.disable()
+        return jsonify(tracing.get_status())
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
 # COVID data endpoints
 @app.route('/api/countries', methods=['GET'])
 def get_countries():
-    """Get all countries"""
+    """Get all country names, or a page of country totals when searching, sorting or paging
+    
+    search is a case-insensitive name prefix, sort a COUNTRY_SORTS column
+    with an optional leading '-' for descending order (the default is
+    -confirmed), page starts at 1 and page_size is at most 500.
+    """
     try:
-        countries = covid_db.get_all_countries()
-        return jsonify({'countries': countries, 'count': len(countries)})
+        if not any(param in request.args for param in ('search', 'sort', 'page', 'page_size')):
+            countries = covid_db.get_all_countries()
+            return jsonify({'countries': countries, 'count': len(countries)})
+        
+        sort = request.args.get('sort', '-confirmed')
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort not in COUNTRY_SORTS:
+            return jsonify({'error': f"sort must be one of {', '.join(COUNTRY_SORTS)}, '-' first for descending"}), 400
+        
+        try:
+            page = int(request.args.get('page', 1))
+            page_size = int(request.args.get('page_size', COUNTRY_PAGE_ROWS))
+        except ValueError:
+            return jsonify({'error': 'page and page_size must be integers'}), 400
+        if page < 1 or page_size < 1 or page_size > 500:
+            return jsonify({'error': 'page must be at least 1 and page_size between 1 and 500'}), 400
+        
+        result = covid_db.query_country_totals(request.args.get('search'), sort, descending, page, page_size)
+        result['sort'] = ('-' if descending else '') + sort
+        result['count'] = len(result['countries'])
+        return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -66,10 +198,177 @@ def get_countries():
 def get_country_data(country_name):
     """Get data for a specific country"""
     try:
-        data = covid_db.get_country_data(country_name)
+        granularity = get_granularity()
+        if granularity is None:
+            return jsonify(GRANULARITY_ERROR), 400
+        
+        country = canonicalize_country(country_name)
+        data = covid_db.get_country_data(country, granularity)
         if data is None:
             return jsonify({'error': 'Country not found'}), 404
-        return jsonify({'country': country_name, 'data': data, 'count': len(data)})
+        return jsonify({
+            'country': country,
+            'iso3': get_iso3(country),
+            'granularity': granularity,
+            'data': data,
+            'count': len(data)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/timeseries', methods=['GET'])
+def get_time_series():
+    """Get the global or a country's time series per day, week or month"""
+    try:
+        granularity = get_granularity()
+        if granularity is None:
+            return jsonify(GRANULARITY_ERROR), 400
+        
+        country = request.args.get('country')
+        if country:
+            country = canonicalize_country(country)
+        # Aggregate over the memory-mapped snapshot when it is current
+        from snapshot import load_snapshot
+        snapshot = load_snapshot(covid_db)
+        if snapshot is not None:
+            frame = snapshot.time_series(country or None, granularity)
+            data = None if frame is None else frame.to_dict('records')
+        else:
+            data = covid_db.get_time_series(country or None, granularity)
+        if data is None:
+            return jsonify({'error': 'Country not found'}), 404
+        return jsonify({'country': country or None, 'granularity': granularity, 'data': data, 'count': len(data)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_cases():
+    """Stream case rows as CSV or NDJSON (?format=&country=&from=&to=&gzip=1)
+    
+    country can be repeated to export several countries, one after another.
+    """
+    try:
+        file_format = request.args.get('format', 'csv')
+        if file_format not in export.EXPORT_FORMATS:
+            return jsonify({'error': f"format must be one of {', '.join(export.EXPORT_FORMATS)}"}), 400
+        start, end = request.args.get('from') or None, request.args.get('to') or None
+        try:
+            for value in (start, end):
+                if value is not None:
+                    to_day_number(value)
+        except ValueError:
+            return jsonify({'error': 'from and to must be dates (YYYY-MM-DD)'}), 400
+        
+        countries = [canonicalize_country(name) for name in request.args.getlist('country') if name]
+        if countries:
+            known = set(covid_db.get_all_countries())
+            if any(name not in known for name in countries):
+                return jsonify({'error': 'Country not found'}), 404
+        compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+        
+        chunks = export.export_cases(covid_db, file_format, countries or None, start, end, compress)
+        suffix = '_' + countries[0].replace(' ', '_') if len(countries) == 1 else ''
+        file_name = f"covid_cases{suffix}.{file_format}"
+        response = Response(stream_with_context(chunks), mimetype=export.MIMETYPES[file_format])
+        response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Case rows written since a data version, for incremental sync (?since=&limit=)
+    
+    Start without since, pass the returned 'next' as since on every
+    following call. With 'reset' (always the case without since) the
+    change log does not reach back to since: download /api/export and
+    continue from 'next'. Changes hold the current row, so applying one
+    twice is harmless.
+    """
+    try:
+        try:
+            since = request.args.get('since')
+            since = int(since) if since else None
+            limit = int(request.args.get('limit', CHANGE_PAGE_ROWS))
+        except ValueError:
+            return jsonify({'error': 'since and limit must be integers'}), 400
+        if limit < 1 or limit > EXPORT_PAGE_ROWS:
+            return jsonify({'error': f'Limit must be between 1 and {EXPORT_PAGE_ROWS}'}), 400
+        
+        # One row over the limit tells whether another page follows
+        feed = covid_db.get_changes(since, limit + 1)
+        changes = feed['changes'][:limit]
+        has_more = len(feed['changes']) > limit
+        return jsonify({
+            'since': since,
+            'version': feed['version'],
+            'next': changes[-1]['seq'] if has_more else feed['version'],
+            'has_more': has_more,
+            'reset': feed['reset'],
+            'changes': changes,
+            'count': len(changes)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stream', methods=['GET'])
+def stream_changes():
+    """Server-Sent Events with the case rows and country totals changed by every write
+
+    Each event's id is the data version. A client reconnecting with a
+    Last-Event-ID other than the current version gets a reset event first,
+    telling it to reload before applying further events.
+    """
+    subscriber = broadcaster.subscribe()
+    last_id = request.headers.get('Last-Event-ID')
+    
+    def events():
+        try:
+            yield 'retry: 3000\n\n'
+            version = broadcaster.version
+            if last_id is not None and version is not None and last_id != str(version):
+                yield live_updates.format_sse({'version': version, 'reset': True})
+            while True:
+                try:
+                    event = subscriber.get(timeout=live_updates.HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield live_updates.format_sse(event)
+        finally:
+            # Runs when the client disconnects and the server closes the generator
+            broadcaster.unsubscribe(subscriber)
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/derived-metrics', methods=['GET'])
+def get_derived_metrics():
+    """Get daily new cases, rolling averages, growth rates and doubling times"""
+    try:
+        country = request.args.get('country')
+        start_date = request.args.get('from')
+        end_date = request.args.get('to')
+        
+        for value in (start_date, end_date):
+            if value:
+                to_day_number(value)
+        
+        metrics = covid_db.get_derived_metrics(country, start_date or None, end_date or None)
+        if metrics is None:
+            return jsonify({'error': 'Country not found'}), 404
+        return jsonify({
+            'country': canonicalize_country(country) if country else None,
+            'data_version': covid_db.get_data_version(),
+            'metrics': metrics,
+            'count': len(metrics)
+        })
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -77,7 +376,11 @@ def get_country_data(country_name):
 def get_global_summary():
     """Get global COVID summary"""
     try:
-        summary = covid_db.get_global_summary()
+        granularity = get_granularity()
+        if granularity is None:
+            return jsonify(GRANULARITY_ERROR), 400
+        
+        summary = covid_db.get_global_summary(granularity)
         if summary is None:
             return jsonify({'error': 'No data available'}), 404
         return jsonify(summary)
@@ -94,7 +397,14 @@ def get_top_countries():
         if limit < 1 or limit > 50:
             return jsonify({'error': 'Limit must be between 1 and 50'}), 400
         
-        top_countries = covid_db.get_top_countries(metric, limit)
+        if metric not in CASE_METRICS:
+            return jsonify({'error': f"metric must be one of {', '.join(CASE_METRICS)}"}), 400
+        
+        granularity = get_granularity()
+        if granularity is None:
+            return jsonify(GRANULARITY_ERROR), 400
+        
+        top_countries = covid_db.get_top_countries(metric, limit, granularity)
         return jsonify({'metric': metric, 'countries': top_countries, 'count': len(top_countries)})
     except ValueError:
         return jsonify({'error': 'Invalid limit parameter'}), 400
@@ -111,14 +421,48 @@ def compare_countries():
         if not countries:
             return jsonify({'error': 'No countries provided'}), 400
         
-        if len(countries) > 10:
-            return jsonify({'error': 'Maximum 10 countries allowed'}), 400
+        if len(countries) > MAX_COMPARE_COUNTRIES:
+            return jsonify({'error': f'Maximum {MAX_COMPARE_COUNTRIES} countries allowed'}), 400
         
         comparison = covid_db.compare_countries(countries)
         return jsonify({'comparison': comparison, 'count': len(comparison)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/compare/series', methods=['POST'])
+def compare_series_endpoint():
+    """Date-aligned time series of up to MAX_COMPARE_COUNTRIES countries"""
+    try:
+        data = request.json or {}
+        countries = data.get('countries', [])
+        start_date = data.get('from')
+        end_date = data.get('to')
+        
+        if not countries or not isinstance(countries, list):
+            return jsonify({'error': 'No countries provided'}), 400
+        
+        try:
+            for value in (start_date, end_date):
+                if value:
+                    to_day_number(value)
+        except ValueError:
+            return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+        
+        result = compare_series(
+            covid_db,
+            countries,
+            data.get('metric', 'confirmed'),
+            per_capita=bool(data.get('per_capita')),
+            per_day=bool(data.get('per_day')),
+            start=start_date or None,
+            end=end_date or None
+        )
+        return jsonify(series_to_json(result))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/add-case', methods=['POST'])
 def add_case():
     """Add a new COVID case"""
@@ -141,10 +485,30 @@ def add_case():
                     'message': f'{field} must be non-negative'
                 }), 400
         
-        success = covid_db.add_new_case(data)
+        if not isinstance(data['country'], str) or not data['country'].strip():
+            return jsonify({'success': False, 'message': 'country must be a non-empty string'}), 400
+        
+        case_data = {
+            'country': canonicalize_country(data['country']),
+            'date': data.get('date') or date.today().isoformat(),
+            'confirmed': int(data['confirmed']),
+            'deaths': int(data['deaths']),
+            'recovered': int(data['recovered']),
+            'active': int(data.get('active', data['confirmed'] - data['deaths'] - data['recovered']))
+        }
+        
+        try:
+            to_day_number(case_data['date'])
+        except ValueError:
+            return jsonify({'success': False, 'message': 'date must be in YYYY-MM-DD format'}), 400
+        
+        success = covid_db.add_new_case(case_data)
+        if success:
+            broadcaster.wake()
         return jsonify({
             'success': success,
-            'message': 'Case added successfully' if success else 'Failed to add case'
+            'message': 'Case added successfully' if success else 'Failed to add case',
+            'country': case_data['country']
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
@@ -179,11 +543,22 @@ if __name__ == '__main__':
     print("  GET  /api/health")
     print("  POST /api/register")
     print("  POST /api/login")
-    print("  GET  /api/countries")
+    print("  GET  /api/login-stats")
+    print("  GET  /api/query-stats")
+    print("  GET  /api/metrics")
+    print("  GET  /api/tracing")
+    print("  POST /api/tracing")
+    print("  GET  /api/countries?search=&sort=&page=")
     print("  GET  /api/country/<name>")
+    print("  GET  /api/timeseries")
+    print("  GET  /api/export")
+    print("  GET  /api/changes")
+    print("  GET  /api/stream")
+    print("  GET  /api/derived-metrics")
     print("  GET  /api/global-summary")
     print("  GET  /api/top-countries")
     print("  POST /api/compare")
+    print("  POST /api/compare/series")
     print("  POST /api/add-case")
     print("  GET  /api/statistics")
     print("=" * 50)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
+import importlib
 import streamlit as st
-from database import CovidDatabase, UserDatabase
+from database import get_covid_database, UserDatabase
 
 # Page configuration
 st.set_page_config(
@@ -10,16 +11,31 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize databases
+# Initialize databases - the case database only once someone has logged in,
+# so the login page renders without NumPy, pandas or pyarrow
 @st.cache_resource
-def init_databases():
+def init_user_database():
     try:
-        return CovidDatabase(), UserDatabase()
+        return UserDatabase()
     except Exception as e:
         st.error(f"Database initialization error: {e}")
         st.stop()
 
-covid_db, user_db = init_databases()
+@st.cache_resource
+def init_covid_database():
+    try:
+        from rollup_scheduler import RollupScheduler
+        from storage import SNAPSHOT_DIR
+        
+        covid_db = get_covid_database()
+        # Keep the weekly/monthly rollups and the Arrow snapshot current in the background
+        RollupScheduler(covid_db, snapshot_dir=SNAPSHOT_DIR).start()
+        return covid_db
+    except Exception as e:
+        st.error(f"Database initialization error: {e}")
+        st.stop()
+
+user_db = init_user_database()
 
 # Session state initialization
 if 'logged_in' not in st.session_state:
@@ -37,10 +53,10 @@ import os
 sys.path.append(os.path.dirname(__file__))
 
 from pages.auth import login_page, register_page
-from pages.dashboard import show as dashboard_show
-from pages.compare import show as compare_show
-from pages.add_case import show as add_case_show
-from pages.users import show as users_show
+
+def show_page(name, *args):
+    """Render a page, importing its module (and its plotting libraries) on first use"""
+    importlib.import_module(f'pages.{name}').show(*args)
 
 def main():
     # Custom CSS
@@ -98,7 +114,8 @@ def main():
                     "🏠 Dashboard": "dashboard",
                     "⚖️ Compare Countries": "compare",
                     "➕ Add Case": "add_case",
-                    "👥 User Management": "users"
+                    "👥 User Management": "users",
+                    "⏱️ Performance": "performance"
                 }
             else:
                 menu_options = {
@@ -126,14 +143,10 @@ def main():
         # Route to appropriate page based on selection
         page_value = menu_options[page]
         
-        if page_value == "dashboard":
-            dashboard_show(covid_db)
-        elif page_value == "compare":
-            compare_show(covid_db)
-        elif page_value == "add_case":
-            add_case_show(covid_db)
-        elif page_value == "users":
-            users_show(user_db)
+        if page_value == "users":
+            show_page(page_value, user_db)
+        else:
+            show_page(page_value, init_covid_database())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
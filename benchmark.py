@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the case database, the user database and the API
+
+Builds a synthetic dataset of the chosen size in a scratch directory, then
+times every public CovidDatabase and UserDatabase method, the throughput
+of each API endpoint through the Flask test client, the formatData CSV
+ingest rate, the cold import time of the Streamlit pages and the API's
+process start to ready time. Results are written as JSON so runs can be
+compared:
+
+    python benchmark.py --size 10k --output before.json
+    python benchmark.py --size 10k --baseline before.json --threshold 0.2
+
+With --baseline the run exits with status 1 when any timing is more than
+`threshold` (relative) slower than in the baseline. Sizes are 10k, 1m and
+10m case rows; COVID_DB_BACKEND or --backend picks the storage backend.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from create_sample_data import DEFAULT_START, country_names, chunk_rows_of, generate_chunks, write_csv
+from login_limiter import LoginLimiter
+
+# Case rows per dataset size
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+DATASET_DAYS = 1000
+DATASET_START = DEFAULT_START
+# Users in the user database, one per this many case rows (at least 1000)
+ROWS_PER_USER = 100
+BENCHMARK_PASSWORD = 'benchmark-password'
+# Rows written to the CSV for the formatData ingest benchmark
+INGEST_ROWS = 50_000
+
+# Timings below this many milliseconds never count as a regression
+NOISE_FLOOR_MS = 0.5
+DEFAULT_THRESHOLD = 0.2
+
+
+def dataset_countries(rows):
+    """Country names of a dataset with `rows` case rows"""
+    return country_names(max(1, -(-rows // DATASET_DAYS)))
+
+
+def dataset_chunks(rows, seed=0):
+    """Column chunks of the seeded synthetic dataset with `rows` case rows"""
+    return generate_chunks(countries=len(dataset_countries(rows)), days=DATASET_DAYS,
+                           start=DATASET_START, seed=seed)
+
+
+def build_users(db_name, count):
+    """Fill a user database with `count` users sharing one precomputed hash"""
+    from database import UserDatabase, hash_password
+
+    UserDatabase(db_name).ensure_schema()
+    password_hash = hash_password(BENCHMARK_PASSWORD)
+    conn = sqlite3.connect(db_name)
+    conn.executemany('''
+        INSERT OR IGNORE INTO users (username, password_hash, full_name, email, login_count)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ((f'user{i:07d}', password_hash, f'Benchmark User {i}', f'user{i}@example.com', i % 50)
+          for i in range(1, count + 1)))
+    conn.commit()
+    conn.close()
+
+
+def unlimited_limiter():
+    """A LoginLimiter that never rejects, so login timings measure the login itself"""
+    return LoginLimiter(ip_capacity=10**9, ip_refill_rate=10**9, user_capacity=10**9,
+                        user_refill_rate=10**9, lockout_threshold=10**9)
+
+
+def measure(function, args=(), repeat=5, warmup=1):
+    """Call function(*args) repeatedly, returns timing statistics in milliseconds"""
+    for _ in range(warmup):
+        function(*args)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'median_ms': round(timings[len(timings) // 2], 3),
+        'min_ms': round(timings[0], 3),
+        'max_ms': round(timings[-1], 3),
+        'runs': repeat
+    }
+
+
+def _counter(prefix):
+    """Callable returning a new unique name on every call"""
+    state = {'next': 0}
+
+    def name():
+        state['next'] += 1
+        return f'{prefix}{os.getpid()}_{state["next"]}'
+    return name
+
+
+def benchmark_covid(covid_db, countries, repeat):
+    """Time every public method of the case database"""
+    country, others = countries[0], countries[:3]
+    last_day = (DATASET_START + timedelta(days=DATASET_DAYS - 1)).isoformat()
+    batch = [(name, last_day, 10, 1, 5, 4) for name in countries[:1000]]
+    # Bucket rebuilds and full-table reads are too slow to repeat much at scale
+    slow = max(1, min(repeat, 3))
+
+    reads = [
+        ('create_tables', ()),
+        ('get_data_version', ()),
+        ('get_global_summary', ()),
+        ('get_global_summary', ('week',)),
+        ('get_global_summary', ('month',)),
+        ('get_top_countries', ('confirmed', 10)),
+        ('get_top_countries', ('deaths', 10, 'week')),
+        ('get_top_countries', ('active', 10, 'month')),
+        ('get_all_countries', ()),
+        ('get_country_totals', ()),
+        ('compare_countries', (others,)),
+        ('get_country_data', (country,)),
+        ('get_country_data', (country, 'week')),
+        ('get_country_data', (country, 'month')),
+        ('get_time_series', ()),
+        ('get_time_series', (None, 'week')),
+        ('get_time_series', (None, 'month')),
+        ('get_time_series', (country,)),
+        ('get_derived_metrics', (country,)),
+        ('get_derived_metrics', ()),
+    ]
+    if hasattr(covid_db, 'get_reload_version'):
+        reads.append(('get_reload_version', ()))
+
+    results = {}
+    for method, args in reads:
+        label = method + (f"({', '.join(repr(arg) for arg in args)})" if args else '')
+        if not hasattr(covid_db, method):
+            continue
+        results[f'covid.{label}'] = measure(getattr(covid_db, method), args, repeat)
+
+    results['covid.get_case_columns'] = measure(covid_db.get_case_columns, (), slow)
+
+    # Cold derived metrics: drop the cache before every run
+    def cold_derived_metrics():
+        covid_db._metrics_cache = None
+        covid_db.get_derived_metrics(country)
+    results['covid.get_derived_metrics(cold)'] = measure(cold_derived_metrics, (), slow)
+
+    # Writes last, they change the data the reads above ran on
+    results['covid.add_new_case'] = measure(covid_db.add_new_case, ({
+        'country': country, 'date': last_day,
+        'confirmed': 1, 'deaths': 0, 'recovered': 0, 'active': 1
+    },), repeat)
+    results[f'covid.insert_cases({len(batch)} rows)'] = measure(covid_db.insert_cases, (batch,), repeat)
+    results['covid.refresh_rollups'] = measure(covid_db.refresh_rollups, (), repeat)
+    if hasattr(covid_db, 'rebuild_rollups'):
+        results['covid.rebuild_rollups'] = measure(covid_db.rebuild_rollups, (), slow, warmup=0)
+    return results
+
+
+def benchmark_users(user_db, user_count, repeat):
+    """Time every public method of the user database"""
+    # bcrypt hashes dominate these, a handful of runs is enough
+    hashed = max(1, min(repeat, 3))
+    username = f'user{user_count // 2:07d}'
+    new_name = _counter('bench_register_')
+    bulk_name = _counter('bench_bulk_')
+
+    def bulk_import():
+        user_db.bulk_import_users([{'username': bulk_name(), 'password': BENCHMARK_PASSWORD}
+                                   for _ in range(8)])
+
+    results = {
+        'users.create_tables': measure(user_db.create_tables, (), repeat),
+        'users.register_user': measure(lambda: user_db.register_user(new_name(), BENCHMARK_PASSWORD), (), hashed),
+        'users.bulk_import_users(8 users)': measure(bulk_import, (), hashed),
+        'users.authenticate_user(valid)': measure(user_db.authenticate_user,
+                                                  (username, BENCHMARK_PASSWORD, '127.0.0.1'), hashed),
+        'users.authenticate_user(wrong password)': measure(user_db.authenticate_user,
+                                                           (username, 'wrong-password', '127.0.0.1'), hashed),
+        'users.authenticate_user(unknown user)': measure(user_db.authenticate_user,
+                                                         ('no-such-user', BENCHMARK_PASSWORD, '127.0.0.1'), hashed),
+        'users.get_user_info': measure(user_db.get_user_info, (username,), repeat),
+        'users.is_admin': measure(user_db.is_admin, (username,), repeat),
+        'users.get_user_count': measure(user_db.get_user_count, (), repeat),
+        'users.get_user_statistics': measure(user_db.get_user_statistics, (), repeat),
+        'users.get_all_users': measure(user_db.get_all_users, (), max(1, min(repeat, 3))),
+        "users.search_users('')": measure(user_db.search_users, ('',), repeat),
+        "users.search_users('user00')": measure(user_db.search_users, ('user00',), repeat),
+        "users.search_users('Benchmark', 'username', 5)": measure(user_db.search_users,
+                                                                 ('Benchmark', 'username', 5), repeat),
+        "users.count_users('user00')": measure(user_db.count_users, ('user00',), repeat),
+        'users.update_user_profile': measure(user_db.update_user_profile,
+                                             (username, 'Renamed User', 'renamed@example.com'), repeat),
+        'users.deactivate_user': measure(user_db.deactivate_user, (username,), repeat),
+        'users.activate_user': measure(user_db.activate_user, (username,), repeat),
+    }
+    return results
+
+
+# Endpoints timed through the Flask test client, as (method, path, JSON body)
+API_REQUESTS = [
+    ('GET', '/api/health', None),
+    ('GET', '/api/countries', None),
+    ('GET', '/api/countries?search=un&sort=-deaths&page=1', None),
+    ('GET', '/api/country/{country}', None),
+    ('GET', '/api/country/{country}?granularity=week', None),
+    ('GET', '/api/timeseries', None),
+    ('GET', '/api/timeseries?granularity=month', None),
+    ('GET', '/api/timeseries?country={country}', None),
+    ('GET', '/api/derived-metrics?country={country}', None),
+    ('GET', '/api/derived-metrics', None),
+    ('GET', '/api/export?format=csv&country={country}', None),
+    ('GET', '/api/export?format=ndjson&country={country}&gzip=1', None),
+    ('GET', '/api/changes?since=0', None),
+    ('GET', '/api/global-summary', None),
+    ('GET', '/api/top-countries', None),
+    ('GET', '/api/top-countries?metric=deaths&granularity=week', None),
+    ('GET', '/api/statistics', None),
+    ('GET', '/api/login-stats', None),
+    ('GET', '/api/query-stats', None),
+    ('GET', '/api/metrics', None),
+    ('POST', '/api/compare', {'countries': '{countries}'}),
+    ('POST', '/api/compare/series', {'countries': '{countries}', 'per_day': True}),
+    ('POST', '/api/login', {'username': '{username}', 'password': BENCHMARK_PASSWORD}),
+    ('POST', '/api/register', {'username': '{new_user}', 'password': BENCHMARK_PASSWORD}),
+    ('POST', '/api/add-case', {'country': '{country}', 'confirmed': 1, 'deaths': 0, 'recovered': 0}),
+]
+
+
+def benchmark_api(countries, user_count, repeat):
+    """Requests per second of each endpoint through the Flask test client
+
+    Must run with the dataset directory as the working directory, api.py
+    opens data/covid_data.db and data/users.db on import.
+    """
+    import api
+
+    api.rollup_scheduler.stop()
+    api.user_db.limiter = unlimited_limiter()
+    client = api.app.test_client()
+    new_user = _counter('bench_api_')
+    values = {'country': countries[0], 'countries': countries[:3],
+              'username': f'user{user_count // 2:07d}'}
+
+    def fill(value):
+        if isinstance(value, dict):
+            return {key: fill(item) for key, item in value.items()}
+        if value == '{new_user}':
+            return new_user()
+        if value == '{countries}':
+            return values['countries']
+        return value.format(**values) if isinstance(value, str) else value
+
+    results = {}
+    for method, path, body in API_REQUESTS:
+        url = path.format(**values)
+        statuses = set()
+
+        def call():
+            if method == 'GET':
+                response = client.get(url)
+            else:
+                response = client.post(url, json=fill(body))
+            statuses.add(response.status_code)
+
+        # Endpoints that hash passwords get fewer runs
+        runs = max(1, min(repeat, 3)) if path in ('/api/login', '/api/register') else repeat
+        timing = measure(call, (), runs)
+        timing['requests_per_s'] = round(1000 / timing['median_ms'], 1) if timing['median_ms'] else None
+        timing['status'] = sorted(statuses)
+        results[f'api.{method} {path}'] = timing
+    return results
+
+
+def benchmark_ingest(rows, backend):
+    """Rows per second for formatData's CSV import, a full reload and a snapshot"""
+    import formatData
+    from database import get_covid_database
+    from snapshot import write_snapshot
+
+    os.makedirs('ingest', exist_ok=True)
+    csv_file = os.path.join('ingest', 'cases.csv')
+    write_csv(csv_file, dataset_chunks(rows, seed=1))
+
+    results = {}
+    for label, replace in (('fresh', False), ('replace', True)):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ok = formatData.import_csv_to_database(csv_file, os.path.join('ingest', 'cases.db'),
+                                                   interactive=False, replace=replace)
+        elapsed = time.perf_counter() - started
+        if not ok:
+            raise RuntimeError('formatData import failed')
+        results[f'ingest.formatData({label}, {rows} rows)'] = {
+            'median_ms': round(elapsed * 1000, 3),
+            'rows_per_s': round(rows / elapsed, 1),
+            'runs': 1
+        }
+
+    covid_db = get_covid_database(os.path.join('ingest', 'cases.db'), backend)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        write_snapshot(covid_db, os.path.join('ingest', 'snapshot'))
+    results['ingest.write_snapshot'] = {'median_ms': round((time.perf_counter() - started) * 1000, 3), 'runs': 1}
+    return results
+
+
+# Cold imports timed in a fresh interpreter, as (label, already imported, timed imports)
+IMPORT_TARGETS = [
+    ('login page', '', 'streamlit, database, pages.auth'),
+    ('streamlit', '', 'streamlit'),
+    ('database', '', 'database'),
+    ('pages.dashboard', 'streamlit, database', 'pages.dashboard'),
+    ('pages.compare', 'streamlit, database', 'pages.compare'),
+    ('pages.add_case', 'streamlit, database', 'pages.add_case'),
+    ('pages.users', 'streamlit, database', 'pages.users'),
+    ('pages.performance', 'streamlit, database', 'pages.performance'),
+    ('rollup_scheduler', 'database', 'rollup_scheduler'),
+    ('pandas', '', 'pandas'),
+    ('plotly.express', '', 'plotly.express'),
+]
+# Libraries the login page should render without
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'plotly.express')
+
+IMPORT_SCRIPT = """
+import json, sys, time
+{preload}
+started = time.perf_counter()
+import {modules}
+print(json.dumps({{'seconds': time.perf_counter() - started,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def benchmark_imports(repeat):
+    """Cold import time of the app's entry points and pages, each in a new interpreter"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for label, preload, modules in IMPORT_TARGETS:
+        script = IMPORT_SCRIPT.format(preload=f'import {preload}' if preload else '', modules=modules,
+                                      heavy=HEAVY_MODULES)
+        timings = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True,
+                                    text=True, check=True).stdout
+            child = json.loads(output.strip().splitlines()[-1])
+            timings.append(child['seconds'] * 1000)
+        timings.sort()
+        results[f'import.{label}'] = {
+            'median_ms': round(timings[len(timings) // 2], 3),
+            'min_ms': round(timings[0], 3),
+            'max_ms': round(timings[-1], 3),
+            'runs': repeat,
+            'heavy_modules': child['heavy']
+        }
+    return results
+
+
+STARTUP_SCRIPT = """
+import json, time
+import api
+ready = time.perf_counter()
+api.rollup_scheduler.stop()
+client = api.app.test_client()
+started = time.perf_counter()
+client.get('/api/global-summary')
+print(json.dumps({'startup': api.STARTUP_SECONDS, 'first_request': time.perf_counter() - started}))
+"""
+
+
+def benchmark_startup(repeat):
+    """Process start to ready for the API, in new processes against the current directory's data"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    wall, startup, first_request = [], [], []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True,
+                                check=True, env=env).stdout
+        child = json.loads(output.strip().splitlines()[-1])
+        # Includes the interpreter start, the first request and the exit
+        wall.append((time.perf_counter() - started) * 1000)
+        startup.append(child['startup'] * 1000)
+        first_request.append(child['first_request'] * 1000)
+
+    def summary(timings):
+        timings = sorted(timings)
+        return {'median_ms': round(timings[len(timings) // 2], 3), 'min_ms': round(timings[0], 3),
+                'max_ms': round(timings[-1], 3), 'runs': repeat}
+    return {
+        'startup.api process (start to exit)': summary(wall),
+        'startup.api import to ready': summary(startup),
+        'startup.api first request': summary(first_request)
+    }
+
+
+def build_dataset(directory, rows, backend):
+    """Create data/covid_data.db and data/users.db under directory, returns load timings"""
+    from database import CovidDatabase
+
+    os.makedirs(os.path.join(directory, 'data'), exist_ok=True)
+    covid_name = os.path.join(directory, 'data', 'covid_data.db')
+    users_name = os.path.join(directory, 'data', 'users.db')
+
+    started = time.perf_counter()
+    loaded = CovidDatabase(covid_name).reload_cases(chunk_rows_of(dataset_chunks(rows)))
+    reload_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    build_users(users_name, max(1000, rows // ROWS_PER_USER))
+    users_seconds = time.perf_counter() - started
+
+    return {
+        f'ingest.reload_cases({loaded} rows)': {
+            'median_ms': round(reload_seconds * 1000, 3),
+            'rows_per_s': round(loaded / reload_seconds, 1),
+            'runs': 1
+        },
+        'ingest.build_users': {'median_ms': round(users_seconds * 1000, 3), 'runs': 1}
+    }
+
+
+def run(size='10k', backend=None, repeat=5, sections=('covid', 'users', 'api', 'ingest', 'imports', 'startup'),
+        workdir=None):
+    """Run the suite, returns the JSON-able results"""
+    from database import UserDatabase, get_covid_database
+
+    rows = SIZES[size]
+    backend = backend or os.environ.get('COVID_DB_BACKEND', 'sqlite')
+    os.environ['COVID_DB_BACKEND'] = backend
+    directory = workdir or tempfile.mkdtemp(prefix='covid-benchmark-')
+    countries = dataset_countries(rows)
+    user_count = max(1000, rows // ROWS_PER_USER)
+
+    results = build_dataset(directory, rows, backend)
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        if 'covid' in sections:
+            results.update(benchmark_covid(get_covid_database('data/covid_data.db', backend), countries, repeat))
+        if 'users' in sections:
+            results.update(benchmark_users(UserDatabase('data/users.db', unlimited_limiter()), user_count, repeat))
+        if 'api' in sections:
+            results.update(benchmark_api(countries, user_count, repeat))
+        if 'ingest' in sections:
+            results.update(benchmark_ingest(min(rows, INGEST_ROWS), backend))
+        if 'imports' in sections:
+            results.update(benchmark_imports(repeat))
+        if 'startup' in sections:
+            results.update(benchmark_startup(repeat))
+    finally:
+        os.chdir(previous)
+        if workdir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'meta': {
+            'size': size,
+            'rows': rows,
+            'backend': backend,
+            'repeat': repeat,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Timings more than `threshold` slower than the baseline, as a list of dicts"""
+    regressions = []
+    for name, timing in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        old, new = before['median_ms'], timing['median_ms']
+        if new > old * (1 + threshold) and new - old > NOISE_FLOOR_MS:
+            regressions.append({'name': name, 'baseline_ms': old, 'median_ms': new,
+                                'change': round(new / old - 1, 3) if old else None})
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"\n{'Benchmark':<60} {'Median ms':>11} {'Baseline':>11} {'Rate':>12}")
+    print("-" * 97)
+    for name, timing in results['results'].items():
+        before = (baseline or {}).get('results', {}).get(name, {}).get('median_ms')
+        rate = timing.get('rows_per_s') or timing.get('requests_per_s')
+        print(f"{name[:60]:<60} {timing['median_ms']:>11.3f} "
+              f"{before if before is not None else '':>11} {rate if rate else '':>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', choices=SIZES, default='10k')
+    parser.add_argument('--backend', help='storage backend (default COVID_DB_BACKEND or sqlite)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--sections', default='covid,users,api,ingest,imports,startup',
+                        help='comma separated subset of covid,users,api,ingest,imports,startup')
+    parser.add_argument('--workdir', help='keep the dataset in this directory instead of a temp one')
+    parser.add_argument('--output', help='write the results JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown counted as a regression (default 0.2)')
+    args = parser.parse_args(argv)
+
+    results = run(args.size, args.backend, args.repeat, args.sections.split(','), args.workdir)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if {key: baseline['meta'].get(key) for key in ('size', 'backend')} != \
+                {key: results['meta'][key] for key in ('size', 'backend')}:
+            print("Warning: baseline was run with a different size or backend")
+    print_results(results, baseline)
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        results['regressions'] = regressions
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression['name']}: {regression['baseline_ms']} ms -> "
+                      f"{regression['median_ms']} ms")
+        else:
+            print(f"\nNo regressions over {args.threshold:.0%}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
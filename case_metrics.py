@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Derived COVID-19 metrics
+
+Computes daily new values, rolling averages, growth rates and doubling
+times for every (country, day) series at once with NumPy. Input rows must
+be sorted by country and day - the clustered key order of covid_cases - so
+each country is a contiguous run and grouped operations become shifted
+array arithmetic instead of per-country Python loops.
+
+Values are cumulative totals. Rates are per day, so gaps between
+observations are spread evenly over the missing days.
+"""
+
+import numpy as np
+
+# Cumulative columns that get derived series
+DERIVED_COLUMNS = ('confirmed', 'deaths', 'recovered')
+ROLLING_WINDOWS = (7, 14)
+
+
+def _lookback(country_ids, days, window):
+    """For each row, the index of the last row of the same country at least
+    `window` days earlier, and a mask of rows where such a row exists"""
+    span = int(days.max() - days.min()) + 1
+    keys = country_ids * span + (days - days.min())
+    index = np.searchsorted(keys, keys - window, side='right') - 1
+    valid = index >= 0
+    valid[valid] = country_ids[index[valid]] == country_ids[valid]
+    return index, valid
+
+
+def compute_derived_metrics(country_ids, days, values):
+    """Compute derived metrics for all series in one pass
+
+    country_ids and days are integer arrays sorted by (country_id, day),
+    values maps column name to the cumulative counts. Returns a dict of
+    float64 arrays aligned with the input rows, NaN where undefined.
+    """
+    country_ids = np.asarray(country_ids, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    n = len(days)
+    metrics = {}
+    if n == 0:
+        return metrics
+
+    # First row of each country has no previous observation
+    same_series = np.zeros(n, dtype=bool)
+    same_series[1:] = country_ids[1:] == country_ids[:-1]
+    gap = np.ones(n, dtype=np.float64)
+    gap[1:] = days[1:] - days[:-1]
+
+    lookbacks = {window: _lookback(country_ids, days, window) for window in ROLLING_WINDOWS}
+
+    for column in DERIVED_COLUMNS:
+        cumulative = np.asarray(values[column], dtype=np.float64)
+
+        new = np.full(n, np.nan)
+        # Rows at a country boundary can share a day, they are masked below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new[1:] = (cumulative[1:] - cumulative[:-1]) / gap[1:]
+        new[~same_series] = np.nan
+        metrics[f'new_{column}'] = new
+
+        # Mean daily increase over the window, from the cumulative difference
+        for window, (index, valid) in lookbacks.items():
+            average = np.full(n, np.nan)
+            earlier = index[valid]
+            average[valid] = ((cumulative[valid] - cumulative[earlier]) /
+                              (days[valid] - days[earlier]))
+            metrics[f'{column}_avg{window}'] = average
+
+    # Compound daily growth of confirmed cases over the last week
+    index, valid = lookbacks[7]
+    confirmed = np.asarray(values['confirmed'], dtype=np.float64)
+    growth = np.full(n, np.nan)
+    doubling = np.full(n, np.nan)
+    earlier = index[valid]
+    elapsed = (days[valid] - days[earlier]).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = confirmed[valid] / confirmed[earlier]
+        growth[valid] = np.power(ratio, 1.0 / elapsed) - 1.0
+        doubling[valid] = np.where(ratio > 1.0, elapsed * np.log(2.0) / np.log(ratio), np.nan)
+    growth[~np.isfinite(growth)] = np.nan
+    metrics['growth_rate'] = growth
+    metrics['doubling_time'] = doubling
+
+    return metrics
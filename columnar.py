@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar analytics backend
+
+ColumnarCovidDatabase keeps covid_cases in memory as NumPy arrays sorted by
+(country_id, day): int32 country codes, int32 day numbers and an int64
+matrix of the case counts. Grouped aggregates become np.add.reduceat over
+contiguous country runs instead of SQL GROUP BY scans.
+
+SQLite stays the source of truth. Writes go through the inherited
+CovidDatabase methods and every read first applies the changes logged in
+case_changes since the last sync, so inserts from this or any other
+process are picked up incrementally without reloading the table.
+
+Select it with COVID_DB_BACKEND=columnar (see database.get_covid_database).
+"""
+
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from countries import canonicalize_country
+from database import LOG_FLOOR_SQL, CovidDatabase
+from storage import CovidStorage, CASE_METRICS, bucket_starts, check_granularity, from_day_number
+
+# Immutable snapshot of the arrays, swapped atomically on every sync
+ColumnarState = namedtuple('ColumnarState', 'seq keys country_ids days values starts')
+
+_DAY_OFFSET = 1 << 31
+
+
+def _make_keys(country_ids, days):
+    """Combined sort key, ordered like (country_id, day)"""
+    return (country_ids.astype(np.int64) << 32) + (days.astype(np.int64) + _DAY_OFFSET)
+
+
+def _run_starts(sorted_ids):
+    """Index of the first row of each run of equal values"""
+    if len(sorted_ids) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+
+
+class ColumnarCovidDatabase(CovidDatabase):
+    def __init__(self, db_name='data/covid_data.db'):
+        self._lock = threading.Lock()
+        self._state = None
+        self._names = {}
+        self._iso3 = {}
+        self._ids_by_name = {}
+        super().__init__(db_name)
+
+    # ----- Loading and incremental sync -----
+
+    def _load_countries(self, cursor):
+        cursor.execute('SELECT id, name, iso3 FROM countries')
+        rows = cursor.fetchall()
+        self._names = {row[0]: row[1] for row in rows}
+        self._iso3 = {row[0]: row[2] for row in rows}
+        self._ids_by_name = {row[1]: row[0] for row in rows}
+
+    def _make_state(self, seq, country_ids, days, values):
+        return ColumnarState(seq, _make_keys(country_ids, days), country_ids, days, values,
+                             _run_starts(country_ids))
+
+    def _full_load(self, cursor, seq):
+        cursor.execute('''
+            SELECT country_id, day, confirmed, deaths, recovered, active
+            FROM covid_cases
+            ORDER BY country_id, day
+        ''')
+        rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 6)
+        return self._make_state(seq, rows[:, 0].astype(np.int32), rows[:, 1].astype(np.int32),
+                                np.ascontiguousarray(rows[:, 2:]))
+
+    def _apply_changes(self, cursor, state, seq):
+        """Apply logged deltas in (state.seq, seq] to a copy of the arrays"""
+        cursor.execute('''
+            SELECT country_id, day, confirmed, deaths, recovered, active
+            FROM case_changes
+            WHERE seq > ? AND seq <= ?
+        ''', (state.seq, seq))
+        changes = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 6)
+        if len(changes) == 0:
+            return state._replace(seq=seq)
+
+        # Combine deltas that hit the same country and day
+        change_keys, first, inverse = np.unique(_make_keys(changes[:, 0], changes[:, 1]),
+                                                return_index=True, return_inverse=True)
+        deltas = np.zeros((len(change_keys), len(CASE_METRICS)), dtype=np.int64)
+        np.add.at(deltas, inverse.ravel(), changes[:, 2:])
+
+        position = np.searchsorted(state.keys, change_keys)
+        found = position < len(state.keys)
+        found[found] = state.keys[position[found]] == change_keys[found]
+
+        values = state.values.copy()
+        values[position[found]] += deltas[found]
+
+        new = ~found
+        country_ids = np.insert(state.country_ids, position[new], changes[first[new], 0].astype(np.int32))
+        days = np.insert(state.days, position[new], changes[first[new], 1].astype(np.int32))
+        values = np.insert(values, position[new], deltas[new], axis=0)
+        keys = np.insert(state.keys, position[new], change_keys[new])
+
+        # A row whose counts netted out to zero may have been deleted, check SQLite
+        touched = np.isin(keys, change_keys)
+        zero = touched & ~values.any(axis=1)
+        if zero.any():
+            gone = []
+            for index in np.flatnonzero(zero):
+                cursor.execute('SELECT 1 FROM covid_cases WHERE country_id = ? AND day = ?',
+                               (int(country_ids[index]), int(days[index])))
+                if cursor.fetchone() is None:
+                    gone.append(index)
+            if gone:
+                keep = np.ones(len(keys), dtype=bool)
+                keep[gone] = False
+                country_ids, days, values = country_ids[keep], days[keep], values[keep]
+
+        if not set(np.unique(changes[:, 0]).tolist()) <= self._names.keys():
+            self._load_countries(cursor)
+        return self._make_state(seq, country_ids, days, values)
+
+    def _sync(self):
+        """Bring the arrays up to date with SQLite, returns the current state"""
+        seq = self.get_data_version()
+        state = self._state
+        if state is not None and state.seq == seq:
+            return state
+
+        with self._lock:
+            state = self._state
+            if state is not None and state.seq == seq:
+                return state
+
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute(LOG_FLOOR_SQL)
+            log_floor = cursor.fetchone()[0]
+            if state is None or seq < state.seq or state.seq < log_floor:
+                # First load, or the data was replaced by a full reload or the log pruned since
+                self._load_countries(cursor)
+                state = self._full_load(cursor, seq)
+            else:
+                state = self._apply_changes(cursor, state, seq)
+            conn.close()
+
+            self._state = state
+            return state
+
+    def _country_totals(self, state):
+        """Per-country totals as (country ids, int64 matrix)"""
+        if len(state.starts) == 0:
+            return state.country_ids[:0], state.values[:0]
+        return state.country_ids[state.starts], np.add.reduceat(state.values, state.starts, axis=0)
+
+    def _totals_rows(self, ids, totals, order):
+        return [
+            dict({'country': self._names.get(int(ids[i]))},
+                 **{metric: int(totals[i, m]) for m, metric in enumerate(CASE_METRICS)})
+            for i in order
+        ]
+
+    def _series(self, days, values, granularity):
+        """Sum rows sorted by day into day/week/month buckets"""
+        buckets = bucket_starts(days, granularity)
+        starts = _run_starts(buckets)
+        if len(starts) == 0:
+            return []
+        sums = np.add.reduceat(values, starts, axis=0)
+        return [
+            dict({'date': from_day_number(day)},
+                 **{metric: row[m] for m, metric in enumerate(CASE_METRICS)})
+            for day, row in zip(buckets[starts].tolist(), sums.tolist())
+        ]
+
+    # ----- CovidDatabase reads -----
+
+    def get_global_summary(self, granularity='day'):
+        check_granularity(granularity)
+        totals = self._sync().values.sum(axis=0)
+        return {f'total_{metric}': int(totals[m]) for m, metric in enumerate(CASE_METRICS)}
+
+    def get_top_countries(self, metric='confirmed', limit=10, granularity='day'):
+        check_granularity(granularity)
+        if metric not in CASE_METRICS:
+            metric = 'confirmed'
+        ids, totals = self._country_totals(self._sync())
+        order = np.argsort(-totals[:, CASE_METRICS.index(metric)], kind='stable')[:limit]
+        return self._totals_rows(ids, totals, order)
+
+    def get_all_countries(self):
+        state = self._sync()
+        return sorted(self._names[int(cid)] for cid in state.country_ids[state.starts])
+
+    def get_country_totals(self):
+        ids, totals = self._country_totals(self._sync())
+        order = sorted(range(len(ids)), key=lambda i: self._names.get(int(ids[i]), ''))
+        rows = self._totals_rows(ids, totals, order)
+        for row, i in zip(rows, order):
+            row['iso3'] = self._iso3.get(int(ids[i]))
+        return [
+            {key: row[key] for key in ('country', 'iso3') + CASE_METRICS}
+            for row in rows
+        ]
+
+    def compare_countries(self, countries):
+        state = self._sync()
+        wanted = [self._ids_by_name.get(canonicalize_country(country)) for country in countries]
+        ids, totals = self._country_totals(state)
+        order = np.flatnonzero(np.isin(ids, [cid for cid in wanted if cid is not None]))
+        return self._totals_rows(ids, totals, order)
+
+    def _country_slice(self, state, country):
+        cid = self._ids_by_name.get(canonicalize_country(country))
+        if cid is None:
+            return None
+        lo = np.searchsorted(state.country_ids, cid, side='left')
+        hi = np.searchsorted(state.country_ids, cid, side='right')
+        return slice(lo, hi)
+
+    def get_country_data(self, country, granularity='day'):
+        check_granularity(granularity)
+        state = self._sync()
+        rows = self._country_slice(state, country)
+        if rows is None:
+            return None
+        return self._series(state.days[rows], state.values[rows], granularity)
+
+    def get_time_series(self, country=None, granularity='day'):
+        if country is not None:
+            return self.get_country_data(country, granularity)
+        check_granularity(granularity)
+        state = self._sync()
+        order = np.argsort(state.days, kind='stable')
+        return self._series(state.days[order], state.values[order], granularity)
+
+    # Filtering the arrays already in memory beats the inherited SQL queries
+    get_country_columns = CovidStorage.get_country_columns
+    query_country_totals = CovidStorage.query_country_totals
+
+    def get_case_columns(self):
+        state = self._sync()
+        return {
+            'version': state.seq,
+            'country_ids': state.country_ids,
+            'days': state.days,
+            'values': state.values,
+            'names': dict(self._names)
+        }
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Date-aligned time series of many countries
+
+compare_series() reads the case rows of up to MAX_COMPARE_COUNTRIES
+countries with one primary key query (CovidStorage.get_country_columns)
+and pivots them into a dense countries x days matrix with NumPy, so every
+country has a value on every day of the common date range. Values are
+cumulative: a day between two observations carries the earlier one
+forward, days before a country's first observation are NaN.
+
+per_day turns the cumulative counts into daily increases, spreading the
+increase between two observations evenly over the days in between like
+case_metrics does. per_capita divides by the country's population and
+reports values per PER_CAPITA people, NaN where the population is unknown.
+"""
+
+import numpy as np
+
+from countries import canonicalize_country, get_population
+from storage import CASE_METRICS, from_day_number, to_day_number
+
+MAX_COMPARE_COUNTRIES = 100
+PER_CAPITA = 100000
+# Days read before the start date, so its value can come from an earlier observation
+LOOKBACK_DAYS = 31
+
+
+def _fill_forward(matrix, observed):
+    """Give every cell the last observed value at or before it in its row, NaN before the first"""
+    index = np.where(observed, np.arange(matrix.shape[1]), -1)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = matrix[np.arange(matrix.shape[0])[:, None], np.maximum(index, 0)]
+    filled[index < 0] = np.nan
+    return filled
+
+
+def _fill_backward(matrix, observed):
+    """Give every cell the first observed value at or after it in its row, NaN after the last"""
+    return _fill_forward(matrix[:, ::-1], observed[:, ::-1])[:, ::-1]
+
+
+def _daily_increase(country_ids, days, cumulative):
+    """Increase per day since the previous row of the same country, NaN for a country's first row"""
+    increase = np.full(len(days), np.nan)
+    if len(days) > 1:
+        same_series = country_ids[1:] == country_ids[:-1]
+        increase[1:] = np.where(same_series, (cumulative[1:] - cumulative[:-1]) / np.maximum(days[1:] - days[:-1], 1),
+                                np.nan)
+    return increase
+
+
+def compare_series(covid_db, countries, metric='confirmed', per_capita=False, per_day=False,
+                   start=None, end=None):
+    """Date-aligned series of a metric for up to MAX_COMPARE_COUNTRIES countries
+
+    Returns a dict with the 'countries' found (in the order asked for),
+    their ISO 'dates', 'values' (float64 matrix, one row per country, NaN
+    where undefined), the 'unknown' countries without rows in range and
+    the countries with 'no_population' when per_capita is set. Raises
+    ValueError for too many countries or an unknown metric.
+    """
+    if metric not in CASE_METRICS:
+        raise ValueError(f"metric must be one of {', '.join(CASE_METRICS)}")
+    names = list(dict.fromkeys(canonicalize_country(country) for country in countries))
+    if len(names) > MAX_COMPARE_COUNTRIES:
+        raise ValueError(f"At most {MAX_COMPARE_COUNTRIES} countries can be compared")
+
+    first = to_day_number(start) if start is not None else None
+    origin = first - LOOKBACK_DAYS if first is not None else None
+    columns = covid_db.get_country_columns(names, from_day_number(origin) if origin is not None else None, end)
+    country_ids = np.asarray(columns['country_ids'], dtype=np.int64)
+    days = np.asarray(columns['days'], dtype=np.int64)
+    values = np.asarray(columns['values'], dtype=np.float64).reshape(-1, len(CASE_METRICS))
+    values = values[:, CASE_METRICS.index(metric)]
+
+    ids_by_name = {name: cid for cid, name in columns['names'].items()}
+    found = [name for name in names if name in ids_by_name]
+    result = {
+        'countries': found,
+        'dates': [],
+        'values': np.empty((len(found), 0)),
+        'metric': metric,
+        'per_capita': per_capita,
+        'per_day': per_day,
+        'unknown': [name for name in names if name not in ids_by_name],
+        'no_population': []
+    }
+    if not found:
+        return result
+
+    if first is None:
+        first = origin = int(days.min())
+    last = to_day_number(end) if end is not None else int(days.max())
+    if last < first:
+        return result
+    if per_day:
+        values = _daily_increase(country_ids, days, values)
+
+    # One row per country in the order asked for, one column per day
+    order = np.array([ids_by_name[name] for name in found], dtype=np.int64)
+    sorter = np.argsort(order)
+    rows = sorter[np.searchsorted(order, country_ids, sorter=sorter)]
+    matrix = np.full((len(found), last - origin + 1), np.nan)
+    observed = np.zeros(matrix.shape, dtype=bool)
+    matrix[rows, days - origin] = values
+    observed[rows, days - origin] = True
+
+    # Cumulative values hold until the next observation, an increase is spread back over its gap
+    matrix = (_fill_backward if per_day else _fill_forward)(matrix, observed)
+    matrix = matrix[:, first - origin:]
+
+    if per_capita:
+        population = np.array([get_population(name) or np.nan for name in found], dtype=np.float64)
+        matrix = matrix / population[:, None] * PER_CAPITA
+        result['no_population'] = [name for name, size in zip(found, population) if np.isnan(size)]
+
+    result['dates'] = np.arange(first, last + 1).astype('datetime64[D]').astype(str).tolist()
+    result['values'] = matrix
+    return result
+
+
+def series_to_json(result, decimals=4):
+    """compare_series() result with the matrix as {country: [value or None, ...]}"""
+    values = np.round(result['values'], decimals).astype(object)
+    values[np.isnan(result['values'])] = None
+    data = {key: value for key, value in result.items() if key != 'values'}
+    data['series'] = dict(zip(result['countries'], values.tolist()))
+    return data
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Country reference data
+
+Canonical country names with their ISO 3166-1 alpha-2 / alpha-3 codes and
+common alternative spellings. Used to seed the `countries` dimension table.
+Also the population of each country, for per-capita comparisons.
+"""
+
+# (canonical name, ISO2, ISO3, aliases)
+COUNTRIES = [
+    ('Afghanistan', 'AF', 'AFG', ()),
+    ('Albania', 'AL', 'ALB', ()),
+    ('Algeria', 'DZ', 'DZA', ()),
+    ('Andorra', 'AD', 'AND', ()),
+    ('Angola', 'AO', 'AGO', ()),
+    ('Antigua and Barbuda', 'AG', 'ATG', ('Antigua & Barbuda',)),
+    ('Argentina', 'AR', 'ARG', ()),
+    ('Armenia', 'AM', 'ARM', ()),
+    ('Australia', 'AU', 'AUS', ()),
+    ('Austria', 'AT', 'AUT', ()),
+    ('Azerbaijan', 'AZ', 'AZE', ()),
+    ('Bahamas', 'BS', 'BHS', ('The Bahamas', 'Bahamas, The')),
+    ('Bahrain', 'BH', 'BHR', ()),
+    ('Bangladesh', 'BD', 'BGD', ()),
+    ('Barbados', 'BB', 'BRB', ()),
+    ('Belarus', 'BY', 'BLR', ()),
+    ('Belgium', 'BE', 'BEL', ()),
+    ('Belize', 'BZ', 'BLZ', ()),
+    ('Benin', 'BJ', 'BEN', ()),
+    ('Bhutan', 'BT', 'BTN', ()),
+    ('Bolivia', 'BO', 'BOL', ('Plurinational State of Bolivia',)),
+    ('Bosnia and Herzegovina', 'BA', 'BIH', ('Bosnia', 'Bosnia & Herzegovina')),
+    ('Botswana', 'BW', 'BWA', ()),
+    ('Brazil', 'BR', 'BRA', ('Brasil',)),
+    ('Brunei', 'BN', 'BRN', ('Brunei Darussalam',)),
+    ('Bulgaria', 'BG', 'BGR', ()),
+    ('Burkina Faso', 'BF', 'BFA', ()),
+    ('Burundi', 'BI', 'BDI', ()),
+    ('Cabo Verde', 'CV', 'CPV', ('Cape Verde',)),
+    ('Cambodia', 'KH', 'KHM', ()),
+    ('Cameroon', 'CM', 'CMR', ()),
+    ('Canada', 'CA', 'CAN', ()),
+    ('Central African Republic', 'CF', 'CAF', ('CAR',)),
+    ('Chad', 'TD', 'TCD', ()),
+    ('Chile', 'CL', 'CHL', ()),
+    ('China', 'CN', 'CHN', ('Mainland China', "People's Republic of China", 'PRC')),
+    ('Colombia', 'CO', 'COL', ()),
+    ('Comoros', 'KM', 'COM', ()),
+    ('Congo', 'CG', 'COG', ('Republic of the Congo', 'Congo (Brazzaville)', 'Congo-Brazzaville')),
+    ('Costa Rica', 'CR', 'CRI', ()),
+    ("Cote d'Ivoire", 'CI', 'CIV', ('Ivory Coast', "Côte d'Ivoire")),
+    ('Croatia', 'HR', 'HRV', ()),
+    ('Cuba', 'CU', 'CUB', ()),
+    ('Cyprus', 'CY', 'CYP', ()),
+    ('Czechia', 'CZ', 'CZE', ('Czech Republic',)),
+    ('Democratic Republic of the Congo', 'CD', 'COD', ('DRC', 'DR Congo', 'Congo (Kinshasa)', 'Congo-Kinshasa')),
+    ('Denmark', 'DK', 'DNK', ()),
+    ('Djibouti', 'DJ', 'DJI', ()),
+    ('Dominica', 'DM', 'DMA', ()),
+    ('Dominican Republic', 'DO', 'DOM', ()),
+    ('Ecuador', 'EC', 'ECU', ()),
+    ('Egypt', 'EG', 'EGY', ()),
+    ('El Salvador', 'SV', 'SLV', ()),
+    ('Equatorial Guinea', 'GQ', 'GNQ', ()),
+    ('Eritrea', 'ER', 'ERI', ()),
+    ('Estonia', 'EE', 'EST', ()),
+    ('Eswatini', 'SZ', 'SWZ', ('Swaziland',)),
+    ('Ethiopia', 'ET', 'ETH', ()),
+    ('Fiji', 'FJ', 'FJI', ()),
+    ('Finland', 'FI', 'FIN', ()),
+    ('France', 'FR', 'FRA', ()),
+    ('Gabon', 'GA', 'GAB', ()),
+    ('Gambia', 'GM', 'GMB', ('The Gambia', 'Gambia, The')),
+    ('Georgia', 'GE', 'GEO', ()),
+    ('Germany', 'DE', 'DEU', ('Deutschland',)),
+    ('Ghana', 'GH', 'GHA', ()),
+    ('Greece', 'GR', 'GRC', ()),
+    ('Grenada', 'GD', 'GRD', ()),
+    ('Guatemala', 'GT', 'GTM', ()),
+    ('Guinea', 'GN', 'GIN', ()),
+    ('Guinea-Bissau', 'GW', 'GNB', ('Guinea Bissau',)),
+    ('Guyana', 'GY', 'GUY', ()),
+    ('Haiti', 'HT', 'HTI', ()),
+    ('Honduras', 'HN', 'HND', ()),
+    ('Hungary', 'HU', 'HUN', ()),
+    ('Iceland', 'IS', 'ISL', ()),
+    ('India', 'IN', 'IND', ()),
+    ('Indonesia', 'ID', 'IDN', ()),
+    ('Iran', 'IR', 'IRN', ('Islamic Republic of Iran', 'Iran, Islamic Republic of')),
+    ('Iraq', 'IQ', 'IRQ', ()),
+    ('Ireland', 'IE', 'IRL', ('Republic of Ireland',)),
+    ('Israel', 'IL', 'ISR', ()),
+    ('Italy', 'IT', 'ITA', ('Italia',)),
+    ('Jamaica', 'JM', 'JAM', ()),
+    ('Japan', 'JP', 'JPN', ()),
+    ('Jordan', 'JO', 'JOR', ()),
+    ('Kazakhstan', 'KZ', 'KAZ', ()),
+    ('Kenya', 'KE', 'KEN', ()),
+    ('Kiribati', 'KI', 'KIR', ()),
+    ('Kosovo', 'XK', 'XKX', ()),
+    ('Kuwait', 'KW', 'KWT', ()),
+    ('Kyrgyzstan', 'KG', 'KGZ', ('Kyrgyz Republic',)),
+    ('Laos', 'LA', 'LAO', ("Lao People's Democratic Republic", 'Lao PDR')),
+    ('Latvia', 'LV', 'LVA', ()),
+    ('Lebanon', 'LB', 'LBN', ()),
+    ('Lesotho', 'LS', 'LSO', ()),
+    ('Liberia', 'LR', 'LBR', ()),
+    ('Libya', 'LY', 'LBY', ()),
+    ('Liechtenstein', 'LI', 'LIE', ()),
+    ('Lithuania', 'LT', 'LTU', ()),
+    ('Luxembourg', 'LU', 'LUX', ()),
+    ('Madagascar', 'MG', 'MDG', ()),
+    ('Malawi', 'MW', 'MWI', ()),
+    ('Malaysia', 'MY', 'MYS', ()),
+    ('Maldives', 'MV', 'MDV', ()),
+    ('Mali', 'ML', 'MLI', ()),
+    ('Malta', 'MT', 'MLT', ()),
+    ('Marshall Islands', 'MH', 'MHL', ()),
+    ('Mauritania', 'MR', 'MRT', ()),
+    ('Mauritius', 'MU', 'MUS', ()),
+    ('Mexico', 'MX', 'MEX', ('México',)),
+    ('Micronesia', 'FM', 'FSM', ('Federated States of Micronesia',)),
+    ('Moldova', 'MD', 'MDA', ('Republic of Moldova',)),
+    ('Monaco', 'MC', 'MCO', ()),
+    ('Mongolia', 'MN', 'MNG', ()),
+    ('Montenegro', 'ME', 'MNE', ()),
+    ('Morocco', 'MA', 'MAR', ()),
+    ('Mozambique', 'MZ', 'MOZ', ()),
+    ('Myanmar', 'MM', 'MMR', ('Burma',)),
+    ('Namibia', 'NA', 'NAM', ()),
+    ('Nauru', 'NR', 'NRU', ()),
+    ('Nepal', 'NP', 'NPL', ()),
+    ('Netherlands', 'NL', 'NLD', ('The Netherlands', 'Holland')),
+    ('New Zealand', 'NZ', 'NZL', ()),
+    ('Nicaragua', 'NI', 'NIC', ()),
+    ('Niger', 'NE', 'NER', ()),
+    ('Nigeria', 'NG', 'NGA', ()),
+    ('North Korea', 'KP', 'PRK', ("Democratic People's Republic of Korea", 'DPRK', 'Korea, North')),
+    ('North Macedonia', 'MK', 'MKD', ('Macedonia',)),
+    ('Norway', 'NO', 'NOR', ()),
+    ('Oman', 'OM', 'OMN', ()),
+    ('Pakistan', 'PK', 'PAK', ()),
+    ('Palau', 'PW', 'PLW', ()),
+    ('Palestine', 'PS', 'PSE', ('State of Palestine', 'West Bank and Gaza')),
+    ('Panama', 'PA', 'PAN', ()),
+    ('Papua New Guinea', 'PG', 'PNG', ()),
+    ('Paraguay', 'PY', 'PRY', ()),
+    ('Peru', 'PE', 'PER', ()),
+    ('Philippines', 'PH', 'PHL', ('The Philippines',)),
+    ('Poland', 'PL', 'POL', ()),
+    ('Portugal', 'PT', 'PRT', ()),
+    ('Qatar', 'QA', 'QAT', ()),
+    ('Romania', 'RO', 'ROU', ()),
+    ('Russia', 'RU', 'RUS', ('Russian Federation',)),
+    ('Rwanda', 'RW', 'RWA', ()),
+    ('Saint Kitts and Nevis', 'KN', 'KNA', ('St. Kitts and Nevis',)),
+    ('Saint Lucia', 'LC', 'LCA', ('St. Lucia',)),
+    ('Saint Vincent and the Grenadines', 'VC', 'VCT', ('St. Vincent and the Grenadines',)),
+    ('Samoa', 'WS', 'WSM', ()),
+    ('San Marino', 'SM', 'SMR', ()),
+    ('Sao Tome and Principe', 'ST', 'STP', ('São Tomé and Príncipe',)),
+    ('Saudi Arabia', 'SA', 'SAU', ('KSA',)),
+    ('Senegal', 'SN', 'SEN', ()),
+    ('Serbia', 'RS', 'SRB', ()),
+    ('Seychelles', 'SC', 'SYC', ()),
+    ('Sierra Leone', 'SL', 'SLE', ()),
+    ('Singapore', 'SG', 'SGP', ()),
+    ('Slovakia', 'SK', 'SVK', ('Slovak Republic',)),
+    ('Slovenia', 'SI', 'SVN', ()),
+    ('Solomon Islands', 'SB', 'SLB', ()),
+    ('Somalia', 'SO', 'SOM', ()),
+    ('South Africa', 'ZA', 'ZAF', ('RSA',)),
+    ('South Korea', 'KR', 'KOR', ('Korea', 'Republic of Korea', 'Korea, South', 'Korea, Republic of')),
+    ('South Sudan', 'SS', 'SSD', ()),
+    ('Spain', 'ES', 'ESP', ('España',)),
+    ('Sri Lanka', 'LK', 'LKA', ()),
+    ('Sudan', 'SD', 'SDN', ()),
+    ('Suriname', 'SR', 'SUR', ()),
+    ('Sweden', 'SE', 'SWE', ()),
+    ('Switzerland', 'CH', 'CHE', ()),
+    ('Syria', 'SY', 'SYR', ('Syrian Arab Republic',)),
+    ('Taiwan', 'TW', 'TWN', ('Taiwan*', 'Republic of China')),
+    ('Tajikistan', 'TJ', 'TJK', ()),
+    ('Tanzania', 'TZ', 'TZA', ('United Republic of Tanzania',)),
+    ('Thailand', 'TH', 'THA', ()),
+    ('Timor-Leste', 'TL', 'TLS', ('East Timor',)),
+    ('Togo', 'TG', 'TGO', ()),
+    ('Tonga', 'TO', 'TON', ()),
+    ('Trinidad and Tobago', 'TT', 'TTO', ('Trinidad & Tobago',)),
+    ('Tunisia', 'TN', 'TUN', ()),
+    ('Turkey', 'TR', 'TUR', ('Türkiye', 'Turkiye')),
+    ('Turkmenistan', 'TM', 'TKM', ()),
+    ('Tuvalu', 'TV', 'TUV', ()),
+    ('Uganda', 'UG', 'UGA', ()),
+    ('Ukraine', 'UA', 'UKR', ()),
+    ('United Arab Emirates', 'AE', 'ARE', ('UAE', 'Emirates')),
+    ('United Kingdom', 'GB', 'GBR', ('UK', 'U.K.', 'Great Britain', 'Britain', 'England')),
+    ('United States', 'US', 'USA', ('US', 'USA', 'U.S.', 'U.S.A.', 'United States of America', 'America')),
+    ('Uruguay', 'UY', 'URY', ()),
+    ('Uzbekistan', 'UZ', 'UZB', ()),
+    ('Vanuatu', 'VU', 'VUT', ()),
+    ('Vatican City', 'VA', 'VAT', ('Holy See', 'Vatican')),
+    ('Venezuela', 'VE', 'VEN', ('Bolivarian Republic of Venezuela',)),
+    ('Vietnam', 'VN', 'VNM', ('Viet Nam',)),
+    ('Yemen', 'YE', 'YEM', ()),
+    ('Zambia', 'ZM', 'ZMB', ()),
+    ('Zimbabwe', 'ZW', 'ZWE', ()),
+]
+
+# Mid-2020 population in thousands by ISO3 code (UN World Population Prospects
+# 2019, Kosovo from its statistics agency), for per-capita figures
+POPULATION_THOUSANDS = {
+    'AFG': 38928, 'ALB': 2878, 'DZA': 43851, 'AND': 77, 'AGO': 32866, 'ATG': 98, 'ARG': 45196, 'ARM': 2963,
+    'AUS': 25500, 'AUT': 9006, 'AZE': 10139, 'BHS': 393, 'BHR': 1702, 'BGD': 164689, 'BRB': 287, 'BLR': 9449,
+    'BEL': 11590, 'BLZ': 398, 'BEN': 12123, 'BTN': 772, 'BOL': 11673, 'BIH': 3281, 'BWA': 2352, 'BRA': 212559,
+    'BRN': 437, 'BGR': 6948, 'BFA': 20903, 'BDI': 11891, 'CPV': 556, 'KHM': 16719, 'CMR': 26546, 'CAN': 37742,
+    'CAF': 4830, 'TCD': 16426, 'CHL': 19116, 'CHN': 1439324, 'COL': 50883, 'COM': 870, 'COG': 5518, 'CRI': 5094,
+    'CIV': 26378, 'HRV': 4105, 'CUB': 11327, 'CYP': 1207, 'CZE': 10709, 'COD': 89561, 'DNK': 5792, 'DJI': 988,
+    'DMA': 72, 'DOM': 10848, 'ECU': 17643, 'EGY': 102334, 'SLV': 6486, 'GNQ': 1403, 'ERI': 3546, 'EST': 1327,
+    'SWZ': 1160, 'ETH': 114964, 'FJI': 896, 'FIN': 5541, 'FRA': 65274, 'GAB': 2226, 'GMB': 2417, 'GEO': 3989,
+    'DEU': 83784, 'GHA': 31073, 'GRC': 10423, 'GRD': 113, 'GTM': 17916, 'GIN': 13133, 'GNB': 1968, 'GUY': 787,
+    'HTI': 11403, 'HND': 9905, 'HUN': 9660, 'ISL': 341, 'IND': 1380004, 'IDN': 273524, 'IRN': 83993, 'IRQ': 40223,
+    'IRL': 4938, 'ISR': 8656, 'ITA': 60462, 'JAM': 2961, 'JPN': 126476, 'JOR': 10203, 'KAZ': 18777, 'KEN': 53771,
+    'KIR': 119, 'XKX': 1775, 'KWT': 4271, 'KGZ': 6524, 'LAO': 7276, 'LVA': 1886, 'LBN': 6825, 'LSO': 2142,
+    'LBR': 5058, 'LBY': 6871, 'LIE': 38, 'LTU': 2722, 'LUX': 626, 'MDG': 27691, 'MWI': 19130, 'MYS': 32366,
+    'MDV': 541, 'MLI': 20251, 'MLT': 442, 'MHL': 59, 'MRT': 4650, 'MUS': 1272, 'MEX': 128933, 'FSM': 115,
+    'MDA': 4034, 'MCO': 39, 'MNG': 3278, 'MNE': 628, 'MAR': 36911, 'MOZ': 31255, 'MMR': 54410, 'NAM': 2541,
+    'NRU': 11, 'NPL': 29137, 'NLD': 17135, 'NZL': 4822, 'NIC': 6625, 'NER': 24207, 'NGA': 206140, 'PRK': 25779,
+    'MKD': 2083, 'NOR': 5421, 'OMN': 5107, 'PAK': 220892, 'PLW': 18, 'PSE': 5101, 'PAN': 4315, 'PNG': 8947,
+    'PRY': 7133, 'PER': 32972, 'PHL': 109581, 'POL': 37847, 'PRT': 10197, 'QAT': 2881, 'ROU': 19238, 'RUS': 145934,
+    'RWA': 12952, 'KNA': 53, 'LCA': 184, 'VCT': 111, 'WSM': 198, 'SMR': 34, 'STP': 219, 'SAU': 34814,
+    'SEN': 16744, 'SRB': 8737, 'SYC': 98, 'SLE': 7977, 'SGP': 5850, 'SVK': 5460, 'SVN': 2079, 'SLB': 687,
+    'SOM': 15893, 'ZAF': 59309, 'KOR': 51269, 'SSD': 11194, 'ESP': 46755, 'LKA': 21413, 'SDN': 43849, 'SUR': 587,
+    'SWE': 10099, 'CHE': 8655, 'SYR': 17501, 'TWN': 23817, 'TJK': 9538, 'TZA': 59734, 'THA': 69800, 'TLS': 1318,
+    'TGO': 8279, 'TON': 106, 'TTO': 1399, 'TUN': 11819, 'TUR': 84339, 'TKM': 6031, 'TUV': 12, 'UGA': 45741,
+    'UKR': 43734, 'ARE': 9890, 'GBR': 67886, 'USA': 331003, 'URY': 3474, 'UZB': 33469, 'VUT': 307, 'VAT': 0.8,
+    'VEN': 28436, 'VNM': 97339, 'YEM': 29826, 'ZMB': 18384, 'ZWE': 14863,
+}
+
+_alias_index = None
+_iso3_index = None
+
+
+def _lookup_key(name):
+    """Loose form of a name used for alias lookups: no accents, case, dots or extra spaces"""
+    import unicodedata
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch))
+    name = name.casefold().replace('\u2019', "'").replace('&', ' and ').replace('.', '').replace('*', '')
+    return ' '.join(name.split())
+
+
+def _build_indexes():
+    """Build the alias -> canonical name and canonical name -> ISO3 hash maps once"""
+    global _alias_index, _iso3_index
+    alias_index = {}
+    iso3_index = {}
+    for name, iso2, iso3, aliases in COUNTRIES:
+        iso3_index[name] = iso3
+        for alias in (name, iso2, iso3) + tuple(aliases):
+            alias_index.setdefault(_lookup_key(alias), name)
+    _alias_index, _iso3_index = alias_index, iso3_index
+
+
+def canonicalize_country(name):
+    """Return the canonical name for a country name, alias or ISO code
+    
+    Unknown names are returned trimmed and title cased.
+    """
+    if _alias_index is None:
+        _build_indexes()
+    if name is None:
+        return None
+    canonical = _alias_index.get(_lookup_key(name))
+    if canonical is not None:
+        return canonical
+    return ' '.join(str(name).split()).title()
+
+
+def get_iso3(name):
+    """ISO 3166-1 alpha-3 code of a country, None if it isn't a known country"""
+    if _iso3_index is None:
+        _build_indexes()
+    return _iso3_index.get(canonicalize_country(name))
+
+
+def get_population(name):
+    """Population of a country (mid-2020 estimate), None if it is unknown"""
+    thousands = POPULATION_THOUSANDS.get(get_iso3(name))
+    return round(thousands * 1000) if thousands is not None else None
@@ -1,61 +1,249 @@
-import pandas as pd
+# -*- coding: utf-8 -*-
+"""
+Synthetic COVID-19 dataset generator
+
+Every country follows its own epidemic curve from a seeded SIRS model
+(waning immunity and seasonal forcing give several waves), simulated for
+all countries of a chunk at once with NumPy. Reported daily cases are
+Poisson noise around the model's incidence, so cumulative confirmed,
+deaths and recovered never decrease and active never goes negative.
+
+Rows are produced in chunks of whole countries and streamed to CSV,
+SQLite (through CovidDatabase.reload_cases) or Arrow/Parquet files, so
+datasets far larger than memory can be written. The same arguments
+always give the same data.
+
+    python create_sample_data.py                                   # covid_data.csv, 20 x 100
+    python create_sample_data.py --countries 50000 --days 1000 --format sqlite --output data/load.db
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
 import numpy as np
-from datetime import datetime, timedelta
+import pandas as pd
+
+from countries import COUNTRIES
+from storage import CASE_METRICS, EPOCH, to_day_number
+
+# Countries of the original 20 country sample, used first
+SAMPLE_COUNTRIES = [
+    'United States', 'India', 'Brazil', 'United Kingdom', 'France',
+    'Germany', 'Italy', 'Spain', 'Canada', 'Australia',
+    'Japan', 'South Korea', 'China', 'Mexico', 'Argentina',
+    'Russia', 'Turkey', 'Netherlands', 'Belgium', 'Sweden'
+]
+DEFAULT_START = date(2020, 1, 22)
+DEFAULT_CHUNK_ROWS = 1_000_000
+FORMATS = ('csv', 'sqlite', 'arrow', 'parquet')
+
+# Days from infection to a reported recovery or death
+RECOVERY_LAG = 14
+DEATH_LAG = 18
+
+
+def country_names(count):
+    """`count` distinct names: the sample countries, the other known ones, then regions"""
+    names = SAMPLE_COUNTRIES + [country[0] for country in COUNTRIES if country[0] not in SAMPLE_COUNTRIES]
+    names = names[:count]
+    names += [f'Region {i:05d}' for i in range(1, count - len(names) + 1)]
+    return names
+
+
+def _lagged(values, lag):
+    """values shifted `lag` days later along axis 1, zero filled"""
+    shifted = np.zeros_like(values)
+    if lag < values.shape[1]:
+        shifted[:, lag:] = values[:, :values.shape[1] - lag]
+    return shifted
+
+
+def simulate_countries(rng, count, days, noise=0.1):
+    """Cumulative (confirmed, deaths, recovered, active) for `count` countries
+
+    Returns four int64 arrays of shape (count, days).
+    """
+    population = np.clip(rng.lognormal(15.5, 1.6, count), 5e4, 1.5e9)
+    r0 = rng.uniform(1.3, 3.5, count)
+    gamma = 1 / rng.uniform(5, 12, count)
+    beta = r0 * gamma
+    waning = 1 / rng.uniform(120, 400, count)
+    phase = rng.uniform(0, 2 * np.pi, count)
+    onset = rng.integers(0, max(1, days // 5), count)
+    detected = rng.uniform(0.05, 0.5, count)
+    fatality = rng.uniform(0.002, 0.03, count)
+
+    susceptible = population.copy()
+    infected = np.zeros(count)
+    recovered = np.zeros(count)
+    incidence = np.empty((count, days))
+    seeds = population * rng.uniform(1e-6, 1e-4, count)
+
+    # Discrete SIRS step for every country of the chunk at once
+    for day in range(days):
+        infected = np.where(onset == day, infected + seeds, infected)
+        season = 1 + 0.25 * np.sin(2 * np.pi * day / 365 + phase)
+        new = np.minimum(beta * season * susceptible * infected / population, susceptible)
+        cured = gamma * infected
+        immunity_lost = waning * recovered
+        susceptible += immunity_lost - new
+        infected += new - cured
+        recovered += cured - immunity_lost
+        incidence[:, day] = new
+
+    # Reported new cases: a detected share, multiplicative and Poisson noise
+    expected = incidence * detected[:, None]
+    if noise > 0:
+        expected *= rng.lognormal(-noise * noise / 2, noise, expected.shape)
+    confirmed = np.cumsum(rng.poisson(expected), axis=1)
+    deaths = np.floor(_lagged(confirmed, DEATH_LAG) * fatality[:, None]).astype(np.int64)
+    cured = np.floor(_lagged(confirmed, RECOVERY_LAG) * (1 - fatality[:, None])).astype(np.int64)
+    return confirmed, deaths, cured, confirmed - deaths - cured
+
+
+def generate_chunks(countries=20, days=100, start=DEFAULT_START, seed=0, noise=0.1,
+                    chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield the dataset as dicts of column arrays, about chunk_rows rows each
+
+    Columns are 'country' (names), 'day' (days since 1970-01-01) and
+    CASE_METRICS, rows ordered by country then day.
+    """
+    names = np.array(country_names(countries), dtype=object)
+    day_numbers = np.arange(days, dtype=np.int32) + to_day_number(start)
+    per_chunk = max(1, chunk_rows // max(days, 1))
+    rng = np.random.default_rng(seed)
 
-def create_sample_covid_data():
+    for first in range(0, countries, per_chunk):
+        count = min(per_chunk, countries - first)
+        curves = simulate_countries(rng, count, days, noise)
+        chunk = {'country': np.repeat(names[first:first + count], days),
+                 'day': np.tile(day_numbers, count)}
+        chunk.update({metric: curve.ravel() for metric, curve in zip(CASE_METRICS, curves)})
+        yield chunk
+
+
+def chunk_rows_of(chunks):
+    """(country, date, confirmed, deaths, recovered, active) tuples, as insert_cases takes them"""
+    dates = {}
+    for chunk in chunks:
+        for day in np.unique(chunk['day']).tolist():
+            if day not in dates:
+                dates[day] = EPOCH + timedelta(days=day)
+        yield from zip(chunk['country'].tolist(), map(dates.__getitem__, chunk['day'].tolist()),
+                       *(chunk[metric].tolist() for metric in CASE_METRICS))
+
+
+def _frame(chunk):
+    """A chunk as a DataFrame with ISO date strings, in the CSV column order"""
+    frame = pd.DataFrame({
+        'date': np.datetime_as_string(chunk['day'].astype('datetime64[D]')),
+        'country': chunk['country']
+    })
+    for metric in CASE_METRICS:
+        frame[metric] = chunk[metric]
+    return frame
+
+
+def write_csv(path, chunks):
+    """Stream chunks to a CSV file, returns the number of rows written"""
+    written = 0
+    with open(path, 'w', newline='') as f:
+        for i, chunk in enumerate(chunks):
+            _frame(chunk).to_csv(f, header=i == 0, index=False)
+            written += len(chunk['day'])
+    return written
+
+
+def write_sqlite(path, chunks):
+    """Replace the case data of a covid database with the chunks, returns the row count"""
+    from database import CovidDatabase
+
+    return CovidDatabase(path).reload_cases(chunk_rows_of(chunks))
+
+
+def write_arrow(path, chunks, file_format='arrow'):
+    """Stream chunks to an Arrow IPC or Parquet file, returns the row count"""
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    schema = pa.schema([('country', pa.string()), ('date', pa.date32())]
+                       + [(metric, pa.int64()) for metric in CASE_METRICS])
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        writer = pa.parquet.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(pa.OSFile(path, 'wb'), schema)
+
+    written = 0
+    with writer:
+        for chunk in chunks:
+            batch = pa.record_batch(
+                [pa.array(chunk['country'], pa.string()),
+                 pa.array(chunk['day'].astype('datetime64[D]'), pa.date32())]
+                + [pa.array(chunk[metric]) for metric in CASE_METRICS],
+                schema=schema
+            )
+            writer.write_batch(batch)
+            written += batch.num_rows
+    return written
+
+
+def write_dataset(path, file_format='csv', **options):
+    """Generate a dataset (see generate_chunks for options) straight into a file"""
+    if file_format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    chunks = generate_chunks(**options)
+    if file_format == 'csv':
+        return write_csv(path, chunks)
+    if file_format == 'sqlite':
+        return write_sqlite(path, chunks)
+    return write_arrow(path, chunks, file_format)
+
+
+def create_sample_covid_data(countries=20, days=100, seed=0, noise=0.1, output='covid_data.csv'):
     """Create sample COVID-19 dataset"""
-    
-    countries = [
-        'United States', 'India', 'Brazil', 'United Kingdom', 'France',
-        'Germany', 'Italy', 'Spain', 'Canada', 'Australia',
-        'Japan', 'South Korea', 'China', 'Mexico', 'Argentina',
-        'Russia', 'Turkey', 'Netherlands', 'Belgium', 'Sweden'
-    ]
-    
-    start_date = datetime.now() - timedelta(days=100)
-    dates = [start_date + timedelta(days=i) for i in range(100)]
-    
-    data = []
-    
-    for country in countries:
-        base_confirmed = np.random.randint(100000, 5000000)
-        base_deaths = int(base_confirmed * np.random.uniform(0.01, 0.03))
-        base_recovered = int(base_confirmed * np.random.uniform(0.80, 0.95))
-        
-        for i, date in enumerate(dates):
-            growth = 1 + (i / 100) * np.random.uniform(0.1, 0.3)
-            
-            confirmed = int(base_confirmed * growth + np.random.randint(-10000, 50000))
-            deaths = int(base_deaths * growth + np.random.randint(-100, 1000))
-            recovered = int(base_recovered * growth + np.random.randint(-5000, 20000))
-            active = confirmed - deaths - recovered
-            
-            data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'country': country,
-                'confirmed': max(0, confirmed),
-                'deaths': max(0, deaths),
-                'recovered': max(0, recovered),
-                'active': max(0, active)
-            })
-            
-            base_confirmed = confirmed
-            base_deaths = deaths
-            base_recovered = recovered
-    
-    df = pd.DataFrame(data)
-    df.to_csv('covid_data.csv', index=False)
-    
+    write_dataset(output, 'csv', countries=countries, days=days, seed=seed, noise=noise)
+    df = pd.read_csv(output)
+
     print("=" * 60)
     print("Sample Dataset Created!")
     print("=" * 60)
     print(f"✓ Records: {len(df):,}")
-    print(f"✓ Countries: {len(countries)}")
+    print(f"✓ Countries: {df['country'].nunique()}")
     print(f"✓ Date range: {df['date'].min()} to {df['date'].max()}")
-    print(f"✓ Saved as: covid_data.csv")
+    print(f"✓ Saved as: {output}")
     print("=" * 60)
-    
+
     return df
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic COVID-19 dataset')
+    parser.add_argument('--countries', type=int, default=20)
+    parser.add_argument('--days', type=int, default=100)
+    parser.add_argument('--start', default=DEFAULT_START.isoformat(), help='first date (YYYY-MM-DD)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--noise', type=float, default=0.1, help='log-normal sigma of the daily noise')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--output', default='covid_data.csv')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    started = time.perf_counter()
+    rows = write_dataset(args.output, args.format, countries=args.countries, days=args.days,
+                         start=args.start, seed=args.seed, noise=args.noise, chunk_rows=args.chunk_rows)
+    elapsed = time.perf_counter() - started
+    print(f"✓ {rows:,} rows ({args.countries:,} countries x {args.days:,} days) written to "
+          f"{args.output} in {elapsed:.1f}s ({elapsed / max(rows, 1) * 1e6:.2f}s per million)")
+
+
 if __name__ == "__main__":
-    create_sample_covid_data()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        main()
+    else:
+        create_sample_covid_data()
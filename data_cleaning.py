@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from countries import canonicalize_country
 
 class CovidDataCleaner:
     def __init__(self, filepath):
@@ -57,9 +58,12 @@ class CovidDataCleaner:
                 # Convert to integer
                 df_clean[col] = df_clean[col].astype(int)
         
-        # Standardize country names
+        # Standardize country names, resolving aliases like 'USA' or 'UK'
         if 'country' in df_clean.columns:
-            df_clean['country'] = df_clean['country'].str.strip().str.title()
+            names = df_clean['country'].unique()
+            df_clean['country'] = df_clean['country'].map(
+                {name: canonicalize_country(name) for name in names}
+            )
         
         self.df = df_clean
         print(f"Data cleaned successfully: {self.df.shape}")
@@ -2,50 +2,324 @@
 import sqlite3
 import bcrypt
 from datetime import datetime
-import pandas as pd
 import os
+import threading
+from itertools import islice
+from login_limiter import login_limiter, LoginRateLimited
+from countries import canonicalize_country
+import query_stats
+import telemetry
+from storage import (CovidStorage, CASE_METRICS, CHANGE_PAGE_ROWS, COUNTRY_PAGE_ROWS, EXPORT_PAGE_ROWS,
+                     GRANULARITIES, change_row, check_country_query, country_page, to_day_number, from_day_number)
 
-class CovidDatabase:
+# PRAGMA user_version of an up to date database file; bump it whenever
+# create_tables() changes so existing files are migrated on their next open
+COVID_SCHEMA_VERSION = 3
+USER_SCHEMA_VERSION = 1
+
+# Changes kept in case_changes once the rollups have applied them, for change
+# feed clients and mirrors that are catching up
+CHANGE_LOG_RETENTION = 100000
+
+# Oldest data version the change log can bring up to date: versions before a
+# full reload or a prune have to start over from a full load
+LOG_FLOOR_SQL = "SELECT MAX(value) FROM db_meta WHERE key IN ('reload_seq', 'pruned_seq')"
+
+# Rollup table and SQL for the first day (as a day number) of each bucket
+ROLLUP_TABLES = {
+    'week': ('cases_weekly', "day - (((day + 3) % 7) + 7) % 7"),
+    'month': ('cases_monthly', "CAST(julianday(date(day * 86400, 'unixepoch', 'start of month')) - 2440587.5 AS INTEGER)")
+}
+
+
+def get_schema_version(db_name):
+    """PRAGMA user_version of a database file, a read that takes no write lock"""
+    conn = query_stats.connect(db_name)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _set_schema_version(conn, version):
+    conn.execute(f'PRAGMA user_version = {int(version)}')
+    conn.commit()
+
+
+class CovidDatabase(CovidStorage):
+    # The schema is checked on the first connection, not on construction
+    _schema_ready = False
+    # Other threads wait while one creates or migrates the tables, the one doing it may reconnect
+    _schema_lock = threading.RLock()
+    _schema_owner = None
+    
     def __init__(self, db_name='data/covid_data.db'):
         self.db_name = db_name
+        self._metrics_cache = None
         # Ensure data directory exists
         try:
             os.makedirs(os.path.dirname(self.db_name), exist_ok=True)
         except Exception as e:
             print(f"Warning: Could not create data directory: {e}")
-        self.create_tables()
+    
+    def _connect(self):
+        if not self._schema_ready:
+            self.ensure_schema()
+        return query_stats.connect(self.db_name)
+    
+    def ensure_schema(self):
+        """Create or migrate the tables unless the file is already at COVID_SCHEMA_VERSION"""
+        with self._schema_lock:
+            if self._schema_ready or self._schema_owner == threading.get_ident():
+                return
+            if get_schema_version(self.db_name) < COVID_SCHEMA_VERSION:
+                self.create_tables()
+            self._schema_ready = True
     
     def create_tables(self):
-        conn = sqlite3.connect(self.db_name)
+        """Create or migrate the tables, ready for use once it returns"""
+        with self._schema_lock:
+            owner, self._schema_owner = self._schema_owner, threading.get_ident()
+            try:
+                self._create_tables()
+                self._schema_ready = True
+            finally:
+                self._schema_owner = owner
+    
+    def _create_tables(self):
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # WAL lets readers keep their snapshot while a writer commits
+        cursor.execute('PRAGMA journal_mode = WAL')
+        
+        # Country dimension, case rows reference it by integer id
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS countries (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL,
+                iso2 TEXT,
+                iso3 TEXT,
+                aliases TEXT
+            )
+        ''')
+        # Case-insensitive prefix search on names is a range scan of this index
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_countries_name_nocase ON countries(name COLLATE NOCASE)')
+        
+        cursor.execute('SELECT COUNT(*) FROM countries')
+        if cursor.fetchone()[0] == 0:
+            from countries import COUNTRIES
+            cursor.executemany('''
+                INSERT INTO countries (name, iso2, iso3, aliases)
+                VALUES (?, ?, ?, ?)
+            ''', [(name, iso2, iso3, ','.join(aliases)) for name, iso2, iso3, aliases in COUNTRIES])
+        
+        # Older databases keep the country name and date text on every row
+        cursor.execute('PRAGMA table_info(covid_cases)')
+        legacy = 'country' in [row[1] for row in cursor.fetchall()]
+        if legacy:
+            cursor.execute('ALTER TABLE covid_cases RENAME TO covid_cases_legacy')
+        
+        # One row per country and day, clustered on the primary key
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS covid_cases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                country TEXT NOT NULL,
-                date TEXT NOT NULL,
+                country_id INTEGER NOT NULL REFERENCES countries(id),
+                day INTEGER NOT NULL,
                 confirmed INTEGER DEFAULT 0,
                 deaths INTEGER DEFAULT 0,
                 recovered INTEGER DEFAULT 0,
                 active INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                PRIMARY KEY (country_id, day)
+            ) WITHOUT ROWID
+        ''')
+        
+        if legacy:
+            self._migrate_legacy_cases(cursor)
+        
+        self._merge_country_aliases(cursor)
+        
+        # Small key/value store for counters such as the rollup high-water mark
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS db_meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
             )
         ''')
+        cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('rollup_hwm', 0)")
+        cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('reload_seq', 0)")
+        cursor.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('pruned_seq', 0)")
+        for event in ('insert', 'update', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS covid_cases_version_{event}')
+        
+        # Every write to covid_cases is logged as a delta with an increasing seq
+        cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS case_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                country_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                confirmed INTEGER NOT NULL,
+                deaths INTEGER NOT NULL,
+                recovered INTEGER NOT NULL,
+                active INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS covid_cases_log_insert AFTER INSERT ON covid_cases BEGIN
+                INSERT INTO case_changes (country_id, day, confirmed, deaths, recovered, active)
+                VALUES (new.country_id, new.day, new.confirmed, new.deaths, new.recovered, new.active);
+            END;
+            CREATE TRIGGER IF NOT EXISTS covid_cases_log_update AFTER UPDATE ON covid_cases
+            WHEN old.country_id = new.country_id AND old.day = new.day BEGIN
+                INSERT INTO case_changes (country_id, day, confirmed, deaths, recovered, active)
+                VALUES (new.country_id, new.day, new.confirmed - old.confirmed, new.deaths - old.deaths,
+                        new.recovered - old.recovered, new.active - old.active);
+            END;
+            CREATE TRIGGER IF NOT EXISTS covid_cases_log_rekey AFTER UPDATE ON covid_cases
+            WHEN old.country_id != new.country_id OR old.day != new.day BEGIN
+                INSERT INTO case_changes (country_id, day, confirmed, deaths, recovered, active)
+                VALUES (old.country_id, old.day, -old.confirmed, -old.deaths, -old.recovered, -old.active);
+                INSERT INTO case_changes (country_id, day, confirmed, deaths, recovered, active)
+                VALUES (new.country_id, new.day, new.confirmed, new.deaths, new.recovered, new.active);
+            END;
+            CREATE TRIGGER IF NOT EXISTS covid_cases_log_delete AFTER DELETE ON covid_cases BEGIN
+                INSERT INTO case_changes (country_id, day, confirmed, deaths, recovered, active)
+                VALUES (old.country_id, old.day, -old.confirmed, -old.deaths, -old.recovered, -old.active);
+            END;
+        ''')
+        
+        # Weekly and monthly rollups per country, country_id 0 holds the global totals.
+        # period is the day number of the first day of the week (Monday) or month.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'cases_monthly'")
+        new_rollups = cursor.fetchone() is None
+        for table, _ in ROLLUP_TABLES.values():
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    country_id INTEGER NOT NULL,
+                    period INTEGER NOT NULL,
+                    confirmed INTEGER DEFAULT 0,
+                    deaths INTEGER DEFAULT 0,
+                    recovered INTEGER DEFAULT 0,
+                    active INTEGER DEFAULT 0,
+                    PRIMARY KEY (country_id, period)
+                ) WITHOUT ROWID
+            ''')
         
         conn.commit()
         conn.close()
+        
+        if new_rollups:
+            self.rebuild_rollups()
+        
+        conn = self._connect()
+        if legacy:
+            # Reclaim the space of the old text columns
+            conn.execute('VACUUM')
+        # Stamped last, so an interrupted migration runs again
+        _set_schema_version(conn, COVID_SCHEMA_VERSION)
+        conn.close()
     
-    def get_global_summary(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+    def _migrate_legacy_cases(self, cursor):
+        """Move rows from the old text based covid_cases table to the compact layout"""
+        print("Migrating covid_cases to the compact country/day layout...")
         
         cursor.execute('''
+            INSERT OR IGNORE INTO countries (name)
+            SELECT DISTINCT country FROM covid_cases_legacy
+        ''')
+        
+        # Rows recorded twice for the same country and day are added together,
+        # so the totals reported before the migration are preserved
+        cursor.execute('''
+            INSERT INTO covid_cases (country_id, day, confirmed, deaths, recovered, active)
+            SELECT c.id,
+                   CAST(julianday(l.date) - 2440587.5 AS INTEGER) AS day,
+                   SUM(l.confirmed), SUM(l.deaths), SUM(l.recovered), SUM(l.active)
+            FROM covid_cases_legacy l
+            JOIN countries c ON c.name = l.country
+            WHERE julianday(l.date) IS NOT NULL
+            GROUP BY c.id, day
+        ''')
+        migrated = cursor.rowcount
+        
+        cursor.execute('SELECT COUNT(*) FROM covid_cases_legacy WHERE julianday(date) IS NULL')
+        skipped = cursor.fetchone()[0]
+        if skipped:
+            print(f"Warning: Skipped {skipped} rows with invalid dates")
+        
+        cursor.execute('DROP TABLE covid_cases_legacy')
+        print(f"Migrated {migrated} country/day rows")
+    
+    def _merge_country_aliases(self, cursor):
+        """Fold countries stored under an alias (e.g. 'USA') into their canonical row"""
+        # Only rows added on the fly have no ISO code, the seeded ones are canonical
+        cursor.execute('SELECT id, name FROM countries WHERE iso3 IS NULL')
+        for alias_id, name in cursor.fetchall():
+            canonical = canonicalize_country(name)
+            if canonical == name:
+                continue
+            
+            cursor.execute('SELECT id FROM countries WHERE name = ?', (canonical,))
+            result = cursor.fetchone()
+            if not result:
+                cursor.execute('UPDATE countries SET name = ? WHERE id = ?', (canonical, alias_id))
+                continue
+            
+            cursor.execute('''
+                INSERT INTO covid_cases (country_id, day, confirmed, deaths, recovered, active)
+                SELECT ?, day, confirmed, deaths, recovered, active
+                FROM covid_cases WHERE country_id = ? AND true
+                ON CONFLICT (country_id, day) DO UPDATE SET
+                    confirmed = confirmed + excluded.confirmed,
+                    deaths = deaths + excluded.deaths,
+                    recovered = recovered + excluded.recovered,
+                    active = active + excluded.active
+            ''', (result[0], alias_id))
+            cursor.execute('DELETE FROM covid_cases WHERE country_id = ?', (alias_id,))
+            cursor.execute('DELETE FROM countries WHERE id = ?', (alias_id,))
+            print(f"Merged country '{name}' into '{canonical}'")
+    
+    def _get_country_ids(self, cursor, names):
+        """Map country names to ids by canonical name, adding any country not seen before"""
+        canonical = {name: canonicalize_country(name) for name in set(names)}
+        wanted = list(set(canonical.values()))
+        ids = {}
+        for start in range(0, len(wanted), 500):
+            batch = wanted[start:start + 500]
+            placeholders = ','.join(['?' for _ in batch])
+            cursor.execute(f'SELECT name, id FROM countries WHERE name IN ({placeholders})', batch)
+            ids.update(cursor.fetchall())
+        
+        for name in set(wanted) - ids.keys():
+            cursor.execute('INSERT INTO countries (name) VALUES (?)', (name,))
+            ids[name] = cursor.lastrowid
+        return {name: ids[canonical[name]] for name in canonical}
+    
+    def _case_source(self, granularity, scope='country'):
+        """Table (with filter) and time column holding cases at a granularity
+        
+        scope is 'country' for per-country rows or 'global' for the global row
+        of a rollup. Raises ValueError for an unknown granularity.
+        """
+        if granularity == 'day':
+            return 'covid_cases', 'day'
+        if granularity not in ROLLUP_TABLES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        table = ROLLUP_TABLES[granularity][0]
+        condition = 'country_id = 0' if scope == 'global' else 'country_id > 0'
+        return f'(SELECT * FROM {table} WHERE {condition})', 'period'
+    
+    def get_global_summary(self, granularity='day'):
+        # Rollups already hold the global row, so coarser grains read a few rows
+        source, _ = self._case_source(granularity, scope='global')
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
             SELECT 
                 SUM(confirmed) as total_confirmed,
                 SUM(deaths) as total_deaths,
                 SUM(recovered) as total_recovered,
                 SUM(active) as total_active
-            FROM covid_cases
+            FROM {source}
         ''')
         
         result = cursor.fetchone()
@@ -60,20 +334,30 @@ class CovidDatabase:
             }
         return None
     
-    def get_top_countries(self, metric='confirmed', limit=10):
-        conn = sqlite3.connect(self.db_name)
+    def get_top_countries(self, metric='confirmed', limit=10, granularity='day'):
+        if metric not in CASE_METRICS:
+            metric = 'confirmed'
+        source, _ = self._case_source(granularity)
+        
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # Aggregate on the integer key, join names only for the top rows
         query = f'''
-            SELECT country, 
-                   SUM(confirmed) as confirmed,
-                   SUM(deaths) as deaths,
-                   SUM(recovered) as recovered,
-                   SUM(active) as active
-            FROM covid_cases
-            GROUP BY country
-            ORDER BY {metric} DESC
-            LIMIT ?
+            SELECT c.name, t.confirmed, t.deaths, t.recovered, t.active
+            FROM (
+                SELECT country_id,
+                       SUM(confirmed) as confirmed,
+                       SUM(deaths) as deaths,
+                       SUM(recovered) as recovered,
+                       SUM(active) as active
+                FROM {source}
+                GROUP BY country_id
+                ORDER BY {metric} DESC
+                LIMIT ?
+            ) t
+            JOIN countries c ON c.id = t.country_id
+            ORDER BY t.{metric} DESC
         '''
         
         cursor.execute(query, (limit,))
@@ -92,29 +376,121 @@ class CovidDatabase:
         ]
     
     def get_all_countries(self):
-        conn = sqlite3.connect(self.db_name)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT DISTINCT country FROM covid_cases ORDER BY country')
+        cursor.execute('''
+            SELECT name FROM countries c
+            WHERE EXISTS (SELECT 1 FROM covid_cases WHERE country_id = c.id)
+            ORDER BY name
+        ''')
         results = cursor.fetchall()
         conn.close()
         
         return [row[0] for row in results]
     
+    def get_country_totals(self):
+        """Get all-time totals and the ISO3 code of every country with data"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT c.name, c.iso3, t.confirmed, t.deaths, t.recovered, t.active
+            FROM (
+                SELECT country_id,
+                       SUM(confirmed) as confirmed,
+                       SUM(deaths) as deaths,
+                       SUM(recovered) as recovered,
+                       SUM(active) as active
+                FROM covid_cases
+                GROUP BY country_id
+            ) t
+            JOIN countries c ON c.id = t.country_id
+            ORDER BY c.name
+        ''')
+        results = cursor.fetchall()
+        conn.close()
+        
+        return [
+            {
+                'country': row[0],
+                'iso3': row[1],
+                'confirmed': row[2],
+                'deaths': row[3],
+                'recovered': row[4],
+                'active': row[5]
+            }
+            for row in results
+        ]
+    
+    def query_country_totals(self, search=None, sort='confirmed', descending=True, page=1,
+                             page_size=COUNTRY_PAGE_ROWS):
+        """One page of country totals, the name prefix is a range on the NOCASE index"""
+        check_country_query(sort, page, page_size)
+        prefix = (search or '').strip()
+        
+        # Every name starting with the prefix sorts between it and prefix + U+10FFFF
+        name_filter, params = '', []
+        if prefix:
+            name_filter = 'AND name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE'
+            params = [prefix, prefix + '\U0010ffff']
+        order = 'c.name' if sort == 'country' else f't.{sort}'
+        direction = 'DESC' if descending else 'ASC'
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        # One read transaction so the count matches the page
+        cursor.execute('BEGIN')
+        cursor.execute(f'''
+            SELECT COUNT(*)
+            FROM countries
+            WHERE EXISTS (SELECT 1 FROM covid_cases WHERE country_id = countries.id) {name_filter}
+        ''', params)
+        total = cursor.fetchone()[0]
+        
+        # Only the matching countries are aggregated, each by its primary key range
+        cursor.execute(f'''
+            SELECT c.name, c.iso3, t.confirmed, t.deaths, t.recovered, t.active
+            FROM (
+                SELECT country_id,
+                       SUM(confirmed) as confirmed,
+                       SUM(deaths) as deaths,
+                       SUM(recovered) as recovered,
+                       SUM(active) as active
+                FROM covid_cases
+                WHERE country_id IN (SELECT id FROM countries WHERE true {name_filter})
+                GROUP BY country_id
+            ) t
+            JOIN countries c ON c.id = t.country_id
+            ORDER BY {order} {direction}, c.name
+            LIMIT ? OFFSET ?
+        ''', params + [page_size, (page - 1) * page_size])
+        results = cursor.fetchall()
+        cursor.execute('COMMIT')
+        conn.close()
+        
+        return country_page([
+            dict({'country': row[0], 'iso3': row[1]}, **dict(zip(CASE_METRICS, row[2:])))
+            for row in results
+        ], total, page, page_size)
+    
     def compare_countries(self, countries):
-        conn = sqlite3.connect(self.db_name)
+        countries = [canonicalize_country(country) for country in countries]
+        
+        conn = self._connect()
         cursor = conn.cursor()
         
         placeholders = ','.join(['?' for _ in countries])
         query = f'''
-            SELECT country,
+            SELECT c.name,
                    SUM(confirmed) as confirmed,
                    SUM(deaths) as deaths,
                    SUM(recovered) as recovered,
                    SUM(active) as active
             FROM covid_cases
-            WHERE country IN ({placeholders})
-            GROUP BY country
+            JOIN countries c ON c.id = covid_cases.country_id
+            WHERE c.name IN ({placeholders})
+            GROUP BY c.id
         '''
         
         cursor.execute(query, countries)
@@ -132,44 +508,594 @@ class CovidDatabase:
             for row in results
         ]
     
-    def add_new_case(self, case_data):
-        try:
-            conn = sqlite3.connect(self.db_name)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO covid_cases (country, date, confirmed, deaths, recovered, active)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                case_data['country'],
-                case_data['date'],
-                case_data['confirmed'],
-                case_data['deaths'],
-                case_data['recovered'],
-                case_data['active']
-            ))
-            
+    def _rows_to_series(self, results):
+        return [
+            {
+                'date': from_day_number(row[0]),
+                'confirmed': row[1],
+                'deaths': row[2],
+                'recovered': row[3],
+                'active': row[4]
+            }
+            for row in results
+        ]
+    
+    def get_country_data(self, country, granularity='day'):
+        """Get the records of one country per day, week or month
+        
+        Weekly and monthly dates are the first day of the bucket.
+        Returns None if the country is unknown.
+        """
+        source, time_column = self._case_source(granularity)
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT id FROM countries WHERE name = ?', (canonicalize_country(country),))
+        result = cursor.fetchone()
+        if not result:
+            conn.close()
+            return None
+        
+        cursor.execute(f'''
+            SELECT {time_column}, confirmed, deaths, recovered, active
+            FROM {source}
+            WHERE country_id = ?
+            ORDER BY {time_column}
+        ''', (result[0],))
+        results = cursor.fetchall()
+        conn.close()
+        
+        return self._rows_to_series(results)
+    
+    def get_time_series(self, country=None, granularity='day'):
+        """Get the global series, or one country's, per day, week or month"""
+        if country is not None:
+            return self.get_country_data(country, granularity)
+        
+        source, time_column = self._case_source(granularity, scope='global')
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT {time_column}, SUM(confirmed), SUM(deaths), SUM(recovered), SUM(active)
+            FROM {source}
+            GROUP BY {time_column}
+            ORDER BY {time_column}
+        ''')
+        results = cursor.fetchall()
+        conn.close()
+        
+        return self._rows_to_series(results)
+    
+    def get_country_columns(self, countries, start=None, end=None):
+        """Case rows of the given countries in one query, a primary key range per country"""
+        import numpy as np
+        
+        names = sorted({canonicalize_country(country) for country in countries})
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id, name FROM countries WHERE name IN ({','.join('?' * len(names))})", names)
+        ids = dict(cursor.fetchall()) if names else {}
+        
+        conditions = [f"country_id IN ({','.join('?' * len(ids))})"]
+        params = list(ids)
+        if start is not None:
+            conditions.append('day >= ?')
+            params.append(to_day_number(start))
+        if end is not None:
+            conditions.append('day <= ?')
+            params.append(to_day_number(end))
+        cursor.execute(f'''
+            SELECT country_id, day, confirmed, deaths, recovered, active
+            FROM covid_cases
+            WHERE {' AND '.join(conditions)}
+            ORDER BY country_id, day
+        ''', params)
+        rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 6)
+        conn.close()
+        
+        return {
+            'country_ids': rows[:, 0],
+            'days': rows[:, 1],
+            'values': rows[:, 2:],
+            'names': {int(cid): ids[cid] for cid in np.unique(rows[:, 0])}
+        }
+    
+    def get_case_page(self, country=None, start=None, end=None, after=None, limit=EXPORT_PAGE_ROWS):
+        """Up to `limit` case rows after the (country_id, day) key `after`, by primary key range"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        conditions, params = [], []
+        if country is not None:
+            cursor.execute('SELECT id FROM countries WHERE name = ?', (canonicalize_country(country),))
+            result = cursor.fetchone()
+            if not result:
+                conn.close()
+                return []
+            # One country: the key range is on day alone
+            conditions.append('t.country_id = ? AND t.day > ?')
+            params += [result[0], after[1] if after is not None and after[0] == result[0] else -10**9]
+        elif after is not None:
+            conditions.append('(t.country_id, t.day) > (?, ?)')
+            params += list(after)
+        if start is not None:
+            conditions.append('t.day >= ?')
+            params.append(to_day_number(start))
+        if end is not None:
+            conditions.append('t.day <= ?')
+            params.append(to_day_number(end))
+        
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        cursor.execute(f'''
+            SELECT t.country_id, c.name, t.day, t.confirmed, t.deaths, t.recovered, t.active
+            FROM covid_cases t
+            JOIN countries c ON c.id = t.country_id
+            {where}
+            ORDER BY t.country_id, t.day
+            LIMIT ?
+        ''', params + [limit])
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
+    
+    def get_data_version(self):
+        """Sequence number of the latest change to covid_cases"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'case_changes'")
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else 0
+    
+    def get_reload_version(self):
+        """Data version at which the last full reload was published
+        
+        Change log entries before it no longer describe the data, so
+        anything synced to an older version has to start over.
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM db_meta WHERE key = 'reload_seq'")
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else 0
+    
+    def get_changes(self, since=None, limit=CHANGE_PAGE_ROWS):
+        """Rows written after data version `since`, from the case_changes log"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        # One read transaction so the version matches the rows
+        cursor.execute('BEGIN')
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'case_changes'")
+        result = cursor.fetchone()
+        version = result[0] if result else 0
+        cursor.execute(LOG_FLOOR_SQL)
+        log_floor = cursor.fetchone()[0]
+        
+        # Rows loaded by a reload were never logged, pruned changes are gone
+        if since is None or since < log_floor or since > version:
+            cursor.execute('COMMIT')
+            conn.close()
+            return {'version': version, 'reset': True, 'changes': []}
+        
+        # Latest change per country and day; seq is the log's primary key, so
+        # this reads only the changes after `since`
+        cursor.execute('''
+            SELECT l.seq, c.name, l.day, t.confirmed, t.deaths, t.recovered, t.active
+            FROM (
+                SELECT country_id, day, MAX(seq) AS seq
+                FROM case_changes
+                WHERE seq > ?
+                GROUP BY country_id, day
+                ORDER BY seq
+                LIMIT ?
+            ) l
+            JOIN countries c ON c.id = l.country_id
+            LEFT JOIN covid_cases t ON t.country_id = l.country_id AND t.day = l.day
+            ORDER BY l.seq
+        ''', (since, limit))
+        results = cursor.fetchall()
+        cursor.execute('COMMIT')
+        conn.close()
+        
+        return {
+            'version': version,
+            'reset': False,
+            'changes': [change_row(seq, country, day, counts if counts[0] is not None else None)
+                        for seq, country, day, *counts in results]
+        }
+    
+    def _add_to_rollups(self, cursor, source, params=()):
+        """Add the rows selected by `source` to the weekly and monthly rollups"""
+        for table, period_sql in ROLLUP_TABLES.values():
+            # Once per country and once for the global row (country_id 0)
+            for group_sql in ('country_id', '0'):
+                cursor.execute(f'''
+                    INSERT INTO {table} (country_id, period, confirmed, deaths, recovered, active)
+                    SELECT {group_sql}, {period_sql} AS period,
+                           SUM(confirmed), SUM(deaths), SUM(recovered), SUM(active)
+                    FROM ({source})
+                    WHERE true
+                    GROUP BY 1, 2
+                    ON CONFLICT (country_id, period) DO UPDATE SET
+                        confirmed = confirmed + excluded.confirmed,
+                        deaths = deaths + excluded.deaths,
+                        recovered = recovered + excluded.recovered,
+                        active = active + excluded.active
+                ''', params)
+    
+    def rebuild_rollups(self):
+        """Rebuild the weekly and monthly rollups from scratch"""
+        conn = self._connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        
+        for table, _ in ROLLUP_TABLES.values():
+            cursor.execute(f'DELETE FROM {table}')
+        self._add_to_rollups(cursor, '''
+            SELECT day, country_id, confirmed, deaths, recovered, active FROM covid_cases
+        ''')
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'case_changes'")
+        result = cursor.fetchone()
+        cursor.execute("UPDATE db_meta SET value = ? WHERE key = 'rollup_hwm'", (result[0] if result else 0,))
+        
+        cursor.execute('COMMIT')
+        conn.close()
+    
+    def refresh_rollups(self):
+        """Apply changes logged since the last refresh to the rollups
+        
+        Only the buckets touched by those changes are updated. Applied
+        changes older than the latest CHANGE_LOG_RETENTION are then pruned
+        from the log. Returns the number of changes applied.
+        """
+        conn = self._connect()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        # Take the write lock first so concurrent refreshers never apply a change twice
+        cursor.execute('BEGIN IMMEDIATE')
+        
+        cursor.execute("SELECT value FROM db_meta WHERE key = 'rollup_hwm'")
+        high_water_mark = cursor.fetchone()[0]
+        cursor.execute('SELECT MAX(seq), COUNT(*) FROM case_changes WHERE seq > ?', (high_water_mark,))
+        latest, pending = cursor.fetchone()
+        
+        if pending:
+            self._add_to_rollups(cursor, '''
+                SELECT day, country_id, confirmed, deaths, recovered, active
+                FROM case_changes WHERE seq > ? AND seq <= ?
+            ''', (high_water_mark, latest))
+            # Deletes can empty a bucket, drop it so rollups list the same periods as the days
+            for table, period_sql in ROLLUP_TABLES.values():
+                cursor.execute(f'''
+                    DELETE FROM {table} AS r
+                    WHERE confirmed = 0 AND deaths = 0 AND recovered = 0 AND active = 0
+                      AND NOT EXISTS (
+                        SELECT 1 FROM covid_cases
+                        WHERE (country_id = r.country_id OR r.country_id = 0)
+                          AND day BETWEEN r.period AND r.period + 30
+                          AND {period_sql} = r.period
+                      )
+                ''')
+            cursor.execute("UPDATE db_meta SET value = ? WHERE key = 'rollup_hwm'", (latest,))
+            high_water_mark = latest
+        
+        # The log would otherwise grow with every write forever
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'case_changes'")
+        result = cursor.fetchone()
+        prune_to = min(high_water_mark, (result[0] if result else 0) - CHANGE_LOG_RETENTION)
+        cursor.execute("SELECT value FROM db_meta WHERE key = 'pruned_seq'")
+        if prune_to > cursor.fetchone()[0]:
+            cursor.execute('DELETE FROM case_changes WHERE seq <= ?', (prune_to,))
+            cursor.execute("UPDATE db_meta SET value = ? WHERE key = 'pruned_seq'", (prune_to,))
+        
+        cursor.execute('COMMIT')
+        conn.close()
+        return pending
+    
+    def get_case_columns(self):
+        import numpy as np
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        # One read transaction so the version matches the rows
+        cursor.execute('BEGIN')
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'case_changes'")
+        result = cursor.fetchone()
+        # Primary key order, so every country is one contiguous sorted run
+        cursor.execute('''
+            SELECT country_id, day, confirmed, deaths, recovered, active
+            FROM covid_cases
+            ORDER BY country_id, day
+        ''')
+        rows = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 6)
+        cursor.execute('SELECT id, name FROM countries')
+        names = dict(cursor.fetchall())
+        cursor.execute('COMMIT')
+        conn.close()
+        
+        return {
+            'version': result[0] if result else 0,
+            'country_ids': rows[:, 0],
+            'days': rows[:, 1],
+            'values': rows[:, 2:],
+            'names': names
+        }
+    
+    def insert_cases(self, rows):
+        """Insert (country, date, confirmed, deaths, recovered, active) rows in one transaction
+        
+        Counts for a country and day that already has a row are added to it,
+        matching how repeated records were summed before the compact layout.
+        Returns the number of rows written.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        
+        conn = self._connect()
+        cursor = conn.cursor()
+        self._insert_rows(cursor, rows)
+        conn.commit()
+        conn.close()
+        return len(rows)
+    
+    def _insert_rows(self, cursor, rows):
+        country_ids = self._get_country_ids(cursor, [row[0] for row in rows])
+        cursor.executemany('''
+            INSERT INTO covid_cases (country_id, day, confirmed, deaths, recovered, active)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (country_id, day) DO UPDATE SET
+                confirmed = confirmed + excluded.confirmed,
+                deaths = deaths + excluded.deaths,
+                recovered = recovered + excluded.recovered,
+                active = active + excluded.active
+        ''', (
+            (country_ids[country], to_day_number(day), confirmed, deaths, recovered, active)
+            for country, day, confirmed, deaths, recovered, active in rows
+        ))
+    
+    def reload_cases(self, rows):
+        """Replace every case row without stalling or confusing readers
+        
+        The rows are loaded and rolled up in a staging database next to the
+        live one, then copied over the live database in a single step with
+        the SQLite backup API. Readers keep their WAL snapshot while the copy
+        runs and see the complete new data once it commits. rows can be any
+        iterable, it is consumed in chunks. Returns the number of rows loaded.
+        """
+        staging_name = f'{self.db_name}.staging'
+        _remove_database(staging_name)
+        staging = CovidDatabase(staging_name)
+        
+        conn = staging._connect()
+        # Throwaway file: skip fsyncs and the change log while loading
+        conn.execute('PRAGMA synchronous = OFF')
+        cursor = conn.cursor()
+        for trigger in ('insert', 'update', 'rekey', 'delete'):
+            cursor.execute(f'DROP TRIGGER covid_cases_log_{trigger}')
+        loaded = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, 100000))
+            if not chunk:
+                break
+            self._insert_rows(cursor, chunk)
+            loaded += len(chunk)
+        
+        conn.commit()
+        conn.close()
+        
+        # Restores the change log triggers
+        staging.create_tables()
+        staging.rebuild_rollups()
+        
+        while True:
+            # Continue the live sequence and mark the reload, so change log
+            # consumers see a newer version and know to resync from scratch
+            seq = self.get_data_version() + 1
+            conn = staging._connect()
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'case_changes'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('case_changes', ?)", (seq,))
+            conn.execute("UPDATE db_meta SET value = ? WHERE key IN ('reload_seq', 'rollup_hwm')", (seq,))
             conn.commit()
             conn.close()
-            return True
-        except Exception as e:
-            print(f"Error adding case: {e}")
-            return False
+            
+            checked = []
+            def check_version(status, remaining, total):
+                # The live file stays write-locked from the first step until the copy commits,
+                # a write that got in before it would be overwritten without a reset
+                if not checked:
+                    checked.append(True)
+                    if self.get_data_version() + 1 != seq:
+                        raise _LiveDatabaseChanged()
+            
+            source = staging._connect()
+            target = self._connect()
+            try:
+                source.backup(target, pages=1, progress=check_version)
+                break
+            except _LiveDatabaseChanged:
+                # Nothing was copied, stamp the next version and copy again
+                continue
+            finally:
+                target.close()
+                source.close()
+        _remove_database(staging_name)
+        
+        self._metrics_cache = None
+        return loaded
+
+
+class _LiveDatabaseChanged(Exception):
+    """A write reached the live database while reload_cases() was about to copy over it"""
+
+
+def _remove_database(db_name):
+    """Delete a database file and its WAL/shared-memory side files"""
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+
+
+def get_covid_database(db_name='data/covid_data.db', backend=None):
+    """Create the case storage for the configured backend
+    
+    backend defaults to the COVID_DB_BACKEND environment variable:
+    'sqlite' (default), 'mirror' for reads from an in-memory SQLite copy,
+    'columnar' for the in-memory NumPy backend, 'memory' for a throwaway
+    dict store or 'sql' for a DB-API server configured by COVID_DB_DRIVER
+    and COVID_DB_DSN.
+    """
+    backend = (backend or os.environ.get('COVID_DB_BACKEND') or 'sqlite').lower()
+    if backend == 'sqlite':
+        return CovidDatabase(db_name)
+    if backend == 'mirror':
+        from mirror import MirroredCovidDatabase
+        return MirroredCovidDatabase(db_name)
+    if backend == 'columnar':
+        from columnar import ColumnarCovidDatabase
+        return ColumnarCovidDatabase(db_name)
+    if backend == 'memory':
+        from memory_storage import MemoryCovidStorage
+        return MemoryCovidStorage(db_name)
+    if backend == 'sql':
+        from sql_storage import SqlCovidStorage
+        return SqlCovidStorage.from_dsn(os.environ.get('COVID_DB_DRIVER', 'sqlite3'),
+                                        os.environ.get('COVID_DB_DSN', db_name))
+    raise ValueError(f"Unknown COVID_DB_BACKEND: {backend}")
+
+
+def hash_password(password):
+    """Hash a password with bcrypt, returned base64 encoded as stored in users.db"""
+    with telemetry.BCRYPT_QUEUE.track():
+        password_hash, seconds = _timed_hash(password)
+    telemetry.BCRYPT_LATENCY.observe(seconds, 'hash')
+    return password_hash
+
+
+def _timed_hash(password):
+    """hash_password without the metrics, returns (password_hash, seconds)
+    
+    Runs in the bulk import worker processes, whose metrics would never reach
+    the parent, so the caller records the returned time itself.
+    """
+    import base64
+    import time
+    started = time.perf_counter()
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return base64.b64encode(password_hash).decode('utf-8'), time.perf_counter() - started
+
+
+def read_users_csv(file):
+    """Read users for bulk import from a CSV file path or text file object
+    
+    Expected columns: username, password and optionally full_name, email, role.
+    """
+    import csv
+    
+    if isinstance(file, str):
+        # utf-8-sig drops the byte order mark Excel writes, like the upload page does
+        with open(file, newline='', encoding='utf-8-sig') as f:
+            return read_users_csv(f)
+    
+    reader = csv.DictReader(file)
+    return [
+        {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        for row in reader
+    ]
+
+
+def _check_password(password, password_hash):
+    """bcrypt.checkpw, counted in the bcrypt queue and latency metrics"""
+    with telemetry.BCRYPT_QUEUE.track(), telemetry.BCRYPT_LATENCY.time('check'):
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash)
+
+
+_dummy_hash = None
+
+def _get_dummy_hash():
+    """bcrypt hash checked for unknown users so they cost as much as real ones"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = bcrypt.hashpw(os.urandom(16).hex().encode('utf-8'), bcrypt.gensalt())
+    return _dummy_hash
+
+
+# ORDER BY clauses accepted by UserDatabase.search_users
+USER_SORT_ORDERS = {
+    'newest': 'created_at DESC, id DESC',
+    'oldest': 'created_at ASC, id ASC',
+    'username': 'username COLLATE NOCASE ASC',
+    'most_active': 'login_count DESC, id DESC',
+    'last_login': 'last_login DESC, id DESC'
+}
 
 
 class UserDatabase:
-    def __init__(self, db_name='data/users.db'):
+    # The schema is checked on the first connection, not on construction
+    _schema_ready = False
+    # Other threads wait while one creates or migrates the tables, the one doing it may reconnect
+    _schema_lock = threading.RLock()
+    _schema_owner = None
+    _fts_enabled = None
+    
+    def __init__(self, db_name='data/users.db', limiter=None):
         self.db_name = db_name
+        self.limiter = limiter or login_limiter
+        # Hashed now, hashing it during the first unknown-username login would make that one slower
+        _get_dummy_hash()
         # Ensure data directory exists
         try:
             os.makedirs(os.path.dirname(self.db_name), exist_ok=True)
         except Exception as e:
             print(f"Warning: Could not create data directory: {e}")
-        self.create_tables()
+    
+    def _connect(self):
+        if not self._schema_ready:
+            self.ensure_schema()
+        return query_stats.connect(self.db_name)
+    
+    def ensure_schema(self):
+        """Create or migrate the tables unless the file is already at USER_SCHEMA_VERSION"""
+        with self._schema_lock:
+            if self._schema_ready or self._schema_owner == threading.get_ident():
+                return
+            if get_schema_version(self.db_name) < USER_SCHEMA_VERSION:
+                self.create_tables()
+            self._schema_ready = True
+    
+    @property
+    def fts_enabled(self):
+        """Whether the FTS5 user search index exists"""
+        if self._fts_enabled is None:
+            conn = self._connect()
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+            self._fts_enabled = cursor.fetchone() is not None
+            conn.close()
+        return self._fts_enabled
     
     def create_tables(self):
-        """Create users table if it doesn't exist"""
-        conn = sqlite3.connect(self.db_name)
+        """Create the users table and its indexes if they don't exist
+        
+        The default admin account is not created here, run create_admin.py
+        or migrate.py once for a new database.
+        """
+        with self._schema_lock:
+            owner, self._schema_owner = self._schema_owner, threading.get_ident()
+            try:
+                self._create_tables()
+                self._schema_ready = True
+            finally:
+                self._schema_owner = owner
+    
+    def _create_tables(self):
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -187,25 +1113,78 @@ class UserDatabase:
             )
         ''')
         
-        # Create default admin if not exists
-        cursor.execute('SELECT username FROM users WHERE username = ?', ('admin',))
-        if not cursor.fetchone():
-            import base64
-            admin_password = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt())
-            admin_password_b64 = base64.b64encode(admin_password).decode('utf-8')
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, full_name, role)
-                VALUES (?, ?, ?, ?)
-            ''', ('admin', admin_password_b64, 'System Administrator', 'admin'))
-            conn.commit()
+        # Case-insensitive indexes for prefix search and the admin listing
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_full_name_nocase ON users(full_name COLLATE NOCASE)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)')
+        
+        # Full-text index over username/full_name, kept in sync by triggers
+        self._fts_enabled = self._create_search_index(cursor)
         
+        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
+        if cursor.fetchone()[0] == 0:
+            print("No admin user yet, run `python create_admin.py` to create one")
+        
+        conn.commit()
+        _set_schema_version(conn, USER_SCHEMA_VERSION)
+        conn.close()
+    
+    def create_default_admin(self, password='admin123'):
+        """Create the admin account, or reset its password, returns the username"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        # An existing admin keeps its id, history and login stats
+        cursor.execute('''
+            INSERT INTO users (username, password_hash, full_name, role)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (username) DO UPDATE SET
+                password_hash = excluded.password_hash,
+                role = 'admin'
+        ''', ('admin', hash_password(password), 'System Administrator', 'admin'))
         conn.commit()
         conn.close()
+        return 'admin'
+    
+    def _create_search_index(self, cursor):
+        """Create the FTS5 user search index, returns False if FTS5 is unavailable"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'")
+        if cursor.fetchone():
+            return True
+        
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE users_fts USING fts5(
+                    username, full_name,
+                    content='users', content_rowid='id', prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"Warning: FTS5 not available, falling back to prefix search: {e}")
+            return False
+        
+        cursor.executescript('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+                INSERT INTO users_fts(rowid, username, full_name)
+                VALUES (new.id, new.username, new.full_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+                INSERT INTO users_fts(users_fts, rowid, username, full_name)
+                VALUES ('delete', old.id, old.username, old.full_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, full_name ON users BEGIN
+                INSERT INTO users_fts(users_fts, rowid, username, full_name)
+                VALUES ('delete', old.id, old.username, old.full_name);
+                INSERT INTO users_fts(rowid, username, full_name)
+                VALUES (new.id, new.username, new.full_name);
+            END;
+        ''')
+        cursor.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+        return True
     
     def register_user(self, username, password, full_name=None, email=None, role='user'):
         """Register a new user"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Check if username already exists
@@ -215,9 +1194,7 @@ class UserDatabase:
                 return False, "Username already exists"
             
             # Hash password
-            import base64
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            password_hash_b64 = base64.b64encode(password_hash).decode('utf-8')
+            password_hash_b64 = hash_password(password)
             
             # Insert new user
             cursor.execute('''
@@ -233,10 +1210,112 @@ class UserDatabase:
             print(f"Registration error: {e}")
             return False, "Registration failed"
     
-    def authenticate_user(self, username, password):
-        """Authenticate user login"""
+    def bulk_import_users(self, users, workers=None):
+        """Register many users at once (admin function)
+        
+        Passwords are hashed across a process pool and all users are inserted
+        in a single transaction. Returns (imported_count, problems) where
+        problems lists the rows that were not imported.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        problems = []
+        pending = []
+        seen = set()
+        
+        # Validate rows, row numbers match the CSV line (header is line 1)
+        for row_number, user in enumerate(users, start=2):
+            username = (user.get('username') or '').strip()
+            password = user.get('password') or ''
+            role = (user.get('role') or 'user').strip().lower()
+            
+            if not username or not password:
+                problems.append({'row': row_number, 'username': username, 'message': 'Missing username or password'})
+            elif len(password) < 6:
+                problems.append({'row': row_number, 'username': username, 'message': 'Password must be at least 6 characters long'})
+            elif role not in ('user', 'admin'):
+                problems.append({'row': row_number, 'username': username, 'message': f'Invalid role: {role}'})
+            elif username in seen:
+                problems.append({'row': row_number, 'username': username, 'message': 'Duplicate username in file'})
+            else:
+                seen.add(username)
+                pending.append((row_number, username, password,
+                                user.get('full_name') or None, user.get('email') or None, role))
+        
+        if not pending:
+            return 0, problems
+        
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            # Skip hashing for names that are already taken, checked in batches
+            existing = set()
+            names = [item[1] for item in pending]
+            for start in range(0, len(names), 500):
+                batch = names[start:start + 500]
+                placeholders = ','.join(['?' for _ in batch])
+                cursor.execute(f'SELECT username FROM users WHERE username IN ({placeholders})', batch)
+                existing.update(row[0] for row in cursor.fetchall())
+            conn.close()
+            
+            to_insert = [item for item in pending if item[1] not in existing]
+            for item in pending:
+                if item[1] in existing:
+                    problems.append({'row': item[0], 'username': item[1], 'message': 'Username already exists'})
+            
+            # bcrypt is CPU bound, spread it over all cores. The workers come from a
+            # fork server rather than fork(), which would copy this threaded process
+            # (Streamlit, the scheduler, live update threads) with whatever locks
+            # those threads happen to hold
+            passwords = [item[2] for item in to_insert]
+            if len(passwords) > 1:
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                with telemetry.BCRYPT_QUEUE.track(amount=len(passwords)), \
+                        ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context(start_method)) as executor:
+                    chunksize = max(1, len(passwords) // ((workers or os.cpu_count() or 1) * 4))
+                    timed = list(executor.map(_timed_hash, passwords, chunksize=chunksize))
+                hashes = []
+                for password_hash, seconds in timed:
+                    telemetry.BCRYPT_LATENCY.observe(seconds, 'hash')
+                    hashes.append(password_hash)
+            else:
+                hashes = [hash_password(password) for password in passwords]
+            
+            # One transaction, the UNIQUE(username) constraint catches any races
+            conn = self._connect()
+            cursor = conn.cursor()
+            imported = 0
+            for (row_number, username, _, full_name, email, role), password_hash in zip(to_insert, hashes):
+                try:
+                    cursor.execute('''
+                        INSERT INTO users (username, password_hash, full_name, email, role)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (username, password_hash, full_name, email, role))
+                    imported += 1
+                except sqlite3.IntegrityError:
+                    problems.append({'row': row_number, 'username': username, 'message': 'Username already exists'})
+            
+            conn.commit()
+            conn.close()
+            
+            problems.sort(key=lambda problem: problem['row'])
+            return imported, problems
+        
+        except Exception as e:
+            print(f"Bulk import error: {e}")
+            return 0, problems + [{'row': None, 'username': None, 'message': f'Import failed: {e}'}]
+    
+    def authenticate_user(self, username, password, client_ip=None):
+        """Authenticate user login, raises LoginRateLimited when the limiter rejects the attempt"""
+        # Reject floods before doing any bcrypt work
+        if self.limiter.check(username, client_ip):
+            raise LoginRateLimited(self.limiter.retry_after(username, client_ip))
+        
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -249,18 +1328,23 @@ class UserDatabase:
             
             if not result:
                 conn.close()
+                # Same bcrypt cost as a real account, so timing doesn't reveal the username
+                _check_password(password, _get_dummy_hash())
+                self.limiter.record_failure(username)
                 return False, "Invalid username or password", None
             
             password_hash, is_active, role = result
             
             if not is_active:
                 conn.close()
+                # Counted like a wrong password, so disabled accounts cannot be probed unthrottled
+                self.limiter.record_failure(username)
                 return False, "Account is disabled", None
             
             # Verify password
             import base64
             stored_hash = base64.b64decode(password_hash)
-            if bcrypt.checkpw(password.encode('utf-8'), stored_hash):
+            if _check_password(password, stored_hash):
                 # Update login statistics
                 cursor.execute('''
                     UPDATE users 
@@ -270,9 +1354,11 @@ class UserDatabase:
                 
                 conn.commit()
                 conn.close()
+                self.limiter.record_success(username)
                 return True, "Login successful", role
             else:
                 conn.close()
+                self.limiter.record_failure(username)
                 return False, "Invalid username or password", None
         
         except Exception as e:
@@ -282,11 +1368,11 @@ class UserDatabase:
     def get_user_info(self, username):
         """Get user information"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
-                SELECT username, full_name, email, role, created_at, last_login, login_count
+                SELECT username, full_name, email, role, created_at, last_login, login_count, is_active
                 FROM users
                 WHERE username = ?
             ''', (username,))
@@ -302,7 +1388,8 @@ class UserDatabase:
                     'role': result[3],
                     'created_at': result[4],
                     'last_login': result[5],
-                    'login_count': result[6]
+                    'login_count': result[6],
+                    'is_active': bool(result[7])
                 }
             return None
         
@@ -313,7 +1400,7 @@ class UserDatabase:
     def get_all_users(self):
         """Get list of all users (admin function)"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -343,10 +1430,86 @@ class UserDatabase:
             print(f"Error getting users: {e}")
             return []
     
+    def _search_filter(self, query):
+        """Build the WHERE clause and parameters for a user search"""
+        terms = (query or '').split()
+        if not terms:
+            return '', []
+        
+        if self.fts_enabled:
+            # Every term must prefix-match a token in username or full_name
+            match = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+            return 'WHERE id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)', [match]
+        
+        # Without FTS5, prefix-match the NOCASE indexes on the whole query
+        prefix = ' '.join(terms).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return ("WHERE username LIKE ? ESCAPE '\\' OR full_name LIKE ? ESCAPE '\\'",
+                [prefix, prefix])
+    
+    def search_users(self, query='', sort='newest', page=1, page_size=50):
+        """Get one page of users matching a search query (admin function)"""
+        try:
+            order_by = USER_SORT_ORDERS.get(sort, USER_SORT_ORDERS['newest'])
+            where, params = self._search_filter(query)
+            offset = max(page - 1, 0) * page_size
+            
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute(f'''
+                SELECT username, full_name, email, role,
+                       strftime('%Y-%m-%d %H:%M', created_at),
+                       strftime('%Y-%m-%d %H:%M', last_login),
+                       login_count, is_active
+                FROM users
+                {where}
+                ORDER BY {order_by}
+                LIMIT ? OFFSET ?
+            ''', params + [page_size, offset])
+            
+            results = cursor.fetchall()
+            conn.close()
+            
+            return [
+                {
+                    'username': row[0],
+                    'full_name': row[1],
+                    'email': row[2],
+                    'role': row[3],
+                    'created_at': row[4],
+                    'last_login': row[5],
+                    'login_count': row[6],
+                    'is_active': row[7]
+                }
+                for row in results
+            ]
+        
+        except Exception as e:
+            print(f"Error searching users: {e}")
+            return []
+    
+    def count_users(self, query=''):
+        """Get the number of users matching a search query"""
+        try:
+            where, params = self._search_filter(query)
+            
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute(f'SELECT COUNT(*) FROM users {where}', params)
+            count = cursor.fetchone()[0]
+            
+            conn.close()
+            return count
+        
+        except Exception as e:
+            print(f"Error counting users: {e}")
+            return 0
+    
     def get_user_count(self):
         """Get total number of registered users"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
@@ -362,7 +1525,7 @@ class UserDatabase:
     def get_user_statistics(self):
         """Get user statistics"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             # Total users
@@ -408,7 +1571,7 @@ class UserDatabase:
     def update_user_profile(self, username, full_name=None, email=None):
         """Update user profile information"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             if full_name:
@@ -430,7 +1593,7 @@ class UserDatabase:
     def deactivate_user(self, username):
         """Deactivate a user account"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('UPDATE users SET is_active = 0 WHERE username = ?', (username,))
@@ -446,7 +1609,7 @@ class UserDatabase:
     def activate_user(self, username):
         """Activate a user account"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('UPDATE users SET is_active = 1 WHERE username = ?', (username,))
@@ -462,7 +1625,7 @@ class UserDatabase:
     def is_admin(self, username):
         """Check if user is admin"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('SELECT role FROM users WHERE username = ?', (username,))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming CSV and NDJSON export of case rows
+
+export_cases() reads the case table page by page with keyset pagination
+(CovidStorage.iter_case_pages) and yields the formatted file as byte
+chunks, one chunk per page, optionally gzip compressed on the fly. Only a
+page of rows is held in memory however large the export is. The CSV has
+the date, country, confirmed, deaths, recovered, active columns that
+formatData.py imports.
+
+/api/export streams it as the response body. The Streamlit pages link
+to /api/export when COVID_API_URL points them at the API, otherwise
+their download buttons build the file in memory, only for exports of at
+most IN_MEMORY_EXPORT_ROWS rows.
+"""
+
+import csv
+import io
+import json
+import os
+import zlib
+from urllib.parse import urlencode
+
+from storage import CASE_METRICS, EXPORT_PAGE_ROWS, from_day_number
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+CASE_COLUMNS = ('date', 'country') + CASE_METRICS
+
+# Base URL of the Flask API as the browser reaches it, e.g. http://localhost:5000
+EXPORT_API_URL = os.environ.get('COVID_API_URL', '').rstrip('/')
+
+# Largest export the Streamlit download buttons build in memory
+IN_MEMORY_EXPORT_ROWS = 50000
+
+
+def csv_chunks(pages, columns):
+    """CSV text: the header, then one chunk per page of row tuples"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for page in pages:
+        writer.writerows(page)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(pages, columns):
+    """One JSON object per line, one chunk per page of row tuples"""
+    for page in pages:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in page)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress byte chunks into a gzip stream as they come"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _case_rows(covid_db, countries, start, end, page_rows):
+    """Pages of (date, country, *CASE_METRICS) tuples"""
+    dates = {}
+    for country in countries:
+        for page in covid_db.iter_case_pages(country, start, end, page_rows):
+            for row in page:
+                if row[2] not in dates:
+                    dates[row[2]] = from_day_number(row[2])
+            yield [(dates[day], name) + tuple(values) for _, name, day, *values in page]
+
+
+def export_cases(covid_db, file_format='csv', country=None, start=None, end=None, compress=False,
+                 page_rows=EXPORT_PAGE_ROWS):
+    """Yield the case rows as CSV or NDJSON bytes, gzip compressed with compress=True
+
+    country is one name or a list of them, None for every country. start
+    and end are inclusive dates. The rows are read lazily, so invalid
+    arguments only raise once the first chunk is requested.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    countries = country if isinstance(country, (list, tuple)) else [country]
+    formatter = csv_chunks if file_format == 'csv' else ndjson_chunks
+    pages = _case_rows(covid_db, countries, start, end, page_rows)
+    chunks = (text.encode('utf-8') for text in formatter(pages, CASE_COLUMNS))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_url(file_format='csv', country=None, compress=False, base_url=None):
+    """/api/export URL streaming the same file as export_cases(), None when no API URL is set"""
+    base_url = (base_url or EXPORT_API_URL).rstrip('/')
+    if not base_url:
+        return None
+    countries = country if isinstance(country, (list, tuple)) else [country]
+    params = [('format', file_format)] + [('country', name) for name in countries if name]
+    if compress:
+        params.append(('gzip', '1'))
+    return f"{base_url}/api/export?{urlencode(params)}"
+
+
+def fits_in_memory(covid_db, country=None, max_rows=IN_MEMORY_EXPORT_ROWS):
+    """Whether the export has at most max_rows rows, counted a page at a time"""
+    countries = country if isinstance(country, (list, tuple)) else [country]
+    page_rows = min(EXPORT_PAGE_ROWS, max_rows + 1)
+    rows = 0
+    for name in countries:
+        for page in covid_db.iter_case_pages(name, page_rows=page_rows):
+            rows += len(page)
+            if rows > max_rows:
+                return False
+    return True
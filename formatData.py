@@ -2,10 +2,16 @@ import pandas as pd
 import sqlite3
 from datetime import datetime
 import os
+from database import CovidDatabase, to_day_number
+from snapshot import SNAPSHOT_DIR, write_snapshot
 
-def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covid_data.db'):
+def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covid_data.db',
+                           interactive=True, replace=False):
     """
     Import COVID-19 data from CSV file into SQLite database
+    
+    With interactive=False nothing is asked: the detected column mapping is
+    used and existing data is replaced if `replace`, else appended to.
     """
     
     # Check if CSV file exists
@@ -27,27 +33,15 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
         # Display column names to help with mapping
         print(f"\n📋 CSV Columns found: {list(df.columns)}")
         
-        # Connect to SQLite database
+        # Create tables (countries dimension + compact covid_cases) if needed
+        covid_db = CovidDatabase(db_file)
+        covid_db.ensure_schema()
         conn = sqlite3.connect(db_file)
         cursor = conn.cursor()
         
-        # Create table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS covid_cases (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                country TEXT NOT NULL,
-                date TEXT NOT NULL,
-                confirmed INTEGER DEFAULT 0,
-                deaths INTEGER DEFAULT 0,
-                recovered INTEGER DEFAULT 0,
-                active INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
         print(f"\n📊 Database table structure:")
-        print("   - country (TEXT)")
-        print("   - date (TEXT)")
+        print("   - country_id (INTEGER → countries.id)")
+        print("   - day (INTEGER, days since 1970-01-01)")
         print("   - confirmed (INTEGER)")
         print("   - deaths (INTEGER)")
         print("   - recovered (INTEGER)")
@@ -56,14 +50,17 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
         # Check if data already exists
         cursor.execute('SELECT COUNT(*) FROM covid_cases')
         existing_count = cursor.fetchone()[0]
+        replace_existing = replace and existing_count > 0
         
-        if existing_count > 0:
+        if existing_count > 0 and interactive:
             print(f"\n⚠️  Warning: Database already contains {existing_count} records.")
             response = input("Do you want to:\n  1. Clear existing data and import fresh\n  2. Append to existing data\n  3. Cancel\nEnter choice (1/2/3): ")
             
             if response == '1':
-                cursor.execute('DELETE FROM covid_cases')
-                print("🗑️  Cleared existing data")
+                # Loaded into a staging database and swapped in at the end,
+                # so the dashboard keeps serving the old data meanwhile
+                replace_existing = True
+                print("🗑️  Existing data will be replaced")
             elif response == '3':
                 print("❌ Import cancelled")
                 conn.close()
@@ -111,7 +108,7 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
         
         # Ask user to confirm or manually map columns
         print("\n❓ Is this mapping correct?")
-        confirm = input("Press Enter to continue, or 'n' to manually map columns: ")
+        confirm = input("Press Enter to continue, or 'n' to manually map columns: ") if interactive else ''
         
         if confirm.lower() == 'n':
             print("\n📝 Manual Column Mapping:")
@@ -127,6 +124,7 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
         print(f"\n⏳ Importing data...")
         imported_count = 0
         skipped_count = 0
+        rows = []
         
         for index, row in df.iterrows():
             try:
@@ -142,25 +140,31 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
                 if column_mapping['active'] is None and column_mapping['confirmed']:
                     active = confirmed - deaths - recovered
                 
-                # Insert into database
-                cursor.execute('''
-                    INSERT INTO covid_cases (country, date, confirmed, deaths, recovered, active)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (country, date, confirmed, deaths, recovered, active))
+                # Validate the date now so a bad row is skipped, not the whole batch
+                to_day_number(date)
+                rows.append((country, date, confirmed, deaths, recovered, active))
                 
                 imported_count += 1
                 
                 # Show progress every 1000 rows
                 if imported_count % 1000 == 0:
-                    print(f"   Imported {imported_count} rows...")
+                    print(f"   Prepared {imported_count} rows...")
                 
             except Exception as e:
                 skipped_count += 1
                 if skipped_count <= 5:  # Show first 5 errors
                     print(f"   ⚠️  Skipped row {index}: {str(e)}")
         
-        # Commit changes
-        conn.commit()
+        # Insert everything in one transaction, or publish a full reload atomically
+        if replace_existing:
+            covid_db.reload_cases(rows)
+        else:
+            covid_db.insert_cases(rows)
+        
+        # Publish a memory-mapped snapshot for the read-only analytics
+        manifest = write_snapshot(covid_db)
+        if manifest:
+            print(f"   🗂️  Arrow snapshot v{manifest['version']} written to {SNAPSHOT_DIR}")
         
         # Get final count
         cursor.execute('SELECT COUNT(*) FROM covid_cases')
@@ -174,7 +178,12 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
         
         # Show sample data
         print(f"\n📋 Sample data (first 5 rows):")
-        cursor.execute('SELECT country, date, confirmed, deaths, recovered, active FROM covid_cases LIMIT 5')
+        cursor.execute('''
+            SELECT c.name, date(cc.day * 86400, 'unixepoch'), cc.confirmed, cc.deaths, cc.recovered, cc.active
+            FROM covid_cases cc
+            JOIN countries c ON c.id = cc.country_id
+            LIMIT 5
+        ''')
         results = cursor.fetchall()
         
         print(f"\n{'Country':<20} {'Date':<12} {'Confirmed':>12} {'Deaths':>12} {'Recovered':>12} {'Active':>12}")
@@ -184,14 +193,7 @@ def import_csv_to_database(csv_file='covid_data_cleaned.csv', db_file='data/covi
         
         # Show statistics by country
         print(f"\n📊 Top 10 Countries by Confirmed Cases:")
-        cursor.execute('''
-            SELECT country, SUM(confirmed) as total_confirmed
-            FROM covid_cases
-            GROUP BY country
-            ORDER BY total_confirmed DESC
-            LIMIT 10
-        ''')
-        results = cursor.fetchall()
+        results = [(row['country'], row['confirmed']) for row in covid_db.get_top_countries('confirmed', 10)]
         
         print(f"\n{'Rank':<6} {'Country':<30} {'Total Confirmed':>20}")
         print("-" * 60)
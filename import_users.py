@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk User Import
+Registers users from a CSV file with columns: username, password and
+optionally full_name, email, role.
+
+Usage: python import_users.py users.csv [--db data/users.db] [--workers N]
+"""
+
+import argparse
+import time
+from database import UserDatabase, read_users_csv
+
+def import_users(csv_file, db_name='data/users.db', workers=None):
+    """Import users from a CSV file and print a report"""
+    users = read_users_csv(csv_file)
+    print(f"📂 Read {len(users):,} users from {csv_file}")
+
+    start = time.perf_counter()
+    imported, problems = UserDatabase(db_name).bulk_import_users(users, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"✅ Imported {imported:,} users in {elapsed:.1f}s")
+    if problems:
+        print(f"⚠️  {len(problems):,} rows not imported:")
+        for problem in problems:
+            print(f"   Row {problem['row']}: {problem['username'] or '-'} - {problem['message']}")
+
+    return imported, problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import users from a CSV file")
+    parser.add_argument('csv_file', help="CSV with username, password, full_name, email, role columns")
+    parser.add_argument('--db', default='data/users.db', help="Users database file")
+    parser.add_argument('--workers', type=int, default=None, help="Password hashing processes (default: all cores)")
+    args = parser.parse_args()
+
+    import_users(args.csv_file, args.db, args.workers)
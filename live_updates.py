@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Live push of new case data to dashboards and Server-Sent Events clients
+
+One CaseBroadcaster per storage instance and process polls the change
+feed (CovidStorage.get_changes) every POLL_SECONDS while anyone is
+subscribed and fans each batch out to the subscriber queues, so a
+thousand open dashboards still mean a single poller. An idle feed costs
+one indexed lookup per poll.
+
+Every event is a compact delta:
+
+    {'version': 42, 'reset': False,
+     'rows': [[country, date, confirmed, deaths, recovered, active], ...],
+     'totals': {country: [confirmed, deaths, recovered, active] or None},
+     'deltas': {country: [confirmed, deaths, recovered, active]}}
+
+rows are the case rows written (metrics None once deleted), totals the
+new totals of each country they touched (None when it has no rows left)
+and deltas the change of those totals since the previous event. An event
+with reset True means the feed could not be followed (a full reload, or
+the subscriber fell QUEUE_EVENTS events behind): reload everything.
+/api/stream sends the events as SSE, the dashboard's live mode applies
+them to the totals it keeps in the session.
+"""
+
+import json
+import queue
+import threading
+import weakref
+
+from countries import get_iso3
+from storage import CASE_METRICS, CHANGE_PAGE_ROWS
+
+POLL_SECONDS = 1.0
+# Events a subscriber may fall behind before it only gets a reset
+QUEUE_EVENTS = 100
+# Changes per poll above which subscribers get a reset instead of the rows
+MAX_EVENT_CHANGES = 10 * CHANGE_PAGE_ROWS
+# An SSE comment is sent after this long without events, to keep proxies from closing the stream
+HEARTBEAT_SECONDS = 15
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+class CaseBroadcaster:
+    def __init__(self, covid_db, interval=POLL_SECONDS):
+        self.covid_db = covid_db
+        self.interval = interval
+        self.version = None
+        self.polls = 0
+        self.events = 0
+        # Country totals the deltas are computed against, loaded on the first poll
+        self._totals = None
+        # Queues of sessions that end without unsubscribing disappear with them
+        self._subscribers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        # Serializes polls, taken before _lock when both are needed
+        self._poll_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def subscribe(self):
+        """A queue that receives every event from now on, starts polling if needed
+        
+        The baseline is read before this returns, so data the caller loads
+        afterwards is never older than it and every later write arrives
+        as an event.
+        """
+        subscriber = queue.Queue(QUEUE_EVENTS)
+        with self._poll_lock, self._lock:
+            self._subscribers.add(subscriber)
+            if self.version is None:
+                self._poll()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='case-broadcaster', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def wake(self):
+        """Poll now instead of at the next interval, e.g. right after a write"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # Stop polling with no one listening, subscribe() starts again from a new baseline
+                if not self._subscribers:
+                    self._thread = None
+                    self.version = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error polling case changes: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _load_totals(self):
+        self._totals = {row['country']: [row[metric] for metric in CASE_METRICS]
+                        for row in self.covid_db.get_country_totals()}
+
+    def poll(self):
+        """Publish the changes written since the last poll, returns the event or None"""
+        with self._poll_lock:
+            return self._poll()
+
+    def _poll(self):
+        self.polls += 1
+        if self.version is None:
+            self.version = self.covid_db.get_changes()['version']
+            self._load_totals()
+            return None
+
+        changes, since = [], self.version
+        while True:
+            feed = self.covid_db.get_changes(since, CHANGE_PAGE_ROWS)
+            changes += feed['changes']
+            if feed['reset'] or len(feed['changes']) < CHANGE_PAGE_ROWS or len(changes) > MAX_EVENT_CHANGES:
+                break
+            since = changes[-1]['seq']
+
+        if feed['reset'] or len(changes) > MAX_EVENT_CHANGES:
+            self.version = self.covid_db.get_changes()['version']
+            self._load_totals()
+            event = {'version': self.version, 'reset': True}
+        elif not changes:
+            self.version = feed['version']
+            return None
+        else:
+            self.version = feed['version']
+            event = self._delta_event(changes)
+        self.publish(event)
+        return event
+
+    def _delta_event(self, changes):
+        """New totals of the countries the changes touched, recomputed for just those"""
+        touched = sorted({change['country'] for change in changes})
+        # The mirror backend reads from a copy that follows the disk log on sync()
+        if hasattr(self.covid_db, 'sync'):
+            self.covid_db.sync()
+        current = {row['country']: [row[metric] for metric in CASE_METRICS]
+                   for row in self.covid_db.compare_countries(touched)}
+        totals, deltas = {}, {}
+        for country in touched:
+            after = current.get(country)
+            before = self._totals.get(country, [0] * len(CASE_METRICS))
+            deltas[country] = [new - old for new, old in zip(after or [0] * len(CASE_METRICS), before)]
+            totals[country] = after
+            if after is None:
+                self._totals.pop(country, None)
+            else:
+                self._totals[country] = after
+        return {
+            'version': self.version,
+            'reset': False,
+            'rows': [[change['country'], change['date']] + [change[metric] for metric in CASE_METRICS]
+                     for change in changes],
+            'totals': totals,
+            'deltas': deltas
+        }
+
+    def publish(self, event):
+        """Put an event on every subscriber queue; a full queue is replaced by a reset"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait({'version': event['version'], 'reset': True})
+        self.events += 1
+
+    def get_stats(self):
+        return {
+            'subscribers': self.subscriber_count(),
+            'version': self.version,
+            'polls': self.polls,
+            'events': self.events,
+            'poll_seconds': self.interval
+        }
+
+
+def get_broadcaster(covid_db):
+    """The process-wide broadcaster of a storage instance"""
+    with _broadcasters_lock:
+        broadcaster = _broadcasters.get(id(covid_db))
+        if broadcaster is None or broadcaster.covid_db is not covid_db:
+            broadcaster = _broadcasters[id(covid_db)] = CaseBroadcaster(covid_db)
+        return broadcaster
+
+
+def drain(subscriber):
+    """Every event waiting on a subscriber queue"""
+    events = []
+    while True:
+        try:
+            events.append(subscriber.get_nowait())
+        except queue.Empty:
+            return events
+
+
+def apply_event(frame, event):
+    """Apply an event's country totals to a country totals DataFrame, returns the updated frame
+
+    frame has the country, iso3 and CASE_METRICS columns of
+    snapshot.country_totals_frame(). Reset events are left to the caller.
+    """
+    import pandas as pd
+
+    frame = frame.set_index('country')
+    added = []
+    for country, totals in event['totals'].items():
+        if totals is None:
+            frame = frame.drop(index=country, errors='ignore')
+        elif country in frame.index:
+            frame.loc[country, list(CASE_METRICS)] = totals
+        else:
+            added.append(dict({'country': country, 'iso3': get_iso3(country)}, **dict(zip(CASE_METRICS, totals))))
+    frame = frame.reset_index()
+    if added:
+        frame = pd.concat([frame, pd.DataFrame(added, columns=frame.columns)], ignore_index=True)
+        frame = frame.sort_values('country', ignore_index=True)
+    return frame
+
+
+def format_sse(event):
+    """An event in the text/event-stream format, the data version as its id"""
+    kind = 'reset' if event['reset'] else 'cases'
+    return f"id: {event['version']}\nevent: {kind}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Login rate limiting
+
+Token buckets per client IP and per username, plus an exponential-backoff
+lockout after repeated failures. All checks happen in memory before any
+bcrypt work so a credential-stuffing burst is rejected cheaply.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+RATE_LIMITED_MESSAGE = "Too many login attempts, please try again later"
+
+
+class LoginRateLimited(Exception):
+    """A login attempt rejected by the limiter, retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(RATE_LIMITED_MESSAGE)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket, refilled lazily on each take()"""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity, now):
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def take(self, capacity, refill_rate, now):
+        """Take one token, returns False if the bucket is empty"""
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * refill_rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class LoginLimiter:
+    """Per-IP and per-username login limiter with failure lockout"""
+
+    def __init__(self, ip_capacity=30, ip_refill_rate=0.5,
+                 user_capacity=10, user_refill_rate=0.1,
+                 lockout_threshold=5, lockout_base=2.0, lockout_max=900.0,
+                 max_entries=100000):
+        self.ip_capacity = ip_capacity
+        self.ip_refill_rate = ip_refill_rate
+        self.user_capacity = user_capacity
+        self.user_refill_rate = user_refill_rate
+        self.lockout_threshold = lockout_threshold
+        self.lockout_base = lockout_base
+        self.lockout_max = lockout_max
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._ip_buckets = OrderedDict()
+        self._user_buckets = OrderedDict()
+        # username -> [consecutive failures, locked until]
+        self._failures = OrderedDict()
+        self._counters = {
+            'attempts': 0,
+            'allowed': 0,
+            'rejected_ip': 0,
+            'rejected_user': 0,
+            'rejected_lockout': 0,
+            'failures': 0,
+            'successes': 0,
+            'lockouts': 0
+        }
+
+    def _touch(self, table, key, factory):
+        """Get an entry and mark it recently used, evicting the oldest if full"""
+        entry = table.get(key)
+        if entry is None:
+            entry = factory()
+            table[key] = entry
+            if len(table) > self.max_entries:
+                table.popitem(last=False)
+        else:
+            table.move_to_end(key)
+        return entry
+
+    def check(self, username, ip=None):
+        """Record an attempt, returns 0 if allowed or the seconds to wait"""
+        now = time.monotonic()
+        with self._lock:
+            self._counters['attempts'] += 1
+
+            failure = self._failures.get(username)
+            if failure and failure[1] > now:
+                self._counters['rejected_lockout'] += 1
+                return failure[1] - now
+
+            if ip is not None:
+                bucket = self._touch(self._ip_buckets, ip, lambda: TokenBucket(self.ip_capacity, now))
+                if not bucket.take(self.ip_capacity, self.ip_refill_rate, now):
+                    self._counters['rejected_ip'] += 1
+                    return 1.0 / self.ip_refill_rate
+
+            bucket = self._touch(self._user_buckets, username, lambda: TokenBucket(self.user_capacity, now))
+            if not bucket.take(self.user_capacity, self.user_refill_rate, now):
+                self._counters['rejected_user'] += 1
+                return 1.0 / self.user_refill_rate
+
+            self._counters['allowed'] += 1
+            return 0
+
+    def retry_after(self, username, ip=None):
+        """Seconds until a rejected client may retry, without recording an attempt"""
+        now = time.monotonic()
+        with self._lock:
+            failure = self._failures.get(username)
+            if failure and failure[1] > now:
+                return failure[1] - now
+            waits = [0.0]
+            bucket = self._ip_buckets.get(ip)
+            if bucket is not None and bucket.tokens < 1:
+                waits.append((1 - bucket.tokens) / self.ip_refill_rate)
+            bucket = self._user_buckets.get(username)
+            if bucket is not None and bucket.tokens < 1:
+                waits.append((1 - bucket.tokens) / self.user_refill_rate)
+            return max(waits)
+
+    def record_failure(self, username):
+        """Count a failed login, locking the username out after repeated failures"""
+        now = time.monotonic()
+        with self._lock:
+            self._counters['failures'] += 1
+            failure = self._touch(self._failures, username, lambda: [0, 0.0])
+            failure[0] += 1
+            if failure[0] >= self.lockout_threshold:
+                delay = self.lockout_base * 2 ** (failure[0] - self.lockout_threshold)
+                failure[1] = now + min(delay, self.lockout_max)
+                self._counters['lockouts'] += 1
+
+    def record_success(self, username):
+        """Clear the failure history of a username after a successful login"""
+        with self._lock:
+            self._counters['successes'] += 1
+            self._failures.pop(username, None)
+
+    def get_stats(self):
+        """Counters for monitoring rejected load"""
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._counters)
+            stats['rejected'] = (stats['rejected_ip'] + stats['rejected_user'] +
+                                 stats['rejected_lockout'])
+            stats['locked_usernames'] = sum(1 for _, until in self._failures.values() if until > now)
+            stats['tracked_ips'] = len(self._ip_buckets)
+            stats['tracked_usernames'] = len(self._user_buckets)
+            return stats
+
+
+# Shared by every UserDatabase in the process
+login_limiter = LoginLimiter()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory storage backend
+
+MemoryCovidStorage keeps every (country, day) row in a dict and
+aggregates on read. Nothing touches disk, so it suits tests, demos and
+throwaway sessions. Select it with COVID_DB_BACKEND=memory.
+"""
+
+import threading
+from collections import OrderedDict
+
+from countries import COUNTRIES, canonicalize_country
+from storage import (CovidStorage, CASE_METRICS, CHANGE_PAGE_ROWS, change_row, check_granularity,
+                     period_start, to_day_number, from_day_number)
+
+
+class MemoryCovidStorage(CovidStorage):
+    def __init__(self, db_name=None):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._version = 0
+        # (country_id, day) -> [confirmed, deaths, recovered, active]
+        self._cases = {}
+        # (country_id, day) -> version of its latest write, oldest first
+        self._changed = OrderedDict()
+        self._ids = {}
+        self._iso3 = {}
+        for country_id, (name, _, iso3, _) in enumerate(COUNTRIES, start=1):
+            self._ids[name] = country_id
+            self._iso3[country_id] = iso3
+        self._names = {country_id: name for name, country_id in self._ids.items()}
+
+    def _country_id(self, name):
+        """Id of a country by canonical name, adding it if not seen before"""
+        name = canonicalize_country(name)
+        if name not in self._ids:
+            country_id = max(self._names, default=0) + 1
+            self._ids[name] = country_id
+            self._names[country_id] = name
+            self._iso3[country_id] = None
+        return self._ids[name]
+
+    def insert_cases(self, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self._lock:
+            for country, day, *counts in rows:
+                key = (self._country_id(country), to_day_number(day))
+                current = self._cases.setdefault(key, [0] * len(CASE_METRICS))
+                for i, count in enumerate(counts):
+                    current[i] += count
+                self._version += 1
+                self._changed[key] = self._version
+                self._changed.move_to_end(key)
+        return len(rows)
+
+    def get_data_version(self):
+        return self._version
+
+    def get_changes(self, since=None, limit=CHANGE_PAGE_ROWS):
+        with self._lock:
+            if since is None or since > self._version:
+                return {'version': self._version, 'reset': True, 'changes': []}
+            # Walk back from the newest write, so only the delta is visited
+            changed = []
+            for key in reversed(self._changed):
+                if self._changed[key] <= since:
+                    break
+                changed.append((self._changed[key], key, list(self._cases[key])))
+            version = self._version
+        changed = changed[::-1][:limit]
+        return {
+            'version': version,
+            'reset': False,
+            'changes': [change_row(seq, self._names[country_id], day, counts)
+                        for seq, (country_id, day), counts in changed]
+        }
+
+    def _snapshot(self):
+        with self._lock:
+            return [(key, list(counts)) for key, counts in self._cases.items()]
+
+    def _group(self, key_function, granularity='day'):
+        """Sum the rows into buckets keyed by key_function(country_id, period)"""
+        groups = {}
+        for (country_id, day), counts in self._snapshot():
+            key = key_function(country_id, period_start(day, granularity))
+            total = groups.setdefault(key, [0] * len(CASE_METRICS))
+            for i, count in enumerate(counts):
+                total[i] += count
+        return groups
+
+    def _totals(self):
+        return self._group(lambda country_id, day: country_id)
+
+    def _total_rows(self, totals, country_ids):
+        return [
+            dict({'country': self._names[country_id]}, **dict(zip(CASE_METRICS, totals[country_id])))
+            for country_id in country_ids
+        ]
+
+    def _series(self, groups):
+        return [
+            dict({'date': from_day_number(day)}, **dict(zip(CASE_METRICS, groups[day])))
+            for day in sorted(groups)
+        ]
+
+    def get_global_summary(self, granularity='day'):
+        check_granularity(granularity)
+        totals = [0] * len(CASE_METRICS)
+        for _, counts in self._snapshot():
+            for i, count in enumerate(counts):
+                totals[i] += count
+        return {f'total_{metric}': total for metric, total in zip(CASE_METRICS, totals)}
+
+    def get_top_countries(self, metric='confirmed', limit=10, granularity='day'):
+        check_granularity(granularity)
+        if metric not in CASE_METRICS:
+            metric = 'confirmed'
+        totals = self._totals()
+        column = CASE_METRICS.index(metric)
+        top = sorted(totals, key=lambda country_id: -totals[country_id][column])[:limit]
+        return self._total_rows(totals, top)
+
+    def get_all_countries(self):
+        return sorted(self._names[country_id] for country_id in self._totals())
+
+    def get_country_totals(self):
+        totals = self._totals()
+        rows = self._total_rows(totals, sorted(totals, key=self._names.get))
+        for row in rows:
+            row['iso3'] = self._iso3[self._ids[row['country']]]
+        return [{key: row[key] for key in ('country', 'iso3') + CASE_METRICS} for row in rows]
+
+    def compare_countries(self, countries):
+        totals = self._totals()
+        wanted = {self._ids.get(canonicalize_country(country)) for country in countries}
+        return self._total_rows(totals, sorted(wanted & totals.keys()))
+
+    def get_country_data(self, country, granularity='day'):
+        check_granularity(granularity)
+        country_id = self._ids.get(canonicalize_country(country))
+        if country_id is None:
+            return None
+        groups = self._group(lambda cid, day: day if cid == country_id else None, granularity)
+        groups.pop(None, None)
+        return self._series(groups)
+
+    def get_time_series(self, country=None, granularity='day'):
+        if country is not None:
+            return self.get_country_data(country, granularity)
+        check_granularity(granularity)
+        return self._series(self._group(lambda country_id, day: day, granularity))
+
+    def get_case_columns(self):
+        with self._lock:
+            version = self._version
+            rows = sorted((key, list(counts)) for key, counts in self._cases.items())
+        return {
+            'version': version,
+            'country_ids': [key[0] for key, _ in rows],
+            'days': [key[1] for key, _ in rows],
+            'values': [counts for _, counts in rows],
+            'names': dict(self._names)
+        }
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One-time setup and schema migrations for both databases
+
+Processes only read PRAGMA user_version on their first connection and
+leave the tables alone once a file is at the current schema version, so
+run this after deploying a schema change (or rely on the first process
+to open the file) and once to bootstrap a new installation:
+
+    python migrate.py                  # migrate data/covid_data.db and data/users.db
+    python migrate.py --create-admin   # also create the admin user if it does not exist
+"""
+
+import argparse
+import time
+
+from database import CovidDatabase, UserDatabase, get_schema_version
+
+
+def migrate(covid_name='data/covid_data.db', users_name='data/users.db', create_admin=False):
+    """Bring both databases to the current schema version, returns what was done"""
+    done = []
+    for label, database in (('covid', CovidDatabase(covid_name)), ('users', UserDatabase(users_name))):
+        started = time.perf_counter()
+        before = get_schema_version(database.db_name)
+        database.ensure_schema()
+        done.append(f"{label}: schema {before} -> {get_schema_version(database.db_name)} "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    if create_admin:
+        users = UserDatabase(users_name)
+        if users.is_admin('admin'):
+            done.append("admin: already exists")
+        else:
+            users.create_default_admin()
+            done.append("admin: created (username admin, password admin123)")
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create or migrate the COVID-19 app databases')
+    parser.add_argument('--covid-db', default='data/covid_data.db')
+    parser.add_argument('--users-db', default='data/users.db')
+    parser.add_argument('--create-admin', action='store_true', help='create the admin user if it does not exist')
+    args = parser.parse_args(argv)
+
+    for line in migrate(args.covid_db, args.users_db, args.create_admin):
+        print(f"✓ {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory SQLite mirror of the case database
+
+MirroredCovidDatabase copies data/covid_data.db into a shared-cache
+in-memory SQLite database at startup with the backup API and runs every
+read against that copy. Writes go to the disk database first and are then
+applied to the mirror from the case_changes log, the same way changes
+made by other processes are picked up on each refresh_rollups() call
+(which the RollupScheduler runs in the background).
+
+Every sync builds a new generation and swaps it in, so readers never
+wait on a sync and never see half of one. Full reloads and large batches
+copy the disk database again; small batches copy the current in-memory
+generation and apply the changes to that copy before it is swapped in.
+
+Select it with COVID_DB_BACKEND=mirror.
+
+    python mirror.py [db_file]    # warm-up time, memory and latency vs disk
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+from itertools import count
+
+import query_stats
+from database import LOG_FLOOR_SQL, CovidDatabase
+from storage import CHANGE_PAGE_ROWS
+
+# Pending changes above which the mirror is rebuilt instead of patched
+MIRROR_REBUILD_ROWS = 50000
+
+_mirror_ids = count(1)
+
+
+class _Generation(CovidDatabase):
+    """CovidDatabase methods on a mirror generation that is not switched to yet"""
+
+    _schema_ready = True
+
+    def __init__(self, uri):
+        self.uri = uri
+        self._metrics_cache = None
+
+    def _connect(self):
+        return query_stats.connect(self.uri, uri=True)
+
+
+class MirroredCovidDatabase(CovidDatabase):
+    def __init__(self, db_name='data/covid_data.db'):
+        self.db_name = db_name
+        self._metrics_cache = None
+        self._lock = threading.Lock()
+        self._mirror_id = next(_mirror_ids)
+        self._generation = 0
+        self._keeper = None
+        self.warmup_seconds = None
+        self.syncs = 0
+        # Creates or migrates the tables on disk before they are copied
+        self._disk = CovidDatabase(db_name)
+        self._disk.ensure_schema()
+        with self._lock:
+            self._load_mirror()
+
+    def _connect(self):
+        # A generation is never written once readers use it, so they take no conflicting locks
+        while True:
+            uri = self._mirror_uri
+            conn = query_stats.connect(uri, uri=True)
+            # A switch may have dropped that generation before the connection kept it alive
+            if uri == self._mirror_uri:
+                return conn
+            conn.close()
+
+    def _new_generation(self):
+        """Connection keeping a new, empty in-memory database alive, and its URI"""
+        self._generation += 1
+        uri = f'file:covid_mirror_{self._mirror_id}_{self._generation}?mode=memory&cache=shared'
+        # The in-memory database lives as long as this connection stays open
+        return sqlite3.connect(uri, uri=True, check_same_thread=False), uri
+
+    def _switch_to(self, keeper, uri):
+        """Send new reads to another generation, open readers finish on the old one"""
+        previous = self._keeper
+        self._keeper, self._mirror_uri = keeper, uri
+        if previous is not None:
+            previous.close()
+
+    def _load_mirror(self):
+        """Copy the disk database into a new in-memory generation and switch to it"""
+        started = time.perf_counter()
+        keeper, uri = self._new_generation()
+        disk = sqlite3.connect(self.db_name)
+        disk.backup(keeper)
+        disk.close()
+        self._switch_to(keeper, uri)
+        self.warmup_seconds = time.perf_counter() - started
+
+    def sync(self):
+        """Apply disk changes the mirror has not seen yet, returns their number"""
+        with self._lock:
+            disk = query_stats.connect(self.db_name)
+            cursor = disk.cursor()
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'case_changes'")
+            result = cursor.fetchone()
+            disk_seq = result[0] if result else 0
+            cursor.execute(LOG_FLOOR_SQL)
+            log_floor = cursor.fetchone()[0]
+            mirror_seq = self.get_data_version()
+
+            pending = disk_seq - mirror_seq
+            if pending == 0:
+                disk.close()
+                return 0
+            if pending < 0 or mirror_seq < log_floor or pending > MIRROR_REBUILD_ROWS:
+                disk.close()
+                self._load_mirror()
+                self.syncs += 1
+                return pending
+
+            # Patch a copy of the current generation, readers switch once it is complete
+            keeper, uri = self._new_generation()
+            try:
+                current = sqlite3.connect(self._mirror_uri, uri=True)
+                current.backup(keeper)
+                current.close()
+                self._apply_changes(cursor, uri, mirror_seq, disk_seq)
+                _Generation(uri).refresh_rollups()
+            except Exception:
+                # The unfinished generation goes away with its last connection
+                keeper.close()
+                raise
+            finally:
+                disk.close()
+            self._switch_to(keeper, uri)
+            self.syncs += 1
+            return pending
+
+    def _apply_changes(self, cursor, uri, mirror_seq, disk_seq):
+        """Apply the disk changes after mirror_seq up to disk_seq to the generation at uri"""
+        # Net change per country and day, countries added since the last sync
+        cursor.execute('''
+            SELECT country_id, day, SUM(confirmed), SUM(deaths), SUM(recovered), SUM(active)
+            FROM case_changes
+            WHERE seq > ? AND seq <= ?
+            GROUP BY country_id, day
+        ''', (mirror_seq, disk_seq))
+        changes = cursor.fetchall()
+        mirror = query_stats.connect(uri, uri=True)
+        mirror_cursor = mirror.cursor()
+        mirror_cursor.execute('SELECT COALESCE(MAX(id), 0) FROM countries')
+        cursor.execute('SELECT id, name, iso2, iso3, aliases FROM countries WHERE id > ?',
+                       mirror_cursor.fetchone())
+        countries = cursor.fetchall()
+
+        mirror_cursor.executemany('''
+            INSERT INTO countries (id, name, iso2, iso3, aliases) VALUES (?, ?, ?, ?, ?)
+        ''', countries)
+        # Keys gone from disk are deleted, the rest get their net change
+        existing = set()
+        for start in range(0, len(changes), 400):
+            batch = changes[start:start + 400]
+            placeholders = ','.join(['(?, ?)' for _ in batch])
+            cursor.execute(f'''
+                SELECT country_id, day FROM covid_cases
+                WHERE (country_id, day) IN (VALUES {placeholders})
+            ''', [value for row in batch for value in row[:2]])
+            existing.update(cursor.fetchall())
+
+        mirror_cursor.executemany('''
+            INSERT INTO covid_cases (country_id, day, confirmed, deaths, recovered, active)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (country_id, day) DO UPDATE SET
+                confirmed = confirmed + excluded.confirmed,
+                deaths = deaths + excluded.deaths,
+                recovered = recovered + excluded.recovered,
+                active = active + excluded.active
+        ''', [row for row in changes if tuple(row[:2]) in existing])
+        mirror_cursor.executemany('''
+            DELETE FROM covid_cases WHERE country_id = ? AND day = ?
+        ''', [row[:2] for row in changes if tuple(row[:2]) not in existing])
+
+        # Keep the mirror's data version equal to the disk one
+        mirror_cursor.execute('''
+            UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'case_changes'
+        ''', (disk_seq,))
+        if mirror_cursor.rowcount == 0:
+            mirror_cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('case_changes', ?)",
+                                  (disk_seq,))
+        mirror.commit()
+        mirror.close()
+
+    # ----- Writes go to disk, then to the mirror -----
+
+    def insert_cases(self, rows):
+        written = self._disk.insert_cases(rows)
+        self.sync()
+        return written
+
+    def reload_cases(self, rows):
+        loaded = self._disk.reload_cases(rows)
+        self.sync()
+        return loaded
+
+    def rebuild_rollups(self):
+        self._disk.rebuild_rollups()
+        with self._lock:
+            self._load_mirror()
+
+    def refresh_rollups(self):
+        """Refresh the disk rollups, then pull in every change the mirror lacks"""
+        applied = self._disk.refresh_rollups()
+        self.sync()
+        return applied
+
+    def get_changes(self, since=None, limit=CHANGE_PAGE_ROWS):
+        # Syncs copy net changes only, the change log itself is on disk
+        return self._disk.get_changes(since, limit)
+
+    def get_mirror_stats(self):
+        """Warm-up time and memory footprint of the current mirror"""
+        cursor = self._keeper.cursor()
+        cursor.execute('PRAGMA page_count')
+        pages = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        return {
+            'generation': self._generation,
+            'warmup_seconds': round(self.warmup_seconds, 4),
+            'memory_bytes': pages * page_size,
+            'data_version': self.get_data_version(),
+            'syncs': self.syncs
+        }
+
+
+# Reads compared by benchmark(), as (label, method name, arguments)
+BENCHMARK_READS = [
+    ('global summary', 'get_global_summary', ()),
+    ('top countries', 'get_top_countries', ('confirmed', 10)),
+    ('top countries by week', 'get_top_countries', ('confirmed', 10, 'week')),
+    ('all countries', 'get_all_countries', ()),
+    ('country totals', 'get_country_totals', ()),
+    ('compare countries', 'compare_countries', (['United States', 'India', 'Brazil'],)),
+    ('country data', 'get_country_data', ('United States',)),
+    ('global series', 'get_time_series', ()),
+    ('global series by month', 'get_time_series', (None, 'month')),
+]
+
+
+def _median_seconds(function, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def benchmark(db_name='data/covid_data.db', repeat=20):
+    """Compare read latency on disk and in the mirror, returns a JSON-able dict"""
+    disk = CovidDatabase(db_name)
+    started = time.perf_counter()
+    mirror = MirroredCovidDatabase(db_name)
+    startup = time.perf_counter() - started
+
+    reads = {}
+    for label, method, args in BENCHMARK_READS:
+        disk_seconds = _median_seconds(getattr(disk, method), args, repeat)
+        mirror_seconds = _median_seconds(getattr(mirror, method), args, repeat)
+        reads[label] = {
+            'disk_ms': round(disk_seconds * 1000, 3),
+            'mirror_ms': round(mirror_seconds * 1000, 3),
+            'speedup': round(disk_seconds / mirror_seconds, 2) if mirror_seconds else None
+        }
+    return dict(mirror.get_mirror_stats(), startup_seconds=round(startup, 4), reads=reads)
+
+
+if __name__ == "__main__":
+    results = benchmark(sys.argv[1] if len(sys.argv) > 1 else 'data/covid_data.db')
+    print(f"Mirror warm-up: {results['warmup_seconds'] * 1000:.1f} ms "
+          f"(startup incl. schema check {results['startup_seconds'] * 1000:.1f} ms)")
+    print(f"Mirror memory:  {results['memory_bytes'] / 1024 / 1024:.2f} MiB")
+    print(f"\n{'Read':<26} {'Disk ms':>10} {'Mirror ms':>10} {'Speedup':>8}")
+    print("-" * 58)
+    for label, timing in results['reads'].items():
+        print(f"{label:<26} {timing['disk_ms']:>10.3f} {timing['mirror_ms']:>10.3f} "
+              f"{timing['speedup'] or 0:>7.2f}x")
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Render timing of the Streamlit pages
+
+@timed_page('dashboard') around a page's show() times every render of it.
+Renders are told apart as 'load' (the user navigated to the page) and
+'interaction' (the page was rendered again, so a widget on it changed).
+Timings live in the Streamlit server process, shared by all sessions, and
+use the same log2 histograms as query_stats. Sessions seen in the last
+ACTIVE_SESSION_SECONDS count as active.
+"""
+
+import os
+import threading
+import time
+from functools import wraps
+
+from query_stats import QueryStats
+
+ACTIVE_SESSION_SECONDS = 300
+
+_lock = threading.Lock()
+_pages = {}
+_sessions = {}
+
+
+def _session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def record_render(page, kind, seconds, session_id=None):
+    with _lock:
+        stats = _pages.get((page, kind))
+        if stats is None:
+            stats = _pages[(page, kind)] = QueryStats()
+        stats.add(seconds, 0, None)
+        if session_id is not None:
+            _sessions[session_id] = time.time()
+
+
+def timed_page(page):
+    """Decorator recording how long each render of a page's show() takes"""
+    def decorator(show):
+        @wraps(show)
+        def timed(*args, **kwargs):
+            import streamlit as st
+
+            kind = 'interaction' if st.session_state.get('_timed_page') == page else 'load'
+            st.session_state['_timed_page'] = page
+            started = time.perf_counter()
+            try:
+                return show(*args, **kwargs)
+            finally:
+                # Also runs for st.stop() and st.rerun(), which end a render early
+                record_render(page, kind, time.perf_counter() - started, _session_id())
+        return timed
+    return decorator
+
+
+def get_page_timings():
+    """One dict per page and render kind, the slowest total first"""
+    with _lock:
+        rows = [dict(stats.to_dict(page), kind=kind) for (page, kind), stats in _pages.items()]
+    for row in rows:
+        row['page'] = row.pop('query')
+        del row['rows'], row['call_sites']
+    return sorted(rows, key=lambda row: -row['total_ms'])
+
+
+def get_active_sessions():
+    """Sessions that rendered a timed page in the last ACTIVE_SESSION_SECONDS"""
+    cutoff = time.time() - ACTIVE_SESSION_SECONDS
+    with _lock:
+        for session_id in [key for key, seen in _sessions.items() if seen < cutoff]:
+            del _sessions[session_id]
+        return len(_sessions)
+
+
+def get_process_memory():
+    """Resident and peak resident memory of this process in bytes, None where unknown"""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if os.uname().sysname == 'Darwin' else 1024
+    except (ImportError, AttributeError):
+        pass
+    return {'rss_bytes': current, 'peak_rss_bytes': peak}
+
+
+def reset_page_timings():
+    with _lock:
+        _pages.clear()
@@ -5,15 +5,16 @@ This package contains all the page modules for the COVID-19 dashboard applicatio
 Each module represents a separate page or functionality of the application.
 """
 
-# Import all page modules
-from . import auth
-from . import dashboard
-from . import compare
-from . import add_case
-from . import users
+import importlib
 
 # Define what should be available when using "from pages import *"
-__all__ = ['auth', 'dashboard', 'compare', 'add_case', 'users']
+__all__ = ['auth', 'dashboard', 'compare', 'add_case', 'users', 'performance']
+
+def __getattr__(name):
+    """Import page modules on first access, so plotly and pandas load with the first page using them"""
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Package metadata
 __version__ = '1.0.0'
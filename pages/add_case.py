@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 from datetime import datetime, date
+from countries import canonicalize_country
+from page_timing import timed_page
 
+@timed_page('add_case')
 def show(covid_db):
     """Display add case page"""
     st.markdown('<h1 class="main-header">➕ Add New COVID-19 Case</h1>', unsafe_allow_html=True)
@@ -92,7 +95,7 @@ def show(covid_db):
                 else:
                     # Prepare case data
                     case_data = {
-                        'country': country.strip().title(),
+                        'country': canonicalize_country(country),
                         'date': str(case_date),
                         'confirmed': int(confirmed),
                         'deaths': int(deaths),
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
+from login_limiter import LoginRateLimited
 
 def login_page(user_db):
     """Display login page"""
@@ -21,7 +22,11 @@ def login_page(user_db):
         
         if login_btn:
             if username and password:
-                success, msg, role = user_db.authenticate_user(username, password)
+                client_ip = getattr(st.context, 'ip_address', None)
+                try:
+                    success, msg, role = user_db.authenticate_user(username, password, client_ip)
+                except LoginRateLimited as e:
+                    success, msg, role = False, str(e), None
                 if success:
                     st.session_state.logged_in = True
                     st.session_state.username = username
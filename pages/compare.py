@@ -3,7 +3,12 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from comparison import MAX_COMPARE_COUNTRIES, PER_CAPITA, compare_series
+from export import IN_MEMORY_EXPORT_ROWS, export_cases, export_url, fits_in_memory
+from storage import CASE_METRICS
+from page_timing import timed_page
 
+@timed_page('compare')
 def show(covid_db):
     """Display country comparison page"""
     st.markdown('<h1 class="main-header">⚖️ Compare Countries</h1>', unsafe_allow_html=True)
@@ -19,10 +24,10 @@ def show(covid_db):
     col1, col2 = st.columns([3, 1])
     with col1:
         selected = st.multiselect(
-            "Select countries to compare (2-5 countries)",
+            f"Select countries to compare (2-{MAX_COMPARE_COUNTRIES} countries)",
             countries,
-            max_selections=5,
-            help="Choose between 2 and 5 countries for comparison"
+            max_selections=MAX_COMPARE_COUNTRIES,
+            help=f"Choose between 2 and {MAX_COMPARE_COUNTRIES} countries for comparison"
         )
     
     with col2:
@@ -46,14 +51,30 @@ def show(covid_db):
                 height=250
             )
             
-            # Download button
-            csv = df.to_csv(index=False)
-            st.download_button(
-                label="📥 Download CSV",
-                data=csv,
-                file_name="covid_comparison.csv",
-                mime="text/csv"
-            )
+            # Download buttons - the files are only built when clicked
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    label="📥 Download CSV",
+                    data=lambda: df.to_csv(index=False),
+                    file_name="covid_comparison.csv",
+                    mime="text/csv"
+                )
+            with col2:
+                # Stream from the API when there is one, only small exports are built here
+                url = export_url('csv', selected, compress=True)
+                if url:
+                    st.link_button("📥 Download Daily Records (CSV)", url)
+                elif fits_in_memory(covid_db, selected):
+                    st.download_button(
+                        label="📥 Download Daily Records (CSV)",
+                        data=lambda: b''.join(export_cases(covid_db, 'csv', selected)),
+                        file_name="covid_comparison_daily.csv",
+                        mime="text/csv"
+                    )
+                else:
+                    st.caption(f"📥 Daily records are over {IN_MEMORY_EXPORT_ROWS:,} rows, "
+                               "set COVID_API_URL to download them from the API")
             
             st.markdown("---")
             
@@ -127,6 +148,48 @@ def show(covid_db):
                         )
                         st.plotly_chart(fig, use_container_width=True)
                 
+                # Date-aligned series of every selected country
+                st.markdown("---")
+                st.markdown("### 📈 Time Series Comparison")
+                
+                col1, col2, col3 = st.columns([2, 1, 1])
+                with col1:
+                    series_metric = st.selectbox(
+                        "Metric over time",
+                        CASE_METRICS,
+                        format_func=lambda x: x.title()
+                    )
+                with col2:
+                    per_capita = st.toggle(f"Per {PER_CAPITA:,} people", key='compare_per_capita')
+                with col3:
+                    per_day = st.toggle("New per day", key='compare_per_day')
+                
+                series = compare_series(covid_db, selected, series_metric, per_capita, per_day)
+                if series['dates']:
+                    fig = go.Figure()
+                    for country, values in zip(series['countries'], series['values']):
+                        # WebGL traces keep a hundred long series responsive
+                        fig.add_trace(go.Scattergl(
+                            name=country,
+                            x=series['dates'],
+                            y=values,
+                            mode='lines'
+                        ))
+                    
+                    label = ('New ' if per_day else '') + series_metric.title()
+                    if per_capita:
+                        label += f' per {PER_CAPITA:,} People'
+                    fig.update_layout(
+                        title=f'{label} Over Time',
+                        xaxis_title='Date',
+                        yaxis_title=label,
+                        hovermode='x unified' if len(series['countries']) <= 10 else 'closest',
+                        height=500
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                    if series['no_population']:
+                        st.caption(f"No population figure for {', '.join(series['no_population'])}")
+                
                 # Statistics summary
                 st.markdown("---")
                 st.markdown("### 📊 Statistical Summary")
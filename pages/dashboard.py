@@ -3,15 +3,70 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from snapshot import country_totals_frame
+from export import IN_MEMORY_EXPORT_ROWS, export_cases, export_url, fits_in_memory
+from live_updates import apply_event, drain, get_broadcaster
+from page_timing import timed_page
+from storage import CASE_METRICS, page_country_totals
 
+# How often live mode checks for pushed changes, the check itself runs no query
+LIVE_REFRESH_SECONDS = 2
+
+def _live_totals(covid_db):
+    """Country totals kept in the session, updated from the broadcaster's events"""
+    live = st.session_state.get('dashboard_live_state')
+    if live is None:
+        # Subscribe before loading, subscribe() reads the baseline so no write can fall in between
+        subscriber = get_broadcaster(covid_db).subscribe()
+        live = st.session_state['dashboard_live_state'] = {
+            'subscriber': subscriber,
+            'totals': country_totals_frame(covid_db)
+        }
+    
+    events = drain(live['subscriber'])
+    resets = [i for i, event in enumerate(events) if event['reset']]
+    if resets:
+        live['totals'] = country_totals_frame(covid_db)
+        events = events[resets[-1] + 1:]
+    for event in events:
+        live['totals'] = apply_event(live['totals'], event)
+    return live['totals']
+
+def _stop_live(covid_db):
+    live = st.session_state.pop('dashboard_live_state', None)
+    if live is not None:
+        get_broadcaster(covid_db).unsubscribe(live['subscriber'])
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def _watch_live(subscriber):
+    """Rerun the page once events are waiting"""
+    if not subscriber.empty():
+        st.rerun()
+
+@timed_page('dashboard')
 def show(covid_db):
     """Display main dashboard page"""
     st.markdown('<h1 class="main-header">🦠 COVID-19 Global Dashboard</h1>', unsafe_allow_html=True)
     st.markdown(f"**Welcome back, {st.session_state.username}!**")
     
-    # Global Summary Metrics
-    summary = covid_db.get_global_summary()
+    live = st.toggle("🔴 Live updates", key='dashboard_live',
+                     help="Apply new cases as they are written instead of querying again on every rerun")
+    if live:
+        # Aggregates come from the session's country totals, pushed changes are applied to them
+        df_map = _live_totals(covid_db)
+        summary = {f'total_{metric}': int(df_map[metric].sum()) for metric in CASE_METRICS}
+        top_countries = lambda metric: df_map.nlargest(10, metric).drop(columns=['iso3']).to_dict('records')
+        query_countries = lambda *query: page_country_totals(df_map.to_dict('records'), *query)
+        _watch_live(st.session_state['dashboard_live_state']['subscriber'])
+    else:
+        _stop_live(covid_db)
+        summary = covid_db.get_global_summary()
+        # All countries data for the map, from the Arrow snapshot when it is current
+        df_map = country_totals_frame(covid_db)
+        top_countries = lambda metric: covid_db.get_top_countries(metric, 10)
+        query_countries = covid_db.query_country_totals
     
+    # Global Summary Metrics
     if summary:
         st.markdown("### 🌍 Global Statistics")
         col1, col2, col3, col4 = st.columns(4)
@@ -39,100 +94,105 @@ def show(covid_db):
     # Interactive World Map
     st.markdown("### 🗺️ Interactive World Map - COVID-19 Cases by Country")
     
-    # Get all countries data for map
-    all_countries = covid_db.get_all_countries()
-    if all_countries:
-        map_data = []
-        for country in all_countries:
-            country_data = covid_db.compare_countries([country])
-            if country_data:
-                map_data.append(country_data[0])
+    if not df_map.empty:
         
-        if map_data:
-            df_map = pd.DataFrame(map_data)
-            
-            # Metric selector for map
-            col_metric, col_scale = st.columns([3, 1])
-            with col_metric:
-                map_metric = st.selectbox(
-                    "Select metric to display on map",
-                    ['confirmed', 'deaths', 'recovered', 'active'],
-                    format_func=lambda x: x.replace('_', ' ').title()
-                )
-            
-            with col_scale:
-                color_scales = {
-                    'confirmed': 'Reds',
-                    'deaths': 'Greys',
-                    'recovered': 'Greens',
-                    'active': 'Oranges'
-                }
-                selected_scale = color_scales.get(map_metric, 'Reds')
-            
-            # Create choropleth map
-            fig_map = px.choropleth(
-                df_map,
-                locations="country",
-                locationmode='country names',
-                color=map_metric,
-                hover_name="country",
-                hover_data={
-                    'confirmed': ':,',
-                    'deaths': ':,',
-                    'recovered': ':,',
-                    'active': ':,',
-                    'country': False
-                },
-                color_continuous_scale=selected_scale,
-                labels={map_metric: map_metric.replace('_', ' ').title()},
-                title=f'{map_metric.title()} Cases Worldwide'
+        # Metric selector for map
+        col_metric, col_scale = st.columns([3, 1])
+        with col_metric:
+            map_metric = st.selectbox(
+                "Select metric to display on map",
+                ['confirmed', 'deaths', 'recovered', 'active'],
+                format_func=lambda x: x.replace('_', ' ').title()
             )
-            
-            fig_map.update_layout(
-                height=500,
-                geo=dict(
-                    showframe=False,
-                    showcoastlines=True,
-                    projection_type='natural earth'
-                )
+        
+        with col_scale:
+            color_scales = {
+                'confirmed': 'Reds',
+                'deaths': 'Greys',
+                'recovered': 'Greens',
+                'active': 'Oranges'
+            }
+            selected_scale = color_scales.get(map_metric, 'Reds')
+        
+        # Create choropleth map
+        fig_map = px.choropleth(
+            df_map[df_map['iso3'].notna()],
+            locations="iso3",
+            locationmode='ISO-3',
+            color=map_metric,
+            hover_name="country",
+            hover_data={
+                'confirmed': ':,',
+                'deaths': ':,',
+                'recovered': ':,',
+                'active': ':,',
+                'iso3': False
+            },
+            color_continuous_scale=selected_scale,
+            labels={map_metric: map_metric.replace('_', ' ').title()},
+            title=f'{map_metric.title()} Cases Worldwide'
+        )
+        
+        fig_map.update_layout(
+            height=500,
+            geo=dict(
+                showframe=False,
+                showcoastlines=True,
+                projection_type='natural earth'
             )
+        )
+        
+        st.plotly_chart(fig_map, use_container_width=True)
+        
+        # Country details on click simulation
+        st.markdown("#### 🔍 Country Details")
+        selected_country = st.selectbox(
+            "Select a country to view detailed information",
+            df_map['country'].tolist()
+        )
+        
+        if selected_country:
+            country_info = df_map[df_map['country'] == selected_country].iloc[0]
             
-            st.plotly_chart(fig_map, use_container_width=True)
-            
-            # Country details on click simulation
-            st.markdown("#### 🔍 Country Details")
-            selected_country = st.selectbox(
-                "Select a country to view detailed information",
-                df_map['country'].tolist()
-            )
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Confirmed", f"{country_info['confirmed']:,}")
+            with col2:
+                st.metric("Deaths", f"{country_info['deaths']:,}")
+            with col3:
+                st.metric("Recovered", f"{country_info['recovered']:,}")
+            with col4:
+                st.metric("Active", f"{country_info['active']:,}")
             
-            if selected_country:
-                country_info = df_map[df_map['country'] == selected_country].iloc[0]
+            # Calculate rates
+            if country_info['confirmed'] > 0:
+                recovery_rate = (country_info['recovered'] / country_info['confirmed'] * 100)
+                mortality_rate = (country_info['deaths'] / country_info['confirmed'] * 100)
+                active_rate = (country_info['active'] / country_info['confirmed'] * 100)
                 
-                col1, col2, col3, col4 = st.columns(4)
+                col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric("Confirmed", f"{country_info['confirmed']:,}")
+                    st.metric("Recovery Rate", f"{recovery_rate:.2f}%")
                 with col2:
-                    st.metric("Deaths", f"{country_info['deaths']:,}")
+                    st.metric("Mortality Rate", f"{mortality_rate:.2f}%")
                 with col3:
-                    st.metric("Recovered", f"{country_info['recovered']:,}")
-                with col4:
-                    st.metric("Active", f"{country_info['active']:,}")
-                
-                # Calculate rates
-                if country_info['confirmed'] > 0:
-                    recovery_rate = (country_info['recovered'] / country_info['confirmed'] * 100)
-                    mortality_rate = (country_info['deaths'] / country_info['confirmed'] * 100)
-                    active_rate = (country_info['active'] / country_info['confirmed'] * 100)
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Recovery Rate", f"{recovery_rate:.2f}%")
-                    with col2:
-                        st.metric("Mortality Rate", f"{mortality_rate:.2f}%")
-                    with col3:
-                        st.metric("Active Rate", f"{active_rate:.2f}%")
-    
+                    st.metric("Active Rate", f"{active_rate:.2f}%")
+            
+            # Latest trend from the derived metrics engine
+            series = covid_db.get_derived_metrics(selected_country)
+            if series:
+                latest = series[-1]
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    avg = latest['confirmed_avg7']
+                    st.metric("New Cases (7-day avg)", f"{avg:,.0f}" if avg is not None else "N/A")
+                with col2:
+                    growth = latest['growth_rate']
+                    st.metric("Daily Growth", f"{growth * 100:.2f}%" if growth is not None else "N/A")
+                with col3:
+                    doubling = latest['doubling_time']
+                    st.metric("Doubling Time", f"{doubling:,.1f} days" if doubling is not None else "N/A")
+
     st.markdown("---")
     
     # Statistics Overview
@@ -140,7 +200,7 @@ def show(covid_db):
     
     with col1:
         st.markdown("### 📊 Top 10 Most Affected Countries")
-        top_confirmed = covid_db.get_top_countries('confirmed', 10)
+        top_confirmed = top_countries('confirmed')
         if top_confirmed:
             df_top = pd.DataFrame(top_confirmed)
             
@@ -166,7 +226,7 @@ def show(covid_db):
     
     with col2:
         st.markdown("### 💀 Top 10 Countries by Deaths")
-        top_deaths = covid_db.get_top_countries('deaths', 10)
+        top_deaths = top_countries('deaths')
         if top_deaths:
             df_deaths = pd.DataFrame(top_deaths)
             
@@ -198,7 +258,7 @@ def show(covid_db):
     
     with col1:
         st.markdown("#### 🟢 Top 10 Recovery Rates")
-        top_recovered = covid_db.get_top_countries('recovered', 10)
+        top_recovered = top_countries('recovered')
         if top_recovered:
             df_recovered = pd.DataFrame(top_recovered)
             if 'confirmed' in df_recovered.columns and 'recovered' in df_recovered.columns:
@@ -293,50 +353,71 @@ def show(covid_db):
     
     st.markdown("---")
     
-    # Data Table with Search
+    # Data Table with Search, filtered, sorted and paged by the storage backend
     st.markdown("### 📋 All Countries Data")
-    if map_data:
-        df_all = pd.DataFrame(map_data)
-        
+    if not df_map.empty:
         # Search functionality
-        search = st.text_input("🔍 Search for a country", "")
-        if search:
-            df_filtered = df_all[df_all['country'].str.contains(search, case=False)]
-        else:
-            df_filtered = df_all
+        search = st.text_input("🔍 Search for a country", "", help="Countries whose name starts with this")
         
-        # Sort options
-        col1, col2 = st.columns([2, 1])
+        # Sort and page options
+        col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
         with col1:
             sort_by = st.selectbox(
                 "Sort by",
-                ['confirmed', 'deaths', 'recovered', 'active'],
+                CASE_METRICS + ('country',),
                 format_func=lambda x: x.replace('_', ' ').title()
             )
         with col2:
             sort_order = st.radio("Order", ["Descending", "Ascending"], horizontal=True)
+        with col3:
+            page_size = st.selectbox("Rows per page", [25, 50, 100], index=1)
+        with col4:
+            page = st.number_input("Page", min_value=1, value=1, step=1, key='dashboard_countries_page')
         
-        df_sorted = df_filtered.sort_values(
-            by=sort_by,
-            ascending=(sort_order == "Ascending")
-        )
+        descending = sort_order == "Descending"
+        result = query_countries(search, sort_by, descending, int(page), page_size)
+        if not result['countries'] and result['pages']:
+            # Past the last page, e.g. after narrowing the search
+            result = query_countries(search, sort_by, descending, result['pages'], page_size)
         
+        df_page = pd.DataFrame(result['countries'], columns=['country', 'iso3', *CASE_METRICS])
         st.dataframe(
-            df_sorted.style.format({
-                'confirmed': '{:,.0f}',
-                'deaths': '{:,.0f}',
-                'recovered': '{:,.0f}',
-                'active': '{:,.0f}'
-            }),
+            df_page.drop(columns=['iso3']),
+            column_config={
+                'country': st.column_config.TextColumn('Country'),
+                **{metric: st.column_config.NumberColumn(metric.title(), format='localized')
+                   for metric in CASE_METRICS}
+            },
+            hide_index=True,
             use_container_width=True,
             height=400
         )
+        st.caption(f"Page {result['page']} of {max(result['pages'], 1)} · {result['total']:,} countries")
         
-        # Download button
-        csv = df_sorted.to_csv(index=False)
-        st.download_button(
-            label="📥 Download Full Data as CSV",
-            data=csv,
-            file_name="covid_data_all_countries.csv",
-            mime="text/csv"
-        )
\ No newline at end of file
+        # Download buttons - the files are only built when clicked
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                label="📥 Download Full Data as CSV",
+                data=lambda: pd.DataFrame(
+                    query_countries(search, sort_by, descending, 1, max(result['total'], 1))['countries'],
+                    columns=['country', 'iso3', *CASE_METRICS]
+                ).drop(columns=['iso3']).to_csv(index=False),
+                file_name="covid_data_all_countries.csv",
+                mime="text/csv"
+            )
+        with col2:
+            # Stream from the API when there is one, only small exports are built here
+            url = export_url('csv', compress=True)
+            if url:
+                st.link_button("📥 Download Daily Records (CSV)", url)
+            elif fits_in_memory(covid_db):
+                st.download_button(
+                    label="📥 Download Daily Records (CSV, gzip)",
+                    data=lambda: b''.join(export_cases(covid_db, 'csv', compress=True)),
+                    file_name="covid_cases.csv.gz",
+                    mime="application/gzip"
+                )
+            else:
+                st.caption(f"📥 Daily records are over {IN_MEMORY_EXPORT_ROWS:,} rows, "
+                           "set COVID_API_URL to download them from the API")
\ No newline at end of file
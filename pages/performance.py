@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import streamlit as st
+import pandas as pd
+import page_timing
+import query_stats
+import telemetry
+from page_timing import timed_page
+
+def _megabytes(value):
+    return f"{value / 1024 / 1024:,.1f} MB" if value is not None else "n/a"
+
+@timed_page('performance')
+def show(covid_db):
+    """Display the admin performance page"""
+
+    # Check if user is admin
+    if st.session_state.role != 'admin':
+        st.error("🚫 Access Denied")
+        st.warning("You don't have permission to access this page. This page is only available for administrators.")
+        return
+
+    st.markdown('<h1 class="main-header">⏱️ Performance</h1>', unsafe_allow_html=True)
+    st.markdown("Render times, database timings and caches of this server process - **Admin Only**")
+
+    # Process overview
+    memory = page_timing.get_process_memory()
+    connections = query_stats.get_connection_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Active Sessions", page_timing.get_active_sessions(),
+                help=f"Sessions that rendered a page in the last {page_timing.ACTIVE_SESSION_SECONDS // 60} minutes")
+    col2.metric("Process Memory", _megabytes(memory['rss_bytes']),
+                help=f"Peak: {_megabytes(memory['peak_rss_bytes'])}")
+    col3.metric("DB Connections Opened", f"{connections['opened']:,}", help=f"Open now: {connections['open']}")
+    col4.metric("Data Version", f"{covid_db.get_data_version():,}")
+
+    st.markdown("---")
+
+    # Page render times
+    st.markdown("### 🖥️ Page Render Times")
+    st.caption("'load' is navigating to a page, 'interaction' a rerun of the same page after a widget changed")
+    timings = page_timing.get_page_timings()
+    if timings:
+        df = pd.DataFrame(timings)[['page', 'kind', 'count', 'mean_ms', 'p50_ms', 'p95_ms',
+                                    'p99_ms', 'max_ms', 'total_ms']]
+        st.dataframe(df, use_container_width=True, hide_index=True)
+    else:
+        st.info("No pages rendered yet")
+
+    st.markdown("---")
+
+    # Database query timings
+    st.markdown("### 🗄️ Database Queries")
+    if not query_stats.ENABLED:
+        st.info("Query timing is disabled (QUERY_STATS=0)")
+    else:
+        col1, col2 = st.columns([3, 1])
+        with col2:
+            sort = st.selectbox("Sort by", ['total_ms', 'count', 'mean_ms', 'p95_ms', 'max_ms', 'rows'])
+            limit = st.selectbox("Statements", [10, 25, 50, 100], index=1)
+        with col1:
+            queries = query_stats.get_query_stats(limit, sort)
+            if queries:
+                df = pd.DataFrame(queries)[['query', 'count', 'rows', 'mean_ms', 'p95_ms', 'max_ms', 'total_ms']]
+                st.dataframe(df, use_container_width=True, hide_index=True)
+            else:
+                st.info("No queries recorded yet")
+
+        slow = query_stats.get_slow_queries()
+        with st.expander(f"🐢 Slow queries ({len(slow)}, threshold {query_stats.SLOW_QUERY_MS:g} ms)"):
+            for entry in slow[:20]:
+                st.markdown(f"**{entry['duration_ms']:,.1f} ms** at `{entry['call_site']}` ({entry['time']})")
+                st.code(entry['query'] + ('\n-- ' + '\n-- '.join(entry['plan']) if entry['plan'] else ''),
+                        language='sql')
+
+    st.markdown("---")
+
+    # Cache hit rates
+    st.markdown("### 🎯 Cache Hit Rates")
+    caches = telemetry.get_cache_stats()
+    if caches:
+        cols = st.columns(len(caches))
+        for col, (cache, counts) in zip(cols, caches.items()):
+            rate = counts['hit_rate']
+            col.metric(cache.replace('_', ' ').title(), f"{rate:.0%}" if rate is not None else "n/a",
+                       help=f"{counts['hits']:,} hits, {counts['misses']:,} misses")
+    else:
+        st.info("No cache lookups yet")
+
+    st.markdown("---")
+
+    if st.button("🔄 Reset timings", use_container_width=True):
+        page_timing.reset_page_timings()
+        query_stats.reset_query_stats()
+        st.rerun()
@@ -1,8 +1,25 @@
 # -*- coding: utf-8 -*-
+import io
 import streamlit as st
 import pandas as pd
 from datetime import datetime
+from database import read_users_csv
+from page_timing import timed_page
 
+SORT_LABELS = {
+    'newest': 'Newest first',
+    'oldest': 'Oldest first',
+    'username': 'Username (A-Z)',
+    'most_active': 'Most logins',
+    'last_login': 'Last login'
+}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def count_users_cached(_user_db, search):
+    """Total users matching a search, cached so paging doesn't recount"""
+    return _user_db.count_users(search)
+
+@timed_page('users')
 def show(user_db):
     """Display user management page"""
     
@@ -112,88 +129,98 @@ def show(user_db):
     # All Users List
     st.markdown("### 📋 All Registered Users")
     
-    users = user_db.get_all_users()
+    # Search, sort and paging controls - filtering happens in the database
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        search = st.text_input("🔍 Search users by username or name", "")
+    with col2:
+        sort = st.selectbox(
+            "Sort by",
+            list(SORT_LABELS.keys()),
+            format_func=lambda x: SORT_LABELS[x]
+        )
+    with col3:
+        page_size = st.selectbox("Rows per page", [25, 50, 100, 250], index=1)
+    
+    total = count_users_cached(user_db, search)
+    page_count = max(1, -(-total // page_size))
+    
+    page = st.number_input(
+        f"Page (of {page_count:,})",
+        min_value=1,
+        max_value=page_count,
+        value=1,
+        step=1,
+        key=f"users_page_{search}_{sort}_{page_size}"
+    )
+    st.caption(f"{total:,} user(s) found")
+    
+    users = user_db.search_users(search, sort, int(page), page_size)
     
     if users:
-        df_users = pd.DataFrame(users)
+        df_display = pd.DataFrame(users)
+        df_display['is_active'] = df_display['is_active'].map({1: '✅ Active', 0: '❌ Inactive'})
         
-        # Search functionality
-        search = st.text_input("🔍 Search users by username or name", "")
-        if search:
-            df_filtered = df_users[
-                df_users['username'].str.contains(search, case=False) | 
-                df_users['full_name'].fillna('').str.contains(search, case=False)
-            ]
-        else:
-            df_filtered = df_users
+        # Rename columns for better display
+        df_display = df_display.rename(columns={
+            'username': 'Username',
+            'full_name': 'Full Name',
+            'email': 'Email',
+            'role': 'Role',
+            'created_at': 'Registered',
+            'last_login': 'Last Login',
+            'login_count': 'Logins',
+            'is_active': 'Status'
+        })
         
-        # Format dates for better display
-        if not df_filtered.empty:
-            df_display = df_filtered.copy()
-            df_display['created_at'] = pd.to_datetime(df_display['created_at']).dt.strftime('%Y-%m-%d %H:%M')
-            df_display['last_login'] = pd.to_datetime(df_display['last_login'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M')
-            df_display['is_active'] = df_display['is_active'].map({1: '✅ Active', 0: '❌ Inactive'})
-            
-            # Rename columns for better display
-            df_display = df_display.rename(columns={
-                'username': 'Username',
-                'full_name': 'Full Name',
-                'email': 'Email',
-                'role': 'Role',
-                'created_at': 'Registered',
-                'last_login': 'Last Login',
-                'login_count': 'Logins',
-                'is_active': 'Status'
-            })
-            
-            # Format role column
-            df_display['Role'] = df_display['Role'].map({'admin': '🔑 Admin', 'user': '👤 User'})
-            
-            st.dataframe(
-                df_display,
-                use_container_width=True,
-                height=400,
-                column_config={
-                    "Username": st.column_config.TextColumn("Username", width="medium"),
-                    "Full Name": st.column_config.TextColumn("Full Name", width="medium"),
-                    "Email": st.column_config.TextColumn("Email", width="medium"),
-                    "Role": st.column_config.TextColumn("Role", width="small"),
-                    "Registered": st.column_config.TextColumn("Registered", width="medium"),
-                    "Last Login": st.column_config.TextColumn("Last Login", width="medium"),
-                    "Logins": st.column_config.NumberColumn("Logins", width="small"),
-                    "Status": st.column_config.TextColumn("Status", width="small")
-                }
-            )
-            
-            # Download users list
-            csv = df_display.to_csv(index=False)
-            st.download_button(
-                label="📥 Download Users List (CSV)",
-                data=csv,
-                file_name=f"users_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
-            )
-        else:
-            st.info("No users found matching your search")
-    else:
+        # Format role column
+        df_display['Role'] = df_display['Role'].map({'admin': '🔑 Admin', 'user': '👤 User'})
+        
+        st.dataframe(
+            df_display,
+            use_container_width=True,
+            height=400,
+            column_config={
+                "Username": st.column_config.TextColumn("Username", width="medium"),
+                "Full Name": st.column_config.TextColumn("Full Name", width="medium"),
+                "Email": st.column_config.TextColumn("Email", width="medium"),
+                "Role": st.column_config.TextColumn("Role", width="small"),
+                "Registered": st.column_config.TextColumn("Registered", width="medium"),
+                "Last Login": st.column_config.TextColumn("Last Login", width="medium"),
+                "Logins": st.column_config.NumberColumn("Logins", width="small"),
+                "Status": st.column_config.TextColumn("Status", width="small")
+            }
+        )
+        
+        # Download the current page
+        csv = df_display.to_csv(index=False)
+        st.download_button(
+            label="📥 Download This Page (CSV)",
+            data=csv,
+            file_name=f"users_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv"
+        )
+    elif total == 0 and not search:
         st.warning("No users registered yet")
+    else:
+        st.info("No users found matching your search")
     
     st.markdown("---")
     
     # User Activity Chart
     st.markdown("### 📈 User Activity")
     
-    if users:
-        df_activity = pd.DataFrame(users)
+    if stats['total_users']:
+        import plotly.express as px
         
         col1, col2 = st.columns(2)
         
         with col1:
             # Login count distribution
-            import plotly.express as px
+            df_activity = pd.DataFrame(user_db.search_users(sort='most_active', page_size=10))
             
             fig = px.bar(
-                df_activity.sort_values('login_count', ascending=False).head(10),
+                df_activity,
                 x='username',
                 y='login_count',
                 title='Top 10 Most Active Users',
@@ -203,51 +230,11 @@ def show(user_db):
             )
             fig.update_layout(xaxis_tickangle=-45, showlegend=False)
             st.plotly_chart(fig, use_container_width=True)
-    
-    st.markdown("---")
-    
-    # User Actions Section
-    st.markdown("### ⚙️ User Actions")
-    
-    with st.expander("🔧 Manage User Status"):
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("#### Activate User")
-            user_to_activate = st.selectbox(
-                "Select user to activate",
-                [u['username'] for u in users if not u['is_active']],
-                key="activate_user"
-            )
-            if st.button("✅ Activate User", use_container_width=True):
-                if user_to_activate:
-                    success, msg = user_db.activate_user(user_to_activate)
-                    if success:
-                        st.success(f"✅ {msg}")
-                        st.rerun()
-                    else:
-                        st.error(f"❌ {msg}")
-        
-        with col2:
-            st.markdown("#### Deactivate User")
-            user_to_deactivate = st.selectbox(
-                "Select user to deactivate",
-                [u['username'] for u in users if u['is_active'] and u['username'] != 'admin'],
-                key="deactivate_user"
-            )
-            if st.button("❌ Deactivate User", use_container_width=True):
-                if user_to_deactivate:
-                    success, msg = user_db.deactivate_user(user_to_deactivate)
-                    if success:
-                        st.warning(f"⚠️ {msg}")
-                        st.rerun()
-                    else:
-                        st.error(f"❌ {msg}")
         
         with col2:
             # Active vs Inactive users
-            active_count = df_activity['is_active'].sum()
-            inactive_count = len(df_activity) - active_count
+            active_count = stats['active_users']
+            inactive_count = stats['total_users'] - active_count
             
             fig = px.pie(
                 values=[active_count, inactive_count],
@@ -255,4 +242,55 @@ def show(user_db):
                 title='User Status Distribution',
                 color_discrete_sequence=['#51cf66', '#ff6b6b']
             )
-            st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+            st.plotly_chart(fig, use_container_width=True)
+    
+    st.markdown("---")
+    
+    # User Actions Section
+    st.markdown("### ⚙️ User Actions")
+    
+    with st.expander("🔧 Manage User Status"):
+        # Any account by name, not just the ones on the current table page
+        username = st.text_input("Username", key="manage_user_status",
+                                 placeholder="Enter the username to activate or deactivate").strip()
+        if username:
+            target = user_db.get_user_info(username)
+            if target is None:
+                st.error(f"❌ No user named {username}")
+            else:
+                status = "✅ Active" if target['is_active'] else "❌ Inactive"
+                st.markdown(f"**{target['username']}** · {target['role'].title()} · {status}")
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    if st.button("✅ Activate User", use_container_width=True, disabled=target['is_active']):
+                        success, msg = user_db.activate_user(target['username'])
+                        if success:
+                            st.success(f"✅ {msg}")
+                            st.rerun()
+                        else:
+                            st.error(f"❌ {msg}")
+                
+                with col2:
+                    if st.button("❌ Deactivate User", use_container_width=True,
+                                 disabled=not target['is_active'] or target['username'] == 'admin'):
+                        success, msg = user_db.deactivate_user(target['username'])
+                        if success:
+                            st.warning(f"⚠️ {msg}")
+                            st.rerun()
+                        else:
+                            st.error(f"❌ {msg}")
+    
+    with st.expander("📤 Bulk Import Users"):
+        st.markdown("Upload a CSV with columns `username`, `password` and optionally `full_name`, `email`, `role`.")
+        uploaded = st.file_uploader("Users CSV", type=['csv'], key="bulk_import_file")
+        if uploaded is not None and st.button("📥 Import Users", use_container_width=True):
+            rows = read_users_csv(io.StringIO(uploaded.getvalue().decode('utf-8-sig')))
+            with st.spinner(f"Importing {len(rows):,} users..."):
+                imported, problems = user_db.bulk_import_users(rows)
+            
+            count_users_cached.clear()
+            st.success(f"✅ Imported {imported:,} of {len(rows):,} users")
+            if problems:
+                st.warning(f"⚠️ {len(problems):,} rows were not imported")
+                st.dataframe(pd.DataFrame(problems), use_container_width=True, height=250)
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Query timing and slow-query log for the SQLite database layer
+
+connect() is sqlite3.connect() returning an instrumented connection. Each
+statement run through it is timed from execute() until the next statement
+on the same cursor, or until the cursor or connection is closed, so the
+fetches count too. Timings are aggregated per normalized statement: call
+count, rows returned, total/max time, a log2 histogram of durations and
+the lines of code that issued it.
+
+Statements slower than the threshold (SLOW_QUERY_MS, default 100 ms) are
+logged with their EXPLAIN QUERY PLAN and kept in a short in-memory log;
+slow executemany() bulk writes are only logged at DEBUG.
+get_query_stats() and get_slow_queries() return both as plain dicts, which
+is what /api/query-stats serves. Set QUERY_STATS=0 to turn it all off.
+
+Rows are counted by fetchone/fetchmany/fetchall, not by iterating a cursor.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+ENABLED = os.environ.get('QUERY_STATS', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+
+# Histogram bucket i counts durations up to 2**i microseconds, the last one everything above
+HISTOGRAM_BUCKETS = 25
+# Distinct statements tracked and call sites kept per statement
+MAX_STATEMENTS = 1000
+MAX_CALL_SITES = 10
+SLOW_LOG_SIZE = 100
+
+logger = logging.getLogger('query_stats')
+
+_lock = threading.Lock()
+_stats = {}
+_slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+_fingerprints = {}
+_connections = {'opened': 0, 'open': 0}
+# Called as span_hook(query, started, seconds, rows) for every statement while tracing is on
+span_hook = None
+
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_REPEATED_TUPLES = re.compile(r'(\(\?, \.\.\.\)|\(\?\))(?:\s*,\s*(?:\(\?, \.\.\.\)|\(\?\)))+')
+
+
+def fingerprint(sql):
+    """Statement text with whitespace collapsed and IN/VALUES lists of any length merged"""
+    key = _fingerprints.get(sql)
+    if key is None:
+        key = _PLACEHOLDER_LIST.sub('(?, ...)', ' '.join(sql.split()))
+        key = _REPEATED_TUPLES.sub(r'\1, ...', key)
+        if len(_fingerprints) > 4 * MAX_STATEMENTS:
+            _fingerprints.clear()
+        _fingerprints[sql] = key
+    return key
+
+
+class QueryStats:
+    """Aggregated timings of one normalized statement"""
+
+    __slots__ = ('count', 'total', 'max', 'rows', 'buckets', 'sites')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.sites = {}
+
+    def add(self, seconds, rows, site):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.buckets[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        if site is not None and (site in self.sites or len(self.sites) < MAX_CALL_SITES):
+            self.sites[site] = self.sites.get(site, 0) + 1
+
+    def percentile(self, fraction):
+        """Upper bound in ms of the bucket holding the given fraction of calls"""
+        wanted = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted and count:
+                return min(2 ** i / 1000, self.max * 1000)
+        return self.max * 1000
+
+    def to_dict(self, query):
+        return {
+            'query': query,
+            'count': self.count,
+            'rows': self.rows,
+            'total_ms': round(self.total * 1000, 3),
+            'mean_ms': round(self.total * 1000 / self.count, 3) if self.count else 0,
+            'max_ms': round(self.max * 1000, 3),
+            'p50_ms': round(self.percentile(0.5), 3),
+            'p95_ms': round(self.percentile(0.95), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            # Upper bound in ms -> calls, empty buckets left out
+            'histogram': {(f'{2 ** i / 1000:g}' if i < HISTOGRAM_BUCKETS - 1 else '+Inf'): count
+                          for i, count in enumerate(self.buckets) if count},
+            'call_sites': dict(sorted(self.sites.items(), key=lambda item: -item[1]))
+        }
+
+
+# Every statement together, for the metrics endpoint
+_overall = QueryStats()
+
+
+def _call_site(frame):
+    """'file.py:line function' of the first frame outside this module"""
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _explain(connection, sql, parameters):
+    """EXPLAIN QUERY PLAN detail lines, empty if the statement cannot be explained"""
+    try:
+        rows = sqlite3.Connection.execute(connection, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        return [row[-1] for row in rows]
+    except (sqlite3.Error, ValueError):
+        return []
+
+
+def record(sql, seconds, rows=0, site='unknown', connection=None, parameters=()):
+    """Add one statement's timing, logging it when slower than SLOW_QUERY_MS
+
+    parameters is None for executemany(), which is never reported as a slow query.
+    """
+    query = fingerprint(sql)
+    with _lock:
+        stats = _stats.get(query)
+        if stats is None:
+            if len(_stats) >= MAX_STATEMENTS:
+                query = 'other'
+                stats = _stats.setdefault(query, QueryStats())
+            else:
+                stats = _stats[query] = QueryStats()
+        stats.add(seconds, rows, site)
+        _overall.add(seconds, rows, None)
+
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        if parameters is None:
+            # executemany(): bulk writes are expected to be slow and have nothing to explain,
+            # they stay in the stats but would flood the log during imports
+            logger.debug("Slow bulk statement (%.1f ms, %d rows) at %s: %s", seconds * 1000, rows, site, query)
+            return
+        plan = _explain(connection, sql, parameters) if connection is not None else []
+        _slow_queries.append({
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'query': query,
+            'duration_ms': round(seconds * 1000, 3),
+            'rows': rows,
+            'call_site': site,
+            'plan': plan
+        })
+        logger.warning("Slow query (%.1f ms, %d rows) at %s: %s\n  plan: %s",
+                       seconds * 1000, rows, site, query, '; '.join(plan) or 'n/a')
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times each statement together with the fetches of its rows"""
+
+    _pending = None
+
+    def _begin(self, sql, parameters, started, elapsed):
+        self._pending = [sql, parameters, elapsed, 0, _call_site(sys._getframe(1)), started]
+        self.connection._pending.add(self)
+
+    def _finish(self):
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+        self.connection._pending.discard(self)
+        sql, parameters, elapsed, rows, site, started = pending
+        record(sql, elapsed, rows, site, self.connection, parameters)
+        if span_hook is not None:
+            span_hook(fingerprint(sql), started, elapsed, rows)
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._begin(sql, parameters, started, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            # The parameter sets may have been a generator, nothing to explain with
+            self._begin(sql, None, started, time.perf_counter() - started)
+            self._pending[3] = max(self.rowcount, 0)
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        pending = self._pending
+        if pending is not None:
+            pending[2] += time.perf_counter() - started
+            pending[3] += len(result) if isinstance(result, list) else result is not None
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors, and execute shortcuts, are instrumented"""
+
+    _counted = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = set()
+        with _lock:
+            _connections['opened'] += 1
+            _connections['open'] += 1
+        self._counted = True
+
+    def _uncount(self):
+        if self._counted:
+            self._counted = False
+            with _lock:
+                _connections['open'] -= 1
+
+    def __del__(self):
+        self._uncount()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        for cursor in list(self._pending):
+            cursor._finish()
+        self._uncount()
+        super().close()
+
+
+def connect(database, **kwargs):
+    """sqlite3.connect(), instrumented unless QUERY_STATS=0"""
+    if ENABLED:
+        kwargs.setdefault('factory', InstrumentedConnection)
+    return sqlite3.connect(database, **kwargs)
+
+
+def get_query_stats(limit=None, sort='total_ms'):
+    """Per-statement timings as dicts, by default the most expensive first"""
+    with _lock:
+        rows = [stats.to_dict(query) for query, stats in _stats.items()]
+    rows.sort(key=lambda row: -row.get(sort, 0))
+    return rows[:limit] if limit else rows
+
+
+def get_overall_histogram():
+    """Histogram of every statement: (upper bound in seconds, calls) buckets and the sum"""
+    with _lock:
+        buckets = list(_overall.buckets)
+        total = _overall.total
+    bounds = [2 ** i / 1e6 for i in range(HISTOGRAM_BUCKETS - 1)] + [float('inf')]
+    return {'buckets': list(zip(bounds, buckets)), 'sum': total}
+
+
+def get_connection_stats():
+    """Connections opened since start and currently open (connections are not pooled)"""
+    with _lock:
+        return dict(_connections)
+
+
+def get_slow_queries():
+    """The most recent slow statements with their query plans, newest first"""
+    return list(reversed(_slow_queries))
+
+
+def set_slow_query_threshold(ms):
+    global SLOW_QUERY_MS
+    SLOW_QUERY_MS = float(ms)
+
+
+def reset_query_stats():
+    with _lock:
+        _stats.clear()
+        _slow_queries.clear()
+        _overall.__init__()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Background refresh of the weekly/monthly rollup tables
+
+A daemon thread calls CovidDatabase.refresh_rollups() every `interval`
+seconds. Each run only applies the changes logged since the previous one,
+so an idle database costs a single indexed lookup per run.
+
+With a snapshot_dir, a published Arrow snapshot (see snapshot.py) that
+has fallen behind the data version is rewritten on the same schedule.
+The first run happens on the thread too, so start() returns at once and
+snapshot.py (with NumPy, pandas and pyarrow) is only imported there.
+"""
+
+import threading
+
+
+class RollupScheduler:
+    def __init__(self, covid_db, interval=30, snapshot_dir=None):
+        self.covid_db = covid_db
+        self.interval = interval
+        self.snapshot_dir = snapshot_dir
+        self.last_applied = 0
+        self.runs = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Refresh the rollups now, returns the number of changes applied"""
+        try:
+            self.last_applied = self.covid_db.refresh_rollups()
+            self.runs += 1
+        except Exception as e:
+            print(f"Error refreshing rollups: {e}")
+            return 0
+        if self.snapshot_dir:
+            self.refresh_snapshot()
+        return self.last_applied
+
+    def refresh_snapshot(self):
+        """Rewrite the snapshot if one was published and is now stale"""
+        try:
+            from snapshot import snapshot_version, write_snapshot
+
+            version = snapshot_version(self.covid_db, self.snapshot_dir)
+            if version is not None and version != self.covid_db.get_data_version():
+                write_snapshot(self.covid_db, self.snapshot_dir)
+        except Exception as e:
+            print(f"Error refreshing snapshot: {e}")
+
+    def _run(self):
+        self.run_once()
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        """Start the background thread (no-op if already running)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='rollup-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped Arrow snapshot of covid_cases
+
+write_snapshot() exports every case row to uncompressed Arrow IPC files,
+one per year, plus a small countries file. A snapshot is immutable: it is
+written to its own v<data version> directory and published by atomically
+replacing manifest.json, so readers never see a half-written export.
+
+Read-only analytics open it with load_snapshot(), which memory-maps the
+files instead of converting SQLite rows to dicts. Aggregations run in
+Arrow over the mapped buffers and only the small result becomes a
+DataFrame. A snapshot is used only while its version matches the
+database's data version; otherwise callers fall back to live queries.
+
+    python snapshot.py [db_file]    # write a snapshot of db_file
+
+pyarrow is optional. Without it no snapshot is written and every read
+falls back to the database.
+"""
+
+import json
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import telemetry
+from countries import canonicalize_country, get_iso3
+from storage import CASE_METRICS, SNAPSHOT_DIR, bucket_starts, check_granularity
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+MANIFEST = 'manifest.json'
+# Older snapshots kept for readers that still have them mapped
+KEEP_SNAPSHOTS = 2
+
+_lock = threading.Lock()
+_open_snapshots = {}
+
+
+def _year_of(days):
+    return days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def _write_table(table, path):
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def write_snapshot(covid_db, directory=SNAPSHOT_DIR):
+    """Export all case rows of covid_db, returns the manifest (None without pyarrow)"""
+    if pa is None:
+        print("pyarrow is not installed, skipping the Arrow snapshot")
+        return None
+
+    columns = covid_db.get_case_columns()
+    version = columns['version']
+    country_ids = np.asarray(columns['country_ids'], dtype=np.int32)
+    days = np.asarray(columns['days'], dtype=np.int32)
+    values = np.asarray(columns['values'], dtype=np.int64).reshape(-1, len(CASE_METRICS))
+
+    name = f'v{version}'
+    target = os.path.join(directory, name)
+    staging = f'{target}.tmp{os.getpid()}'
+    os.makedirs(staging, exist_ok=True)
+
+    # Rows stay in (country_id, day) order inside every year partition
+    years = {}
+    row_years = _year_of(days)
+    for year in np.unique(row_years).tolist():
+        rows = row_years == year
+        table = pa.table(dict(
+            {'country_id': country_ids[rows], 'day': days[rows]},
+            **{metric: values[rows, i] for i, metric in enumerate(CASE_METRICS)}
+        ))
+        file_name = f'cases-{year}.arrow'
+        _write_table(table, os.path.join(staging, file_name))
+        years[str(year)] = {'file': file_name, 'rows': table.num_rows}
+
+    names = columns['names']
+    ids = sorted(names)
+    _write_table(pa.table({
+        'id': pa.array(ids, pa.int32()),
+        'name': pa.array([names[cid] for cid in ids], pa.string()),
+        'iso3': pa.array([get_iso3(names[cid]) for cid in ids], pa.string())
+    }), os.path.join(staging, 'countries.arrow'))
+
+    if os.path.exists(target):
+        # Same data version already exported
+        shutil.rmtree(staging)
+    else:
+        os.replace(staging, target)
+
+    manifest = {
+        'source': _source(covid_db),
+        'version': version,
+        'path': name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'rows': int(len(days)),
+        'years': years,
+        'countries': 'countries.arrow'
+    }
+    manifest_tmp = os.path.join(directory, f'{MANIFEST}.tmp{os.getpid()}')
+    with open(manifest_tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_tmp, os.path.join(directory, MANIFEST))
+
+    # Drop all but the newest snapshots
+    old = sorted(
+        (entry for entry in os.listdir(directory)
+         if entry.startswith('v') and entry[1:].isdigit() and entry != name),
+        key=lambda entry: int(entry[1:])
+    )
+    for entry in old[:max(len(old) - KEEP_SNAPSHOTS + 1, 0)]:
+        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    return manifest
+
+
+def _source(covid_db):
+    """Identifies the database a snapshot was taken from"""
+    db_name = getattr(covid_db, 'db_name', None)
+    return os.path.abspath(db_name) if db_name else type(covid_db).__name__
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_version(covid_db, directory=SNAPSHOT_DIR):
+    """Data version of the snapshot published for covid_db, None if there is none"""
+    manifest = _read_manifest(directory)
+    if manifest is None or manifest.get('source') != _source(covid_db):
+        return None
+    return manifest['version']
+
+
+def load_snapshot(covid_db, directory=SNAPSHOT_DIR):
+    """The published snapshot if it matches covid_db's data version, else None"""
+    if pa is None:
+        return None
+    manifest = _read_manifest(directory)
+    if (manifest is None or manifest.get('source') != _source(covid_db)
+            or manifest['version'] != covid_db.get_data_version()):
+        telemetry.count_cache('snapshot', False)
+        return None
+    telemetry.count_cache('snapshot', True)
+
+    with _lock:
+        snapshot = _open_snapshots.get(directory)
+        if snapshot is None or snapshot.version != manifest['version']:
+            try:
+                snapshot = CaseSnapshot(directory, manifest)
+            except OSError:
+                # Pruned between reading the manifest and opening the files
+                return None
+            _open_snapshots[directory] = snapshot
+        return snapshot
+
+
+class CaseSnapshot:
+    """One published snapshot, its year files mapped lazily"""
+
+    def __init__(self, directory, manifest):
+        self.path = os.path.join(directory, manifest['path'])
+        self.version = manifest['version']
+        self.years = sorted(int(year) for year in manifest['years'])
+        self._files = {int(year): entry['file'] for year, entry in manifest['years'].items()}
+        self._tables = {}
+        self.countries = self._map(manifest['countries'])
+        self._ids = dict(zip(self.countries.column('name').to_pylist(),
+                             self.countries.column('id').to_pylist()))
+
+    def _map(self, file_name):
+        """Read an Arrow file zero-copy from a memory map"""
+        source = pa.memory_map(os.path.join(self.path, file_name), 'r')
+        return pa.ipc.open_file(source).read_all()
+
+    def cases(self, years=None):
+        """Case rows of the given years (default all) as one Arrow table"""
+        years = self.years if years is None else [year for year in years if year in self._files]
+        tables = []
+        for year in years:
+            if year not in self._tables:
+                self._tables[year] = self._map(self._files[year])
+            tables.append(self._tables[year])
+        if not tables:
+            return self._empty()
+        return pa.concat_tables(tables)
+
+    def _empty(self):
+        return pa.table(dict(
+            {'country_id': pa.array([], pa.int32()), 'day': pa.array([], pa.int32())},
+            **{metric: pa.array([], pa.int64()) for metric in CASE_METRICS}
+        ))
+
+    def _sums(self, table, keys):
+        result = table.group_by(keys).aggregate([(metric, 'sum') for metric in CASE_METRICS])
+        return result.rename_columns([name.removesuffix('_sum') for name in result.column_names])
+
+    def country_totals(self):
+        """Same rows as get_country_totals(), as a DataFrame"""
+        totals = self._sums(self.cases(), ['country_id'])
+        totals = totals.join(self.countries, 'country_id', 'id')
+        frame = totals.select(['name', 'iso3'] + list(CASE_METRICS)).to_pandas()
+        frame = frame.rename(columns={'name': 'country'})
+        return frame.sort_values('country', ignore_index=True)
+
+    def time_series(self, country=None, granularity='day'):
+        """Same rows as get_time_series(), as a DataFrame (None for an unknown country)"""
+        check_granularity(granularity)
+        table = self.cases()
+        if country is not None:
+            country_id = self._ids.get(canonicalize_country(country))
+            if country_id is None:
+                return None
+            mask = pa.compute.equal(table.column('country_id'), pa.scalar(country_id, pa.int32()))
+            table = table.filter(mask)
+
+        days = table.column('day').to_numpy()
+        table = table.append_column('period', pa.array(bucket_starts(days, granularity)))
+        series = self._sums(table, ['period']).sort_by('period')
+        frame = series.select(list(CASE_METRICS)).to_pandas()
+        dates = series.column('period').to_numpy().astype('datetime64[D]')
+        frame.insert(0, 'date', np.datetime_as_string(dates))
+        return frame
+
+
+def country_totals_frame(covid_db, directory=SNAPSHOT_DIR):
+    """Country totals DataFrame from the snapshot when current, else from covid_db"""
+    snapshot = load_snapshot(covid_db, directory)
+    if snapshot is not None:
+        return snapshot.country_totals()
+    return pd.DataFrame(covid_db.get_country_totals(),
+                        columns=['country', 'iso3'] + list(CASE_METRICS))
+
+
+if __name__ == "__main__":
+    from database import get_covid_database
+
+    covid_db = get_covid_database(sys.argv[1] if len(sys.argv) > 1 else 'data/covid_data.db')
+    manifest = write_snapshot(covid_db)
+    if manifest:
+        print(f"Wrote snapshot v{manifest['version']}: {manifest['rows']} rows "
+              f"in {len(manifest['years'])} year files under {SNAPSHOT_DIR}")
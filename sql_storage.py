@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Client-server SQL storage backend
+
+SqlCovidStorage talks to any DB-API 2.0 driver (psycopg2, pymysql,
+sqlite3, ...) through a connect() factory and sticks to portable SQL:
+CREATE TABLE IF NOT EXISTS, plain GROUP BY and UPDATE-then-INSERT upserts.
+Week and month bucket starts are stored as columns on insert, so every
+granularity is an ordinary indexed GROUP BY on the server.
+
+Select it with COVID_DB_BACKEND=sql, COVID_DB_DRIVER (module name, default
+sqlite3) and COVID_DB_DSN (passed to the driver's connect()). sqlite3 with
+a file path works as a local stand-in for a database server.
+"""
+
+import importlib
+
+from countries import COUNTRIES, canonicalize_country
+from storage import (CovidStorage, CASE_METRICS, CHANGE_PAGE_ROWS, COUNTRY_PAGE_ROWS, EXPORT_PAGE_ROWS, change_row,
+                     check_country_query, check_granularity, country_page, period_start, to_day_number,
+                     from_day_number)
+
+# Placeholder used by each DB-API paramstyle (named styles are not supported)
+PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}
+
+_SUMS = ', '.join(f'SUM({metric})' for metric in CASE_METRICS)
+
+
+class SqlCovidStorage(CovidStorage):
+    def __init__(self, connect, paramstyle='qmark'):
+        if paramstyle not in PLACEHOLDERS:
+            raise ValueError(f"Unsupported paramstyle: {paramstyle}")
+        self.connect = connect
+        self.placeholder = PLACEHOLDERS[paramstyle]
+        self.create_tables()
+
+    @classmethod
+    def from_dsn(cls, driver='sqlite3', dsn=''):
+        """Build a backend from a DB-API module name and its connect() argument"""
+        module = importlib.import_module(driver)
+        return cls(lambda: module.connect(dsn), module.paramstyle)
+
+    def _execute(self, cursor, query, params=()):
+        cursor.execute(query.replace('?', self.placeholder), params)
+        return cursor
+
+    def create_tables(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        self._execute(cursor, '''
+            CREATE TABLE IF NOT EXISTS countries (
+                id INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL UNIQUE,
+                iso3 CHAR(3)
+            )
+        ''')
+        self._execute(cursor, '''
+            CREATE TABLE IF NOT EXISTS covid_cases (
+                country_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                week INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                confirmed BIGINT NOT NULL,
+                deaths BIGINT NOT NULL,
+                recovered BIGINT NOT NULL,
+                active BIGINT NOT NULL,
+                PRIMARY KEY (country_id, day)
+            )
+        ''')
+        self._execute(cursor, '''
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY,
+                version BIGINT NOT NULL
+            )
+        ''')
+        # Data version of the latest write to each case row, for get_changes()
+        self._execute(cursor, '''
+            CREATE TABLE IF NOT EXISTS case_versions (
+                country_id INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                seq BIGINT NOT NULL UNIQUE,
+                PRIMARY KEY (country_id, day)
+            )
+        ''')
+
+        self._execute(cursor, 'SELECT COUNT(*) FROM data_version')
+        if cursor.fetchone()[0] == 0:
+            self._execute(cursor, 'INSERT INTO data_version (id, version) VALUES (1, 0)')
+            for country_id, (name, _, iso3, _) in enumerate(COUNTRIES, start=1):
+                self._execute(cursor, 'INSERT INTO countries (id, name, iso3) VALUES (?, ?, ?)',
+                              (country_id, name, iso3))
+
+        conn.commit()
+        conn.close()
+
+    def _get_country_ids(self, cursor, names):
+        """Map country names to ids by canonical name, adding any country not seen before"""
+        canonical = {name: canonicalize_country(name) for name in set(names)}
+        ids = {}
+        for name in set(canonical.values()):
+            self._execute(cursor, 'SELECT id FROM countries WHERE name = ?', (name,))
+            result = cursor.fetchone()
+            if result is None:
+                # Writers are serialized on data_version, so MAX(id) + 1 is free
+                self._execute(cursor, 'SELECT COALESCE(MAX(id), 0) + 1 FROM countries')
+                result = cursor.fetchone()
+                self._execute(cursor, 'INSERT INTO countries (id, name) VALUES (?, ?)',
+                              (result[0], name))
+            ids[name] = result[0]
+        return {name: ids[canonical[name]] for name in canonical}
+
+    def insert_cases(self, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            # Bump the version first: the row lock orders concurrent writers
+            self._execute(cursor, 'UPDATE data_version SET version = version + ? WHERE id = 1',
+                          (len(rows),))
+            self._execute(cursor, 'SELECT version FROM data_version WHERE id = 1')
+            seq = cursor.fetchone()[0] - len(rows)
+            country_ids = self._get_country_ids(cursor, [row[0] for row in rows])
+
+            # Combine rows for the same country and day before touching the server
+            merged = {}
+            for country, day, *counts in rows:
+                key = (country_ids[country], to_day_number(day))
+                total = merged.setdefault(key, [0] * len(CASE_METRICS))
+                for i, count in enumerate(counts):
+                    total[i] += count
+
+            for (country_id, day), counts in merged.items():
+                self._execute(cursor, '''
+                    UPDATE covid_cases
+                    SET confirmed = confirmed + ?, deaths = deaths + ?,
+                        recovered = recovered + ?, active = active + ?
+                    WHERE country_id = ? AND day = ?
+                ''', (*counts, country_id, day))
+                if cursor.rowcount == 0:
+                    self._execute(cursor, '''
+                        INSERT INTO covid_cases
+                            (country_id, day, week, month, confirmed, deaths, recovered, active)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (country_id, day, period_start(day, 'week'),
+                          period_start(day, 'month'), *counts))
+                # Every row written gets its own seq within the versions this write took
+                seq += 1
+                self._execute(cursor, 'UPDATE case_versions SET seq = ? WHERE country_id = ? AND day = ?',
+                              (seq, country_id, day))
+                if cursor.rowcount == 0:
+                    self._execute(cursor, 'INSERT INTO case_versions (country_id, day, seq) VALUES (?, ?, ?)',
+                                  (country_id, day, seq))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return len(rows)
+
+    def _query(self, query, params=()):
+        conn = self.connect()
+        cursor = conn.cursor()
+        self._execute(cursor, query, params)
+        results = cursor.fetchall()
+        conn.close()
+        return results
+
+    def get_data_version(self):
+        return self._query('SELECT version FROM data_version WHERE id = 1')[0][0]
+
+    def get_changes(self, since=None, limit=CHANGE_PAGE_ROWS):
+        version = self.get_data_version()
+        if since is None or since > version:
+            return {'version': version, 'reset': True, 'changes': []}
+        # Capped at the version read, so a write committing in between waits for the next call
+        results = self._query('''
+            SELECT v.seq, c.name, v.day, t.confirmed, t.deaths, t.recovered, t.active
+            FROM case_versions v
+            JOIN countries c ON c.id = v.country_id
+            JOIN covid_cases t ON t.country_id = v.country_id AND t.day = v.day
+            WHERE v.seq > ? AND v.seq <= ?
+            ORDER BY v.seq
+            LIMIT ?
+        ''', (since, version, limit))
+        return {
+            'version': version,
+            'reset': False,
+            'changes': [change_row(seq, country, day, counts) for seq, country, day, *counts in results]
+        }
+
+    def _totals_rows(self, results):
+        return [
+            dict({'country': row[0]}, **{metric: int(row[i + 1]) for i, metric in enumerate(CASE_METRICS)})
+            for row in results
+        ]
+
+    def _series(self, results):
+        return [
+            dict({'date': from_day_number(row[0])},
+                 **{metric: int(row[i + 1]) for i, metric in enumerate(CASE_METRICS)})
+            for row in results
+        ]
+
+    def get_global_summary(self, granularity='day'):
+        check_granularity(granularity)
+        result = self._query(f'SELECT {_SUMS} FROM covid_cases')[0]
+        return {f'total_{metric}': int(result[i] or 0) for i, metric in enumerate(CASE_METRICS)}
+
+    def get_top_countries(self, metric='confirmed', limit=10, granularity='day'):
+        check_granularity(granularity)
+        if metric not in CASE_METRICS:
+            metric = 'confirmed'
+        return self._totals_rows(self._query(f'''
+            SELECT c.name, {_SUMS}
+            FROM covid_cases t
+            JOIN countries c ON c.id = t.country_id
+            GROUP BY c.id, c.name
+            ORDER BY SUM(t.{metric}) DESC
+            LIMIT ?
+        ''', (int(limit),)))
+
+    def get_all_countries(self):
+        return [row[0] for row in self._query('''
+            SELECT name FROM countries c
+            WHERE EXISTS (SELECT 1 FROM covid_cases WHERE country_id = c.id)
+            ORDER BY name
+        ''')]
+
+    def get_country_totals(self):
+        results = self._query(f'''
+            SELECT c.name, c.iso3, {_SUMS}
+            FROM covid_cases t
+            JOIN countries c ON c.id = t.country_id
+            GROUP BY c.id, c.name, c.iso3
+            ORDER BY c.name
+        ''')
+        return [
+            dict({'country': row[0], 'iso3': row[1]},
+                 **{metric: int(row[i + 2]) for i, metric in enumerate(CASE_METRICS)})
+            for row in results
+        ]
+
+    def query_country_totals(self, search=None, sort='confirmed', descending=True, page=1,
+                             page_size=COUNTRY_PAGE_ROWS):
+        check_country_query(sort, page, page_size)
+        prefix = (search or '').strip()
+        name_filter, params = '', []
+        if prefix:
+            # LOWER() on both sides folds case the same way whatever the server's collation
+            name_filter = "AND LOWER(c.name) LIKE LOWER(?) ESCAPE '!'"
+            params = [prefix.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%']
+        total = self._query(f'''
+            SELECT COUNT(*)
+            FROM countries c
+            WHERE EXISTS (SELECT 1 FROM covid_cases t WHERE t.country_id = c.id) {name_filter}
+        ''', params)[0][0]
+        order = 'c.name' if sort == 'country' else sort
+        direction = 'DESC' if descending else 'ASC'
+        results = self._query(f'''
+            SELECT c.name, c.iso3, {', '.join(f'SUM(t.{metric}) AS {metric}' for metric in CASE_METRICS)}
+            FROM covid_cases t
+            JOIN countries c ON c.id = t.country_id
+            WHERE 1 = 1 {name_filter}
+            GROUP BY c.id, c.name, c.iso3
+            ORDER BY {order} {direction}, c.name
+            LIMIT ? OFFSET ?
+        ''', params + [page_size, (page - 1) * page_size])
+        return country_page([
+            dict({'country': row[0], 'iso3': row[1]},
+                 **{metric: int(row[i + 2]) for i, metric in enumerate(CASE_METRICS)})
+            for row in results
+        ], total, page, page_size)
+
+    def compare_countries(self, countries):
+        countries = [canonicalize_country(country) for country in countries]
+        if not countries:
+            return []
+        placeholders = ','.join(['?' for _ in countries])
+        return self._totals_rows(self._query(f'''
+            SELECT c.name, {_SUMS}
+            FROM covid_cases t
+            JOIN countries c ON c.id = t.country_id
+            WHERE c.name IN ({placeholders})
+            GROUP BY c.id, c.name
+            ORDER BY c.id
+        ''', countries))
+
+    def get_country_data(self, country, granularity='day'):
+        check_granularity(granularity)
+        result = self._query('SELECT id FROM countries WHERE name = ?', (canonicalize_country(country),))
+        if not result:
+            return None
+        return self._series(self._query(f'''
+            SELECT {granularity}, {_SUMS}
+            FROM covid_cases
+            WHERE country_id = ?
+            GROUP BY {granularity}
+            ORDER BY {granularity}
+        ''', (result[0][0],)))
+
+    def get_time_series(self, country=None, granularity='day'):
+        if country is not None:
+            return self.get_country_data(country, granularity)
+        check_granularity(granularity)
+        return self._series(self._query(f'''
+            SELECT {granularity}, {_SUMS}
+            FROM covid_cases
+            GROUP BY {granularity}
+            ORDER BY {granularity}
+        '''))
+
+    def get_country_columns(self, countries, start=None, end=None):
+        import numpy as np
+
+        names = sorted({canonicalize_country(country) for country in countries})
+        conn = self.connect()
+        cursor = conn.cursor()
+        ids = {}
+        if names:
+            ids = dict(self._execute(cursor, f"SELECT id, name FROM countries WHERE name IN ({','.join('?' * len(names))})",
+                                     names).fetchall())
+        conditions = [f"country_id IN ({','.join('?' * len(ids))})"] if ids else ['1 = 0']
+        params = list(ids)
+        if start is not None:
+            conditions.append('day >= ?')
+            params.append(to_day_number(start))
+        if end is not None:
+            conditions.append('day <= ?')
+            params.append(to_day_number(end))
+        rows = self._execute(cursor, f'''
+            SELECT country_id, day, confirmed, deaths, recovered, active
+            FROM covid_cases
+            WHERE {' AND '.join(conditions)}
+            ORDER BY country_id, day
+        ''', params).fetchall()
+        conn.close()
+        rows = np.array(rows, dtype=np.int64).reshape(-1, 6)
+        return {
+            'country_ids': rows[:, 0],
+            'days': rows[:, 1],
+            'values': rows[:, 2:],
+            'names': {int(cid): ids[cid] for cid in np.unique(rows[:, 0])}
+        }
+
+    def get_case_page(self, country=None, start=None, end=None, after=None, limit=EXPORT_PAGE_ROWS):
+        conditions, params = [], []
+        if country is not None:
+            result = self._query('SELECT id FROM countries WHERE name = ?', (canonicalize_country(country),))
+            if not result:
+                return []
+            conditions.append('t.country_id = ?')
+            params.append(result[0][0])
+        if after is not None:
+            # Row value comparisons are not portable, spell the keyset condition out
+            conditions.append('(t.country_id > ? OR (t.country_id = ? AND t.day > ?))')
+            params += [after[0], after[0], after[1]]
+        if start is not None:
+            conditions.append('t.day >= ?')
+            params.append(to_day_number(start))
+        if end is not None:
+            conditions.append('t.day <= ?')
+            params.append(to_day_number(end))
+        where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return [tuple(row[:3]) + tuple(int(value) for value in row[3:]) for row in self._query(f'''
+            SELECT t.country_id, c.name, t.day, t.confirmed, t.deaths, t.recovered, t.active
+            FROM covid_cases t
+            JOIN countries c ON c.id = t.country_id
+            {where}
+            ORDER BY t.country_id, t.day
+            LIMIT ?
+        ''', params + [limit])]
+
+    def get_case_columns(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+        version = self._execute(cursor, 'SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+        rows = self._execute(cursor, '''
+            SELECT country_id, day, confirmed, deaths, recovered, active
+            FROM covid_cases
+            ORDER BY country_id, day
+        ''').fetchall()
+        names = dict(self._execute(cursor, 'SELECT id, name FROM countries').fetchall())
+        conn.close()
+        return {
+            'version': version,
+            'country_ids': [row[0] for row in rows],
+            'days': [row[1] for row in rows],
+            'values': [row[2:] for row in rows],
+            'names': names
+        }
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backend interface for COVID case data
+
+CovidStorage is the contract every case-data backend implements: writes,
+per-country aggregates and day/week/month time series. The pages and the
+API only use these methods, so a deployment can pick whichever backend is
+fastest for it (see database.get_covid_database):
+
+    sqlite    CovidDatabase, a single SQLite file (default)
+    mirror    MirroredCovidDatabase, reads from an in-memory SQLite copy
+    columnar  ColumnarCovidDatabase, NumPy arrays synced from SQLite
+    memory    MemoryCovidStorage, plain dicts, for tests and demos
+    sql       SqlCovidStorage, any DB-API 2.0 client-server database
+
+storage_conformance.py checks that all of them return the same results.
+"""
+
+from abc import ABC, abstractmethod
+import os
+import string
+from datetime import date, datetime, timedelta
+
+import telemetry
+from countries import canonicalize_country
+
+# Case count columns, also the metrics accepted by get_top_countries
+CASE_METRICS = ('confirmed', 'deaths', 'recovered', 'active')
+GRANULARITIES = ('day', 'week', 'month')
+
+EPOCH = date(1970, 1, 1)
+
+# Rows per page read by iter_case_pages(), what an export holds in memory at once
+EXPORT_PAGE_ROWS = 10000
+
+# Changed rows per get_changes() call unless a limit is given
+CHANGE_PAGE_ROWS = 1000
+
+# Columns query_country_totals() sorts by, and its rows per page unless a page size is given
+COUNTRY_SORTS = ('country',) + CASE_METRICS
+COUNTRY_PAGE_ROWS = 50
+
+# Country search folds ASCII letters only, like SQLite's NOCASE collation
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Where snapshot.py publishes the Arrow snapshot, here so it is known without importing pyarrow
+SNAPSHOT_DIR = os.path.join('data', 'snapshot')
+
+
+def to_day_number(value):
+    """Convert a date, datetime or ISO date string to days since 1970-01-01"""
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        value = date.fromisoformat(str(value).strip()[:10])
+    return (value - EPOCH).days
+
+
+def from_day_number(day):
+    """Convert days since 1970-01-01 back to an ISO date string"""
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+
+def check_granularity(granularity):
+    """Raise ValueError for anything but day, week or month"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+
+def period_start(day, granularity):
+    """Day number of the first day of the week (Monday) or month holding `day`"""
+    if granularity == 'week':
+        return day - (day + 3) % 7
+    if granularity == 'month':
+        return to_day_number(from_day_number(day)[:8] + '01')
+    return day
+
+
+def bucket_starts(days, granularity):
+    """period_start() over a NumPy array of day numbers"""
+    import numpy as np
+
+    if granularity == 'week':
+        return days - (days + 3) % 7
+    if granularity == 'month':
+        months = np.asarray(days).astype('datetime64[D]').astype('datetime64[M]')
+        return months.astype('datetime64[D]').astype(np.int64).astype(days.dtype)
+    return days
+
+
+def check_country_query(sort, page, page_size):
+    """Raise ValueError for an unknown sort column or a page or page size below 1"""
+    if sort not in COUNTRY_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(COUNTRY_SORTS)}")
+    if page < 1 or page_size < 1:
+        raise ValueError("page and page_size must be at least 1")
+
+
+def page_country_totals(rows, search=None, sort='confirmed', descending=True, page=1,
+                        page_size=COUNTRY_PAGE_ROWS):
+    """query_country_totals() over country total dicts already in memory"""
+    check_country_query(sort, page, page_size)
+    prefix = (search or '').strip().translate(_ASCII_LOWER)
+    if prefix:
+        rows = [row for row in rows if row['country'].translate(_ASCII_LOWER).startswith(prefix)]
+    # Ties keep name order in either direction
+    rows = sorted(rows, key=lambda row: row['country'])
+    if sort != 'country' or descending:
+        rows.sort(key=lambda row: row[sort], reverse=descending)
+    offset = (page - 1) * page_size
+    return country_page(rows[offset:offset + page_size], len(rows), page, page_size)
+
+
+def country_page(rows, total, page, page_size):
+    """One query_country_totals() result"""
+    return {
+        'countries': rows,
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'pages': -(-total // page_size)
+    }
+
+
+def change_row(seq, country, day, counts):
+    """One get_changes() entry, counts None for a deleted row"""
+    row = {'seq': seq, 'country': country, 'date': from_day_number(day)}
+    for i, metric in enumerate(CASE_METRICS):
+        row[metric] = int(counts[i]) if counts is not None else None
+    row['deleted'] = counts is None
+    return row
+
+
+class CovidStorage(ABC):
+    """Reads, writes, aggregates and time series over covid case data
+
+    Country arguments accept any spelling canonicalize_country() knows.
+    Totals are dicts keyed by 'country' plus CASE_METRICS, series rows by
+    'date' (ISO string, the first day of the bucket) plus CASE_METRICS.
+    """
+
+    _metrics_cache = None
+
+    # ----- Writes -----
+
+    @abstractmethod
+    def insert_cases(self, rows):
+        """Insert (country, date, confirmed, deaths, recovered, active) rows
+
+        Counts for a country and day that already has a row are added to it.
+        Returns the number of rows written.
+        """
+
+    def add_new_case(self, case_data):
+        try:
+            self.insert_cases([(
+                case_data['country'],
+                case_data['date'],
+                case_data['confirmed'],
+                case_data['deaths'],
+                case_data['recovered'],
+                case_data['active']
+            )])
+            return True
+        except Exception as e:
+            print(f"Error adding case: {e}")
+            return False
+
+    @abstractmethod
+    def get_data_version(self):
+        """Number that grows with every write, for cache invalidation"""
+
+    def refresh_rollups(self):
+        """Bring precomputed aggregates up to date, returns the changes applied
+
+        Backends that aggregate on read have nothing to refresh.
+        """
+        return 0
+
+    # ----- Aggregates -----
+
+    @abstractmethod
+    def get_global_summary(self, granularity='day'):
+        """Totals over every country as total_<metric> keys"""
+
+    @abstractmethod
+    def get_top_countries(self, metric='confirmed', limit=10, granularity='day'):
+        """Country totals of the `limit` countries with the highest metric"""
+
+    @abstractmethod
+    def get_all_countries(self):
+        """Sorted names of the countries that have case data"""
+
+    @abstractmethod
+    def get_country_totals(self):
+        """Totals and ISO3 code of every country with data, sorted by name"""
+
+    @abstractmethod
+    def compare_countries(self, countries):
+        """Totals of the given countries, unknown ones are left out"""
+
+    # ----- Time series -----
+
+    @abstractmethod
+    def get_country_data(self, country, granularity='day'):
+        """Series of one country, None if the country is unknown"""
+
+    @abstractmethod
+    def get_time_series(self, country=None, granularity='day'):
+        """Global series, or one country's"""
+
+    @abstractmethod
+    def get_case_columns(self):
+        """Every case row as columns, sorted by (country_id, day)
+
+        Returns a dict with the data 'version' the rows belong to,
+        'country_ids' and 'days' (int arrays), 'values' (one column per
+        CASE_METRICS entry) and 'names' mapping country ids to names.
+        """
+
+    def get_country_columns(self, countries, start=None, end=None):
+        """Case rows of the given countries as NumPy columns, sorted by (country_id, day)
+
+        Same layout as get_case_columns() without the version; 'names' only
+        holds the countries with rows between the inclusive start and end
+        dates. This default filters get_case_columns(); backends override
+        it with a primary key lookup per country.
+        """
+        import numpy as np
+
+        columns = self.get_case_columns()
+        wanted = {canonicalize_country(country) for country in countries}
+        country_ids = np.asarray(columns['country_ids'], dtype=np.int64)
+        days = np.asarray(columns['days'], dtype=np.int64)
+        keep = np.isin(country_ids, [cid for cid, name in columns['names'].items() if name in wanted])
+        if start is not None:
+            keep &= days >= to_day_number(start)
+        if end is not None:
+            keep &= days <= to_day_number(end)
+        values = np.asarray(columns['values'], dtype=np.int64).reshape(-1, len(CASE_METRICS))
+        return {
+            'country_ids': country_ids[keep],
+            'days': days[keep],
+            'values': values[keep],
+            'names': {int(cid): columns['names'][cid] for cid in np.unique(country_ids[keep])}
+        }
+
+    def query_country_totals(self, search=None, sort='confirmed', descending=True, page=1,
+                             page_size=COUNTRY_PAGE_ROWS):
+        """One page of get_country_totals() rows whose name starts with `search`
+
+        The prefix match ignores ASCII case, rows are ordered by the `sort`
+        column (one of COUNTRY_SORTS) and then by name. Returns a dict with
+        the page's 'countries', the 'total' number of matches, 'page',
+        'page_size' and 'pages'. Raises ValueError for an unknown sort or a
+        page or page size below 1. This default pages get_country_totals();
+        backends override it with a query.
+        """
+        return page_country_totals(self.get_country_totals(), search, sort, descending, page, page_size)
+
+    def get_case_page(self, country=None, start=None, end=None, after=None, limit=EXPORT_PAGE_ROWS):
+        """Up to `limit` case rows with a (country_id, day) key above `after`, in key order
+
+        Rows are (country_id, country, day, confirmed, deaths, recovered,
+        active) tuples with day as a day number. start and end are
+        inclusive dates, an unknown country gives no rows. This default
+        reads every row; backends override it with a keyset query.
+        """
+        from bisect import bisect_right
+
+        columns = self.get_case_columns()
+        country_ids, days, names = list(columns['country_ids']), list(columns['days']), columns['names']
+        values = [list(row) for row in columns['values']]
+        wanted = None
+        if country is not None:
+            country = canonicalize_country(country)
+            wanted = next((cid for cid, name in names.items() if name == country), None)
+            if wanted is None:
+                return []
+        first = to_day_number(start) if start is not None else None
+        last = to_day_number(end) if end is not None else None
+
+        rows = []
+        index = bisect_right(list(zip(country_ids, days)), tuple(after)) if after is not None else 0
+        for i in range(index, len(days)):
+            if len(rows) == limit:
+                break
+            if (wanted is None or country_ids[i] == wanted) and (first is None or days[i] >= first) \
+                    and (last is None or days[i] <= last):
+                rows.append((country_ids[i], names[country_ids[i]], days[i], *values[i]))
+        return rows
+
+    def iter_case_pages(self, country=None, start=None, end=None, page_rows=EXPORT_PAGE_ROWS):
+        """Yield get_case_page() pages until the rows run out, one page in memory at a time"""
+        after = None
+        while True:
+            page = self.get_case_page(country, start, end, after, page_rows)
+            if page:
+                yield page
+            if len(page) < page_rows:
+                return
+            after = (page[-1][0], page[-1][2])
+
+    # ----- Change feed -----
+
+    @abstractmethod
+    def get_changes(self, since=None, limit=CHANGE_PAGE_ROWS):
+        """Rows written after data version `since`, the oldest change first
+
+        Returns a dict with the data 'version' the changes were read at,
+        'reset' (True when `since` is None or no longer covered by the
+        change log, e.g. after a full reload or once the log was pruned, and
+        the client has to start over from a full export) and up to `limit`
+        'changes'. Each change is the current row of a (country, date)
+        written since then: 'seq' (its latest change, unique and
+        increasing), 'country', 'date', CASE_METRICS and 'deleted' (the row
+        is gone, metrics are None).
+        """
+
+    def _load_derived_metrics(self):
+        """Derived metrics for all countries, recomputed only when the data version changes"""
+        import numpy as np
+        from case_metrics import compute_derived_metrics
+
+        if self._metrics_cache is not None and self._metrics_cache['version'] == self.get_data_version():
+            telemetry.count_cache('derived_metrics', True)
+            return self._metrics_cache
+        telemetry.count_cache('derived_metrics', False)
+
+        columns = self.get_case_columns()
+        country_ids = np.asarray(columns['country_ids'], dtype=np.int64)
+        days = np.asarray(columns['days'], dtype=np.int64)
+        values = np.asarray(columns['values'], dtype=np.int64).reshape(-1, len(CASE_METRICS))
+        values = {column: values[:, i] for i, column in enumerate(CASE_METRICS)}
+        self._metrics_cache = {
+            'version': columns['version'],
+            'country_ids': country_ids,
+            'days': days,
+            'values': values,
+            'metrics': compute_derived_metrics(country_ids, days, values),
+            'names': columns['names']
+        }
+        return self._metrics_cache
+
+    def get_derived_metrics(self, country=None, start_date=None, end_date=None):
+        """Get daily new values, 7/14-day averages, growth rate and doubling time
+
+        With a country, returns its series (optionally limited to a date range)
+        or None if the country is unknown. Without one, returns the latest
+        row of every country.
+        """
+        import numpy as np
+
+        cache = self._load_derived_metrics()
+        country_ids = cache['country_ids']
+        days = cache['days']
+
+        if country is None:
+            # Last row of each contiguous country run
+            index = np.flatnonzero(np.append(country_ids[1:] != country_ids[:-1], True))
+            index = index[:len(days)]
+        else:
+            country = canonicalize_country(country)
+            ids = [cid for cid, name in cache['names'].items() if name == country]
+            if not ids:
+                return None
+            lo = np.searchsorted(country_ids, ids[0], side='left')
+            hi = np.searchsorted(country_ids, ids[0], side='right')
+            if start_date is not None:
+                lo += np.searchsorted(days[lo:hi], to_day_number(start_date), side='left')
+            if end_date is not None:
+                hi = lo + np.searchsorted(days[lo:hi], to_day_number(end_date), side='right')
+            index = np.arange(lo, hi)
+
+        columns = {column: values[index].tolist() for column, values in cache['values'].items()}
+        columns.update({
+            name: np.where(np.isnan(values[index]), None, np.round(values[index], 4)).tolist()
+            for name, values in cache['metrics'].items()
+        })
+        ids = country_ids[index].tolist()
+
+        return [
+            dict(
+                {
+                    'country': cache['names'].get(ids[i]),
+                    'date': from_day_number(day)
+                },
+                **{name: column[i] for name, column in columns.items()}
+            )
+            for i, day in enumerate(days[index].tolist())
+        ]
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Conformance checks for CovidStorage backends
+
+Loads the same fixture into a fresh instance of every backend and checks
+each read against the expected values and against the SQLite reference
+backend. Also reports how long every backend took, to help pick the
+fastest one for a deployment.
+
+    python storage_conformance.py                # all backends
+    python storage_conformance.py memory sql     # selected backends
+
+The sql backend uses COVID_DB_DRIVER / COVID_DB_DSN when set, otherwise a
+temporary sqlite3 file stands in for the server. Exits with status 1 if
+any backend fails a check.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from database import get_covid_database
+
+BACKENDS = ('sqlite', 'mirror', 'columnar', 'memory', 'sql')
+
+# (country, date, confirmed, deaths, recovered, active)
+FIXTURE = [
+    ('United States', '2020-03-01', 10, 1, 0, 9),
+    ('USA', '2020-03-01', 5, 0, 0, 5),
+    ('United States', '2020-03-02', 30, 2, 1, 27),
+    ('United States', '2020-03-09', 80, 4, 10, 66),
+    ('Canada', '2020-02-29', 3, 0, 0, 3),
+    ('Canada', '2020-03-01', 7, 0, 1, 6),
+    ('Atlantis', '2020-03-05', 2, 0, 0, 2),
+]
+
+
+def _totals(country, confirmed, deaths, recovered, active, **extra):
+    return dict({'country': country}, confirmed=confirmed, deaths=deaths,
+                recovered=recovered, active=active, **extra)
+
+
+def _point(date, confirmed, deaths, recovered, active):
+    return {'date': date, 'confirmed': confirmed, 'deaths': deaths,
+            'recovered': recovered, 'active': active}
+
+
+# (name, read, expected) - expected None means "same as the reference backend"
+CHECKS = [
+    ('global summary', lambda s: s.get_global_summary(),
+     {'total_confirmed': 137, 'total_deaths': 7, 'total_recovered': 12, 'total_active': 118}),
+    ('global summary by week', lambda s: s.get_global_summary('week'),
+     {'total_confirmed': 137, 'total_deaths': 7, 'total_recovered': 12, 'total_active': 118}),
+    ('all countries', lambda s: s.get_all_countries(),
+     ['Atlantis', 'Canada', 'United States']),
+    ('top countries', lambda s: s.get_top_countries('confirmed', 2),
+     [_totals('United States', 125, 7, 11, 107), _totals('Canada', 10, 0, 1, 9)]),
+    ('top countries by deaths', lambda s: s.get_top_countries('deaths', 1, 'month'),
+     [_totals('United States', 125, 7, 11, 107)]),
+    ('unknown metric falls back to confirmed', lambda s: s.get_top_countries('bogus', 1),
+     [_totals('United States', 125, 7, 11, 107)]),
+    ('country totals', lambda s: s.get_country_totals(),
+     [{'country': 'Atlantis', 'iso3': None, 'confirmed': 2, 'deaths': 0, 'recovered': 0, 'active': 2},
+      {'country': 'Canada', 'iso3': 'CAN', 'confirmed': 10, 'deaths': 0, 'recovered': 1, 'active': 9},
+      {'country': 'United States', 'iso3': 'USA', 'confirmed': 125, 'deaths': 7, 'recovered': 11,
+       'active': 107}]),
+    ('compare countries', lambda s: sorted(s.compare_countries(['usa', 'Canada', 'Nowhere']),
+                                           key=lambda row: row['country']),
+     [_totals('Canada', 10, 0, 1, 9), _totals('United States', 125, 7, 11, 107)]),
+    ('country by day', lambda s: s.get_country_data('United States'),
+     [_point('2020-03-01', 15, 1, 0, 14), _point('2020-03-02', 30, 2, 1, 27),
+      _point('2020-03-09', 80, 4, 10, 66)]),
+    ('country by week', lambda s: s.get_country_data('US', 'week'),
+     [_point('2020-02-24', 15, 1, 0, 14), _point('2020-03-02', 30, 2, 1, 27),
+      _point('2020-03-09', 80, 4, 10, 66)]),
+    ('country by month', lambda s: s.get_country_data('Canada', 'month'),
+     [_point('2020-02-01', 3, 0, 0, 3), _point('2020-03-01', 7, 0, 1, 6)]),
+    ('unknown country', lambda s: s.get_country_data('Nowhere'), None),
+    ('global series by day', lambda s: s.get_time_series(), None),
+    ('global series by week', lambda s: s.get_time_series(granularity='week'),
+     [_point('2020-02-24', 25, 1, 1, 23), _point('2020-03-02', 32, 2, 1, 29),
+      _point('2020-03-09', 80, 4, 10, 66)]),
+    ('global series by month', lambda s: s.get_time_series(granularity='month'),
+     [_point('2020-02-01', 3, 0, 0, 3), _point('2020-03-01', 134, 7, 12, 115)]),
+    ('country series', lambda s: s.get_time_series('Canada'), None),
+    ('derived metrics', lambda s: [(row['date'], row['new_confirmed'], row['confirmed_avg7'])
+                                   for row in s.get_derived_metrics('United States')],
+     [('2020-03-01', None, None), ('2020-03-02', 15.0, None), ('2020-03-09', 7.1429, 7.1429)]),
+    ('latest derived metrics', lambda s: s.get_derived_metrics(), None),
+    ('case pages', lambda s: [[row[1:] for row in page] for page in s.iter_case_pages(page_rows=2)], None),
+    ('case pages of a country and date range',
+     lambda s: [row[1:] for page in s.iter_case_pages('US', '2020-03-02', '2020-03-31', 1) for row in page],
+     [('United States', 18323, 30, 2, 1, 27), ('United States', 18330, 80, 4, 10, 66)]),
+    ('case pages of an unknown country', lambda s: list(s.iter_case_pages('Nowhere')), []),
+    ('country totals page', lambda s: s.query_country_totals(page_size=2), None),
+    ('country totals by name, second page',
+     lambda s: {key: value if key != 'countries' else [row['country'] for row in value]
+                for key, value in s.query_country_totals(sort='country', page=2, page_size=2).items()},
+     {'countries': ['Atlantis'], 'total': 3, 'page': 2, 'page_size': 2, 'pages': 2}),
+    ('country name prefix search',
+     lambda s: [row['country'] for row in s.query_country_totals(' uNiTeD ')['countries']], ['United States']),
+    ('bad country sort raises ValueError', lambda s: _raises(ValueError, s.query_country_totals, None, 'iso3'), True),
+    ('country columns', lambda s: _country_columns(s.get_country_columns(['US', 'Atlantis', 'Nowhere'],
+                                                                         '2020-03-02')),
+     [('Atlantis', 18326, [2, 0, 0, 2]), ('United States', 18323, [30, 2, 1, 27]),
+      ('United States', 18330, [80, 4, 10, 66])]),
+    ('bad granularity raises ValueError', lambda s: _raises(ValueError, s.get_time_series,
+                                                            None, 'year'), True),
+]
+
+
+def _country_columns(columns):
+    """get_country_columns() as (country, day, counts) rows, country ids differ between backends"""
+    return sorted((columns['names'][int(cid)], int(day), [int(value) for value in values])
+                  for cid, day, values in zip(columns['country_ids'], columns['days'], columns['values']))
+
+
+def _raises(exception, function, *args):
+    try:
+        function(*args)
+    except exception:
+        return True
+    return False
+
+
+def _create(backend, directory):
+    os.makedirs(directory, exist_ok=True)
+    return get_covid_database(os.path.join(directory, 'covid_data.db'), backend)
+
+
+def _write(storage):
+    """Load the fixture, returns a list of write problems"""
+    problems = []
+    version = storage.get_data_version()
+    if storage.insert_cases(FIXTURE[:-1]) != len(FIXTURE) - 1:
+        problems.append('insert_cases did not report the rows written')
+    since = storage.get_data_version()
+    if not storage.add_new_case(dict(zip(('country', 'date', 'confirmed', 'deaths', 'recovered',
+                                          'active'), FIXTURE[-1]))):
+        problems.append('add_new_case failed')
+    if not storage.get_data_version() > version:
+        problems.append('data version did not grow after writes')
+    # Versions are numbered per backend, so the feed is checked here rather than against sqlite
+    changes = storage.get_changes(since)
+    if changes['reset'] or [(row['country'], row['date'], row['active'], row['deleted'])
+                            for row in changes['changes']] != [('Atlantis', '2020-03-05', 2, False)]:
+        problems.append(f'get_changes did not return just the row added since, got {changes!r}')
+    if not storage.get_changes()['reset']:
+        problems.append('get_changes() without a version did not ask for a full resync')
+    storage.refresh_rollups()
+    return problems
+
+
+def run(backends=BACKENDS):
+    """Check every backend, returns {backend: (failures, seconds)}"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        reference = _create('sqlite', os.path.join(directory, 'reference'))
+        _write(reference)
+        expected_by_reference = {name: read(reference) for name, read, _ in CHECKS}
+
+        for backend in backends:
+            started = time.perf_counter()
+            storage = _create(backend, os.path.join(directory, backend))
+            failures = _write(storage)
+            for name, read, expected in CHECKS:
+                try:
+                    actual = read(storage)
+                except Exception as e:
+                    failures.append(f'{name}: raised {e!r}')
+                    continue
+                if expected is not None and actual != expected:
+                    failures.append(f'{name}: expected {expected!r}, got {actual!r}')
+                elif actual != expected_by_reference[name]:
+                    failures.append(f'{name}: differs from sqlite, got {actual!r}')
+            results[backend] = (failures, time.perf_counter() - started)
+    return results
+
+
+if __name__ == "__main__":
+    backends = sys.argv[1:] or BACKENDS
+    results = run(backends)
+    for backend, (failures, seconds) in results.items():
+        status = 'PASS' if not failures else 'FAIL'
+        print(f"{status} {backend:<10} {len(CHECKS) - len(failures)}/{len(CHECKS)} checks "
+              f"in {seconds * 1000:.1f} ms")
+        for failure in failures:
+            print(f"     - {failure}")
+    sys.exit(1 if any(failures for failures, _ in results.values()) else 0)
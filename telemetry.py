@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Process metrics in the Prometheus text format
+
+A small dependency-free registry of counters, gauges and histograms.
+instrument_app() wraps a Flask app so every request updates per-route
+counters, latency and response size histograms and the in-flight gauge;
+render() returns everything, plus the query_stats database timings, in
+the text exposition format served by /api/metrics.
+
+The request middleware times itself: telemetry_collection_seconds_total
+divided by http_requests_total is the collection overhead per request.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds and response size buckets in bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Statements exported with their own labels, the most expensive first
+TOP_STATEMENTS = 20
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), lock=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        # Metrics updated together can share one lock
+        self._lock = lock or threading.Lock()
+        _registry.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self._header()
+        for labels, value in values:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _add(self, labels, amount):
+        """inc() for callers already holding the lock"""
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._add(labels, amount)
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    @contextmanager
+    def track(self, *labels, amount=1):
+        """Add `amount` for the duration of a with block"""
+        self.inc(*labels, amount=amount)
+        try:
+            yield
+        finally:
+            self.dec(*labels, amount=amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, lock=None):
+        super().__init__(name, documentation, labelnames, lock)
+        self.buckets = tuple(buckets)
+
+    def _observe(self, value, labels):
+        """observe() for callers already holding the lock"""
+        entry = self._values.get(labels)
+        if entry is None:
+            # Per-bucket counts (last one is +Inf), then the sum
+            entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def observe(self, value, *labels):
+        with self._lock:
+            self._observe(value, labels)
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        lines = self._header()
+        for labels, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(entry[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+# ----- Metrics updated across the app -----
+
+# The request metrics are all updated under one lock
+_request_lock = threading.Lock()
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                        ('route', 'method', 'status'), _request_lock)
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency by route',
+                         ('route', 'method'), lock=_request_lock)
+HTTP_RESPONSE_SIZE = Histogram('http_response_size_bytes', 'HTTP response body size by route',
+                               ('route', 'method'), SIZE_BUCKETS, _request_lock)
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being served', (), _request_lock)
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by cache and result (hit or miss)',
+                         ('cache', 'result'))
+BCRYPT_QUEUE = Gauge('bcrypt_queue_depth', 'Passwords waiting for or being hashed/checked with bcrypt')
+BCRYPT_LATENCY = Histogram('bcrypt_duration_seconds', 'Time per bcrypt hash or check', ('operation',),
+                           (0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0))
+COLLECTION_SECONDS = Counter('telemetry_collection_seconds_total',
+                             'Time spent recording request metrics', (), _request_lock)
+
+
+def count_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+def get_cache_stats():
+    """Hits, misses and hit rate of each cache"""
+    with CACHE_REQUESTS._lock:
+        values = dict(CACHE_REQUESTS._values)
+    stats = {}
+    for (cache, result), count in sorted(values.items()):
+        stats.setdefault(cache, {'hits': 0, 'misses': 0})['hits' if result == 'hit' else 'misses'] = count
+    for counts in stats.values():
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / lookups if lookups else None
+    return stats
+
+
+class MetricsMiddleware:
+    """WSGI middleware recording request metrics around a Flask app
+
+    Runs outside Flask, only a before_request hook reads the matched
+    route template and leaves it in the environ.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        response = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = (status, headers)
+            return start_response(status, headers, exc_info)
+
+        with _request_lock:
+            HTTP_IN_FLIGHT._add((), 1)
+        try:
+            return self.wsgi_app(environ, capture)
+        finally:
+            finished = time.perf_counter()
+            route = environ.get('telemetry.route', 'unmatched')
+            method = environ.get('REQUEST_METHOD', '')
+            status, headers = response or ('500', ())
+            size = next((value for name, value in headers if name == 'Content-Length'), None)
+            labels = (route, method)
+            with _request_lock:
+                HTTP_IN_FLIGHT._add((), -1)
+                HTTP_REQUESTS._add((route, method, status[:3]), 1)
+                HTTP_LATENCY._observe(finished - started, labels)
+                if size is not None:
+                    HTTP_RESPONSE_SIZE._observe(int(size), labels)
+                # Only the part after the app is timed, the setup above is a few dict operations
+                COLLECTION_SECONDS._add((), environ.get('telemetry.overhead', 0) + time.perf_counter() - finished)
+
+
+def instrument_app(app):
+    """Record request metrics for every request a Flask app serves"""
+    from flask import request
+
+    @app.before_request
+    def _tag_route():
+        started = time.perf_counter()
+        current = request._get_current_object()
+        if current.url_rule is not None:
+            current.environ['telemetry.route'] = current.url_rule.rule
+        current.environ['telemetry.overhead'] = time.perf_counter() - started
+
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+    return app
+
+
+def _database_lines():
+    """Connection and query metrics from query_stats"""
+    import query_stats
+
+    lines = []
+    pool = query_stats.get_connection_stats()
+    for name, kind, documentation, key in (
+            ('db_connections_opened_total', 'counter', 'SQLite connections opened', 'opened'),
+            ('db_connections_open', 'gauge', 'SQLite connections currently open', 'open')):
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {pool[key]}']
+
+    statements = query_stats.get_query_stats()
+    totals = query_stats.get_overall_histogram()
+    name = 'db_query_duration_seconds'
+    lines += [f'# HELP {name} Duration of every SQL statement', f'# TYPE {name} histogram']
+    cumulative = 0
+    for bound, count in totals['buckets']:
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{_number(bound)}"}} {cumulative}')
+    lines += [f'{name}_sum {_number(totals["sum"])}', f'{name}_count {cumulative}']
+
+    for name, key, documentation, scale in (
+            ('db_statement_calls_total', 'count', 'Calls of the most expensive statements', 1),
+            ('db_statement_seconds_total', 'total_ms', 'Time in the most expensive statements', 1000),
+            ('db_statement_rows_total', 'rows', 'Rows returned by the most expensive statements', 1)):
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} counter']
+        for row in statements[:TOP_STATEMENTS]:
+            value = row[key] / scale if scale != 1 else row[key]
+            lines.append(f'{name}{_labels(("statement",), (row["query"][:200],))} {_number(value)}')
+    return lines
+
+
+def render(extra=()):
+    """Every metric in the Prometheus text format
+
+    extra holds (name, kind, documentation, value) gauges or counters
+    computed at scrape time.
+    """
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for name, kind, documentation, value in extra:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}', f'{name} {_number(value)}']
+    lines += _database_lines()
+    return '\n'.join(lines) + '\n'
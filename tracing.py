@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Request tracing for the Flask API
+
+While tracing is enabled every request gets a correlation ID (taken from a
+valid X-Request-ID header or generated, and echoed back in X-Request-ID)
+and is split into spans: JSON parsing and serialization, each call into the
+case and user databases, and every SQL statement run by query_stats. The
+spans are summed up per stage in a Server-Timing response header, which
+browser dev tools show next to the request.
+
+A sampled share of the requests is appended to a trace file in the Chrome
+Trace Event Format (a JSON array of complete 'X' events), which opens in
+chrome://tracing, Perfetto or speedscope.
+
+Tracing is off unless TRACING=1 and is toggled at runtime with enable()
+and disable() (POST /api/tracing). When it is off nothing of it is left in
+the request path: the database methods, the JSON provider and the
+query_stats hook are only swapped in by enable(), and the WSGI middleware
+only checks a flag.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+
+import query_stats
+
+ENABLED = False
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01))
+TRACE_FILE = os.environ.get('TRACE_FILE', 'data/traces.json')
+
+# Incoming correlation IDs are reused only when they look like one
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+
+_current = ContextVar('trace', default=None)
+_file_lock = threading.Lock()
+_apps = []
+_targets = []
+_stats = {'requests': 0, 'sampled': 0}
+
+
+class Trace:
+    """Spans of one request, as (name, started, seconds, depth, args) tuples"""
+
+    __slots__ = ('request_id', 'started', 'spans', 'depth', 'sampled')
+
+    def __init__(self, request_id, sampled):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+        self.sampled = sampled
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'args', 'started', 'depth')
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.depth = self.trace.depth
+        self.trace.depth += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        self.trace.depth -= 1
+        self.trace.spans.append((self.name, self.started, seconds, self.depth, self.args))
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Context manager timing a block as a span of the current request, if it is traced"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, args)
+
+
+def current_request_id():
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+
+def _sql_span(query, started, seconds, rows):
+    """query_stats.span_hook: one span per finished statement"""
+    trace = _current.get()
+    if trace is not None:
+        trace.spans.append(('sql', started, seconds, trace.depth, {'query': query, 'rows': rows}))
+
+
+def _traced_method(method, name):
+    def traced(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return method(*args, **kwargs)
+        with _Span(trace, name, {}):
+            return method(*args, **kwargs)
+    traced.__name__ = method.__name__
+    traced.__doc__ = method.__doc__
+    return traced
+
+
+def server_timing(trace, total):
+    """Server-Timing header value: time per top-level stage, all SQL, the rest and the total"""
+    stages = {}
+    sql_seconds = 0.0
+    queries = 0
+    for name, _, seconds, depth, _ in trace.spans:
+        if name == 'sql':
+            sql_seconds += seconds
+            queries += 1
+        if depth == 0:
+            stage = name.split('.', 1)[0]
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    other = total - sum(stages.values())
+    stages.pop('sql', None)
+
+    metrics = [f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in stages.items()]
+    if queries:
+        metrics.append(f'sql;dur={sql_seconds * 1000:.3f};desc="{queries} queries"')
+    metrics.append(f'app;dur={max(other, 0) * 1000:.3f}')
+    metrics.append(f'total;dur={total * 1000:.3f}')
+    return ', '.join(metrics)
+
+
+def _events(trace, total, environ, status):
+    """The trace as Chrome Trace Event Format complete events, timestamps in microseconds"""
+    pid = os.getpid()
+    tid = threading.get_ident()
+    request = {
+        'request_id': trace.request_id,
+        'method': environ.get('REQUEST_METHOD', ''),
+        'path': environ.get('PATH_INFO', ''),
+        'query': environ.get('QUERY_STRING', ''),
+        'status': status
+    }
+    route = environ.get('telemetry.route', environ.get('PATH_INFO', ''))
+    events = [{'name': f"{request['method']} {route}", 'cat': 'request', 'ph': 'X', 'pid': pid,
+               'tid': tid, 'ts': trace.started * 1e6, 'dur': total * 1e6, 'args': request}]
+    for name, started, seconds, _, args in trace.spans:
+        events.append({'name': name, 'cat': name.split('.', 1)[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                       'ts': started * 1e6, 'dur': seconds * 1e6,
+                       'args': dict(args, request_id=trace.request_id)})
+    return events
+
+
+def write_trace(events, path=None):
+    """Append events to the trace file, starting the JSON array if the file is new
+
+    The array is left open, as the format allows, so appends stay cheap.
+    """
+    path = path or TRACE_FILE
+    lines = ''.join(json.dumps(event, default=str) + ',\n' for event in events)
+    with _file_lock:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            if f.tell() == 0:
+                f.write('[\n')
+            f.write(lines)
+
+
+def read_trace(path=None):
+    """Events of a trace file written by write_trace()"""
+    with open(path or TRACE_FILE) as f:
+        text = f.read().rstrip().rstrip(',')
+    return json.loads(text if text.endswith(']') else text + ']')
+
+
+class TracingMiddleware:
+    """WSGI middleware starting a trace per request while tracing is enabled"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not ENABLED:
+            return self.wsgi_app(environ, start_response)
+
+        request_id = environ.get('HTTP_X_REQUEST_ID', '')
+        if not _REQUEST_ID.fullmatch(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        environ['tracing.request_id'] = request_id
+        trace = Trace(request_id, random.random() < SAMPLE_RATE)
+        token = _current.set(trace)
+
+        def traced_start_response(status, headers, exc_info=None):
+            total = time.perf_counter() - trace.started
+            headers.append(('X-Request-ID', request_id))
+            headers.append(('Server-Timing', server_timing(trace, total)))
+            _stats['requests'] += 1
+            if trace.sampled:
+                _stats['sampled'] += 1
+                try:
+                    write_trace(_events(trace, total, environ, int(status[:3])))
+                except OSError as e:
+                    print(f"Error writing trace: {e}")
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, traced_start_response)
+        finally:
+            _current.reset(token)
+
+
+def _traced_json_provider(app):
+    """app.json with parse and serialize spans around loads() and response()"""
+    provider = app.json
+
+    class TracedJSONProvider(type(provider)):
+        def loads(self, s, **kwargs):
+            with span('parse'):
+                return super().loads(s, **kwargs)
+
+        def response(self, *args, **kwargs):
+            with span('serialize'):
+                return super().response(*args, **kwargs)
+
+    traced = TracedJSONProvider(app)
+    traced.__dict__.update(provider.__dict__)
+    return traced
+
+
+def instrument_app(app, **targets):
+    """Make a Flask app traceable, targets maps a span prefix to a database object
+
+        tracing.instrument_app(app, covid=covid_db, auth=user_db)
+    """
+    _apps.append([app, app.json, None])
+    _targets.extend((prefix, target) for prefix, target in targets.items())
+    app.wsgi_app = TracingMiddleware(app.wsgi_app)
+    if ENABLED:
+        _install()
+    return app
+
+
+def _install():
+    for entry in _apps:
+        app, provider, traced = entry
+        if traced is None:
+            traced = entry[2] = _traced_json_provider(app)
+        app.json = traced
+    for prefix, target in _targets:
+        for name in dir(type(target)):
+            method = getattr(target, name)
+            if not name.startswith('_') and callable(method) and name not in vars(target):
+                setattr(target, name, _traced_method(method, f'{prefix}.{name}'))
+    query_stats.span_hook = _sql_span
+
+
+def _uninstall():
+    query_stats.span_hook = None
+    for app, provider, _ in _apps:
+        app.json = provider
+    for _, target in _targets:
+        for name in list(vars(target)):
+            if getattr(vars(target)[name], '__qualname__', '').startswith('_traced_method'):
+                delattr(target, name)
+
+
+def enable(sample_rate=None, trace_file=None):
+    """Turn tracing on, optionally changing the sampled share and the trace file"""
+    global ENABLED, SAMPLE_RATE, TRACE_FILE
+    if sample_rate is not None:
+        if not 0 <= float(sample_rate) <= 1:
+            raise ValueError('sample_rate must be between 0 and 1')
+        SAMPLE_RATE = float(sample_rate)
+    if trace_file:
+        TRACE_FILE = trace_file
+    if not ENABLED:
+        _install()
+        ENABLED = True
+
+
+def disable():
+    global ENABLED
+    if ENABLED:
+        ENABLED = False
+        _uninstall()
+
+
+def get_status():
+    return {
+        'enabled': ENABLED,
+        'sample_rate': SAMPLE_RATE,
+        'trace_file': TRACE_FILE,
+        'requests': _stats['requests'],
+        'sampled': _stats['sampled']
+    }
+
+
+if os.environ.get('TRACING') == '1':
+    ENABLED = True